@@ -0,0 +1,318 @@
+import datetime
+import logging
+import os
+
+import numpy as np
+
+from history import (
+    REASON_BOTH,
+    REASON_TEMPERATURE,
+    REASON_WEATHER,
+    REASONS,
+    advantage_codes,
+    align_pair,
+    encode_observation,
+    load_history,
+    run_lengths,
+)
+
+logger = logging.getLogger("weathermark.calendar")
+
+# Calendars are kept in this subdirectory of the history directory
+CALENDAR_SUBDIR = "calendar"
+
+# One bit per day of the year (day 0 is 1 January, UTC)
+YEAR_DAYS = 366
+YEAR_BYTES = (YEAR_DAYS + 7) // 8
+
+# Bitmap rows of a year: days the pair was compared at all, then days with
+# at least one run of each reason
+ROW_OBSERVED = 0
+ROWS = {
+    REASON_WEATHER: 1,
+    REASON_TEMPERATURE: 2,
+    REASON_BOTH: 3,
+}
+
+# One record per pair and year, ~190 bytes however many runs it covers
+CALENDAR_DTYPE = np.dtype([("year", "<i2"), ("bits", "u1", (4, YEAR_BYTES))])
+
+
+def calendar_path(our_city, their_city, directory):
+    """Return the path of the calendar file for a city pair"""
+    slugs = [city.strip().lower().replace(" ", "_") for city in (our_city, their_city)]
+    return os.path.join(directory, CALENDAR_SUBDIR, f"{slugs[0]}__{slugs[1]}.cal")
+
+
+def load_calendar(our_city, their_city, directory):
+    """
+    Read the calendar of a city pair
+
+    Returns:
+        dict: Year -> (4, YEAR_BYTES) uint8 bitmaps (empty if there is none)
+    """
+    path = calendar_path(our_city, their_city, directory)
+    try:
+        records = np.fromfile(path, dtype=CALENDAR_DTYPE)
+    except (OSError, ValueError):
+        return {}
+    return {int(record["year"]): record["bits"].copy() for record in records}
+
+
+def save_calendar(our_city, their_city, directory, calendar):
+    """Write the calendar of a city pair (atomically)"""
+    path = calendar_path(our_city, their_city, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    records = np.zeros(len(calendar), dtype=CALENDAR_DTYPE)
+    for i, year in enumerate(sorted(calendar)):
+        records[i] = (year, calendar[year])
+    temp_path = f"{path}.tmp"
+    records.tofile(temp_path)
+    os.replace(temp_path, path)
+
+
+def day_of_year(ts):
+    """
+    Convert run timestamps to (year, day of year) in UTC
+
+    Args:
+        ts: Seconds since the epoch (scalar or array)
+
+    Returns:
+        tuple: (years, days) integer arrays, days counted from 0
+    """
+    times = np.asarray(ts, dtype=np.int64).astype("datetime64[s]")
+    years = times.astype("datetime64[Y]")
+    days = (times.astype("datetime64[D]") - years).astype(np.int64)
+    return years.astype(np.int64) + 1970, days
+
+
+def mark(calendar, ts, codes):
+    """
+    Set the bits of runs in a calendar
+
+    Args:
+        calendar: Calendar from load_calendar (updated in place)
+        ts: Run timestamps
+        codes: REASON_* code of each run
+    """
+    years, days = day_of_year(ts)
+    codes = np.asarray(codes)
+    for year in np.unique(years):
+        bits = calendar.setdefault(int(year), np.zeros((4, YEAR_BYTES), np.uint8))
+        in_year = years == year
+        for row, selected in [(ROW_OBSERVED, in_year)] + [
+            (ROWS[code], in_year & (codes == code)) for code in ROWS
+        ]:
+            day = days[selected]
+            np.bitwise_or.at(bits[row], day >> 3, (1 << (day & 7)).astype(np.uint8))
+
+
+def update_calendar(our_city, their_city, directory, ts, codes):
+    """Add runs to the stored calendar of a city pair"""
+    calendar = load_calendar(our_city, their_city, directory)
+    mark(calendar, ts, codes)
+    save_calendar(our_city, their_city, directory, calendar)
+
+
+def record_run(pairs, weather, directory, ts, min_temp, max_temp, comfort=None):
+    """
+    Add one run's observations to the calendars of its pairs
+
+    Args:
+        pairs: (our_city, their_city) pairs compared in the run
+        weather: City -> weather data fetched in the run
+        directory: History directory
+        ts: Run timestamp
+        min_temp: Minimum comfortable temperature
+        max_temp: Maximum comfortable temperature
+        comfort: comfort.ComfortTable to judge comfort with (optional)
+
+    Returns:
+        int: Number of calendars updated
+    """
+    pairs = [pair for pair in pairs if weather.get(pair[0]) and weather.get(pair[1])]
+    if not pairs:
+        return 0
+
+    records = {}
+    for pair in pairs:
+        for city in pair:
+            if city not in records:
+                records[city] = encode_observation(weather[city], ts)
+    ours = np.concatenate([records[our_city] for our_city, _ in pairs])
+    theirs = np.concatenate([records[their_city] for _, their_city in pairs])
+
+    our_comfortable = their_comfortable = None
+    if comfort is not None:
+        our_comfortable = comfort.comfortable_records(
+            ours,
+            comfort.rows([our_city for our_city, _ in pairs]),
+            [weather[our_city].get("timezone") or 0 for our_city, _ in pairs],
+        )
+        their_comfortable = comfort.comfortable_records(
+            theirs,
+            comfort.rows([their_city for _, their_city in pairs]),
+            [weather[their_city].get("timezone") or 0 for _, their_city in pairs],
+        )
+    codes = advantage_codes(
+        ours, theirs, min_temp, max_temp, our_comfortable, their_comfortable
+    )
+
+    for (our_city, their_city), code in zip(pairs, codes):
+        try:
+            update_calendar(our_city, their_city, directory, [ts], [code])
+        except OSError as e:
+            logger.error(
+                f"Failed to update calendar of {our_city} vs {their_city}: {e}"
+            )
+    return len(pairs)
+
+
+def rebuild_calendar(our_city, their_city, directory, min_temp, max_temp, comfort=None):
+    """
+    Recompute the calendar of a city pair from its full history
+
+    Takes the same comfort settings as record_run.
+
+    Returns:
+        int: Number of aligned runs in the history
+    """
+    ours = load_history(our_city, directory)
+    theirs = load_history(their_city, directory)
+    our_index, their_index = align_pair(ours, theirs)
+    ours, theirs = ours[our_index], theirs[their_index]
+
+    our_comfortable = their_comfortable = None
+    if comfort is not None:
+        our_comfortable = comfort.comfortable_records(ours, comfort.row(our_city))
+        their_comfortable = comfort.comfortable_records(theirs, comfort.row(their_city))
+    codes = advantage_codes(
+        ours, theirs, min_temp, max_temp, our_comfortable, their_comfortable
+    )
+
+    calendar = {}
+    mark(calendar, ours["ts"], codes)
+    save_calendar(our_city, their_city, directory, calendar)
+    return len(codes)
+
+
+def year_length(year):
+    return (datetime.date(year + 1, 1, 1) - datetime.date(year, 1, 1)).days
+
+
+def range_mask(year, start=None, end=None):
+    """
+    Bitmap of the days of a year with start <= day < end
+
+    Args:
+        year: Calendar year
+        start: First datetime.date to include (default: no lower bound)
+        end: datetime.date to stop before (default: no upper bound)
+
+    Returns:
+        numpy.ndarray: YEAR_BYTES packed bits
+    """
+    length = year_length(year)
+    first_ordinal = datetime.date(year, 1, 1).toordinal()
+    first = 0 if start is None else start.toordinal() - first_ordinal
+    last = length if end is None else end.toordinal() - first_ordinal
+
+    days = np.zeros(YEAR_BYTES * 8, dtype=bool)
+    days[min(max(first, 0), length) : min(max(last, 0), length)] = True
+    return np.packbits(days, bitorder="little")
+
+
+def masked(calendar, start=None, end=None):
+    """Yield (year, bitmaps restricted to the range) in year order"""
+    for year in sorted(calendar):
+        if (start is not None and year < start.year) or (
+            end is not None and year > end.year
+        ):
+            continue
+        yield year, calendar[year] & range_mask(year, start, end)
+
+
+def day_advantage(our_city, their_city, directory, date):
+    """
+    Look up one day of a city pair
+
+    Returns:
+        dict: observed (the pair was compared that day), won and whether a
+              run that day had each reason
+    """
+    bits = load_calendar(our_city, their_city, directory).get(date.year)
+    day = date.timetuple().tm_yday - 1
+
+    def is_set(row):
+        return bits is not None and bool(bits[row, day >> 3] >> (day & 7) & 1)
+
+    result = {"observed": is_set(ROW_OBSERVED)}
+    for code, row in ROWS.items():
+        result[REASONS[code]] = is_set(row)
+    result["won"] = any(result[REASONS[code]] for code in ROWS)
+    return result
+
+
+def calendar_win_rate(our_city, their_city, directory, start=None, end=None):
+    """
+    Count the days our city had the advantage over their city
+
+    Same shape as history.win_rate, with days instead of runs.
+
+    Returns:
+        dict: Days compared, days won, win rate and days per reason
+    """
+    counts = {"days": 0, "wins": 0}
+    counts.update({REASONS[code]: 0 for code in ROWS})
+    for _, bits in masked(load_calendar(our_city, their_city, directory), start, end):
+        counts["days"] += int(np.bitwise_count(bits[ROW_OBSERVED]).sum())
+        wins = np.bitwise_or.reduce(bits[1:], axis=0)
+        counts["wins"] += int(np.bitwise_count(wins).sum())
+        for code, row in ROWS.items():
+            counts[REASONS[code]] += int(np.bitwise_count(bits[row]).sum())
+
+    counts["win_rate"] = counts["wins"] / counts["days"] if counts["days"] else 0.0
+    return counts
+
+
+def calendar_streaks(our_city, their_city, directory, start=None, end=None):
+    """
+    Measure winning streaks in days (consecutive days with any advantage)
+
+    Returns:
+        dict: Longest streak, current streak (ending on the last day the
+              pair was compared) and number of streaks
+    """
+    wins = []
+    observed = []
+    previous = None
+    for year, bits in masked(
+        load_calendar(our_city, their_city, directory), start, end
+    ):
+        if previous is not None and year != previous + 1:
+            # A year without any comparison breaks every streak
+            wins.append(np.zeros(1, dtype=np.uint8))
+            observed.append(np.zeros(1, dtype=np.uint8))
+        count = year_length(year)
+        year_wins = np.bitwise_or.reduce(bits[1:], axis=0)
+        wins.append(np.unpackbits(year_wins, count=count, bitorder="little"))
+        observed.append(
+            np.unpackbits(bits[ROW_OBSERVED], count=count, bitorder="little")
+        )
+        previous = year
+
+    if not wins:
+        return {"longest": 0, "current": 0, "count": 0}
+
+    wins = np.concatenate(wins).astype(bool)
+    observed = np.flatnonzero(np.concatenate(observed))
+    lengths = run_lengths(wins)
+    last = observed[-1] if len(observed) else -1
+    return {
+        "longest": int(lengths.max()) if len(lengths) else 0,
+        "current": (
+            int(run_lengths(wins[: last + 1])[-1]) if last >= 0 and wins[last] else 0
+        ),
+        "count": int(len(lengths)),
+    }
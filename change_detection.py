@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger("weathermark.state")
+
+
+def observation_signature(weather_data):
+    """
+    Reduce an observation to the inputs that can change a comparison
+
+    Returns:
+        list: [OWM dt, condition ID, rounded temperature] or None if no data
+    """
+    if not weather_data:
+        return None
+
+    conditions = weather_data.get("weather") or [{}]
+    temp = weather_data.get("main", {}).get("temp")
+    return [
+        weather_data.get("dt"),
+        conditions[0].get("id"),
+        round(temp) if temp is not None else None,
+    ]
+
+
+def pair_key(our_city, their_city):
+    """Return the state key for a city pair"""
+    return f"{our_city}|{their_city}"
+
+
+def load_state(state_file):
+    """
+    Load the last evaluated state of every pair
+
+    Returns:
+        dict: Pair key -> state entry (empty if the file is missing or invalid)
+    """
+    try:
+        with open(state_file, "r") as f:
+            state = json.load(f)
+        if isinstance(state, dict):
+            return state
+        logger.warning(f"Ignoring invalid state file {state_file}")
+    except FileNotFoundError:
+        logger.debug(f"No state file at {state_file}")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read state file {state_file}: {e}")
+    return {}
+
+
+def save_state(state_file, state):
+    """
+    Write the state atomically so an interrupted run can't corrupt it
+
+    Returns:
+        bool: Success status
+    """
+    tmp_file = f"{state_file}.tmp"
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, state_file)
+        return True
+    except OSError as e:
+        logger.error(f"Failed to save state file {state_file}: {e}")
+        return False
+
+
+def inputs_changed(entry, our_signature, their_signature, comfort_range):
+    """
+    Check whether any input of a pair differs from its last evaluation
+
+    A pair with a pending advantage counts as changed, so it's evaluated
+    again until the advantage has been sent.
+    """
+    if not entry or entry.get("pending"):
+        return True
+
+    return (
+        entry.get("our") != our_signature
+        or entry.get("their") != their_signature
+        or entry.get("comfort") != list(comfort_range)
+    )
+
+
+def advantage_flipped(entry, reason):
+    """
+    Check whether an advantage is new since the last evaluation
+
+    An advantage held back by the cooldown stays pending, so it still
+    counts as new until it has been sent.
+    """
+    return entry.get("reason") != reason or entry.get("pending") == reason
+
+
+def cooldown_active(entry, now, cooldown):
+    """Check whether a notification for the pair was sent within the cooldown"""
+    notified_at = entry.get("notified_at")
+    return notified_at is not None and now - notified_at < cooldown
+
+
+def should_notify(entry, reason, now, cooldown, dedup_window):
+    """
+    Decide whether a freshly evaluated advantage should be sent
+
+    A notification is only sent when the advantage flipped since the last
+    evaluation. It is then held back if any notification for the pair was
+    sent within the cooldown (and sent once the cooldown is over, see
+    record_evaluation), or dropped if the same reason was sent within the
+    dedup window.
+
+    Args:
+        entry: Previous state entry for the pair (or None)
+        reason: Newly computed advantage reason (or None)
+        now: Current time (seconds since epoch)
+        cooldown: Minimum seconds between notifications for the pair
+        dedup_window: Seconds during which an identical reason is not resent
+
+    Returns:
+        bool: True if construct_message and the senders should run
+    """
+    if not reason:
+        return False
+    if not entry:
+        return True
+    if not advantage_flipped(entry, reason):
+        logger.debug(f"Advantage unchanged ({reason}) - not notifying again")
+        return False
+
+    notified_at = entry.get("notified_at")
+    if notified_at is None:
+        return True
+    if cooldown_active(entry, now, cooldown):
+        logger.info(
+            f"Notification cooldown active ({int(cooldown - (now - notified_at))}s left)"
+        )
+        return False
+    if entry.get("notified_reason") == reason and now - notified_at < dedup_window:
+        logger.info(f"Already notified about {reason} advantage recently")
+        return False
+    return True
+
+
+def update_entry(
+    entry,
+    our_signature,
+    their_signature,
+    comfort_range,
+    reason,
+    notified,
+    now=None,
+    pending=None,
+):
+    """
+    Record the result of an evaluation
+
+    Args:
+        pending: Advantage held back by the cooldown, to send once it's over
+
+    Returns:
+        dict: The updated state entry
+    """
+    now = now if now is not None else time.time()
+    entry = dict(entry or {})
+    entry.update(
+        {
+            "our": our_signature,
+            "their": their_signature,
+            "comfort": list(comfort_range),
+            "reason": reason,
+            "evaluated_at": now,
+        }
+    )
+    if notified:
+        entry["notified_reason"] = reason
+        entry["notified_at"] = now
+    if pending:
+        entry["pending"] = pending
+    else:
+        entry.pop("pending", None)
+    return entry
+
+
+def pair_changed(
+    state, our_city, their_city, our_weather, their_weather, comfort_range
+):
+    """Check whether a pair needs evaluating against the stored state"""
+    return inputs_changed(
+        state.get(pair_key(our_city, their_city)),
+        observation_signature(our_weather),
+        observation_signature(their_weather),
+        comfort_range,
+    )
+
+
+def record_evaluation(
+    state,
+    our_city,
+    their_city,
+    our_weather,
+    their_weather,
+    comfort_range,
+    reason,
+    settings,
+    now=None,
+):
+    """
+    Store a pair's evaluation and decide whether to notify about it
+
+    An advantage held back by the cooldown is kept pending and sent by the
+    first evaluation after the cooldown that still finds it.
+
+    Args:
+        state: Change detection state (updated in place)
+        our_city: Name of our city
+        their_city: Name of their city
+        our_weather: Weather data for our city
+        their_weather: Weather data for their city
+        comfort_range: comfort.comfort_signature() used for the evaluation
+        reason: Advantage reason (or None)
+        settings: The [notifications] config section
+        now: Current time (default: now)
+
+    Returns:
+        bool: True if construct_message and the senders should run
+    """
+    now = now if now is not None else time.time()
+    key = pair_key(our_city, their_city)
+    entry = state.get(key)
+    cooldown = settings["cooldown_minutes"] * 60
+    send = should_notify(
+        entry, reason, now, cooldown, settings["dedup_window_minutes"] * 60
+    )
+    pending = None
+    if (
+        reason
+        and not send
+        and entry
+        and advantage_flipped(entry, reason)
+        and cooldown_active(entry, now, cooldown)
+    ):
+        pending = reason
+    state[key] = update_entry(
+        entry,
+        observation_signature(our_weather),
+        observation_signature(their_weather),
+        comfort_range,
+        reason,
+        send,
+        now,
+        pending,
+    )
+    return send
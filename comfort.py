@@ -0,0 +1,313 @@
+import hashlib
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger("weathermark.comfort")
+
+# Comfort limits stored for every (profile, month) cell of the table
+THRESHOLD_DTYPE = np.dtype(
+    [
+        ("min", "<f8"),
+        ("max", "<f8"),
+        ("max_humidity", "<f8"),
+        ("max_wind_speed", "<f8"),
+    ]
+)
+
+# Months (1-12) of each southern hemisphere season
+SEASON_MONTHS = {
+    "summer": (12, 1, 2),
+    "autumn": (3, 4, 5),
+    "winter": (6, 7, 8),
+    "spring": (9, 10, 11),
+}
+
+# Observation field compared against min/max for each measure
+MEASURES = ("temp", "feels_like")
+
+
+def season_months(season, hemisphere="south"):
+    """Return the months (1-12) of a season in the given hemisphere"""
+    months = SEASON_MONTHS[season]
+    if hemisphere == "north":
+        months = tuple((month + 5) % 12 + 1 for month in months)
+    return months
+
+
+def local_months(times, utc_offsets=0):
+    """
+    Return the local months (1-12) of many timestamps
+
+    Args:
+        times: Seconds since epoch (array)
+        utc_offsets: Seconds east of UTC, per timestamp or one for all
+                     (the timezone field of OpenWeatherMap responses)
+
+    Returns:
+        numpy.ndarray: Month of each timestamp
+    """
+    local = np.asarray(times, dtype=np.int64) + np.asarray(utc_offsets, dtype=np.int64)
+    return (
+        local.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64) % 12 + 1
+    )
+
+
+def observation_month(weather_data):
+    """
+    Return the month (1-12) of an observation in its city's local time
+
+    The dt of the observation picks the month (now if it has none), shifted
+    by the timezone offset of the response.
+    """
+    dt = weather_data.get("dt") or time.time()
+    return time.gmtime(dt + (weather_data.get("timezone") or 0)).tm_mon
+
+
+def _apply(cells, profile, months=range(1, 13)):
+    """Override the limits of the given months with a profile's settings"""
+    for field in THRESHOLD_DTYPE.names:
+        if field in profile:
+            value = float(profile[field])
+            # 0 (or less) means no limit for humidity and wind
+            if field.startswith("max_") and value <= 0:
+                value = np.inf
+            for month in months:
+                cells[month - 1][field] = value
+
+
+class ComfortTable:
+    """
+    Comfort thresholds compiled into a flat (profile, month) lookup table
+
+    Row 0 is the default profile; each city with its own settings gets a
+    row. Season and city overrides are resolved once when the table is
+    built, so checking an observation is a row lookup and a few
+    comparisons, and whole arrays of records are checked at once.
+    """
+
+    def __init__(self, table, city_rows, measure="temp"):
+        self.table = table
+        self.city_rows = city_rows
+        self.measure = measure
+        self._digest = None
+
+    def digest(self):
+        """
+        Return a short digest of every threshold, profile and the measure
+
+        Any edit to [temperature] or [comfort] that can change a comparison
+        changes the digest.
+        """
+        if self._digest is None:
+            h = hashlib.blake2b(digest_size=8)
+            h.update(self.measure.encode())
+            h.update(repr(sorted(self.city_rows.items())).encode())
+            h.update(np.ascontiguousarray(self.table).tobytes())
+            self._digest = h.hexdigest()
+        return self._digest
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Compile the [temperature] and [comfort] settings
+
+        Precedence, lowest first: [temperature] range, [comfort] limits,
+        [comfort.seasons], [comfort.cities.<city>] and finally
+        [comfort.cities.<city>.<season>].
+        """
+        settings = config.get("comfort", {})
+        measure = settings.get("measure", "temp")
+        if measure not in MEASURES:
+            logger.warning(f"Unknown comfort measure {measure}, using temp")
+            measure = "temp"
+        hemisphere = settings.get("hemisphere", "south")
+        seasons = settings.get("seasons", {})
+        for season in seasons:
+            if season not in SEASON_MONTHS:
+                logger.warning(f"Ignoring unknown season {season}")
+        cities = settings.get("cities", {})
+
+        def build_row(city_settings=None):
+            cells = [dict() for _ in range(12)]
+            _apply(
+                cells,
+                {
+                    "min": config["temperature"]["min_comfortable"],
+                    "max": config["temperature"]["max_comfortable"],
+                    "max_humidity": settings.get("max_humidity", 0),
+                    "max_wind_speed": settings.get("max_wind_speed", 0),
+                },
+            )
+            for season, profile in seasons.items():
+                if season in SEASON_MONTHS:
+                    _apply(cells, profile, season_months(season, hemisphere))
+            if city_settings:
+                _apply(cells, city_settings)
+                for season in SEASON_MONTHS:
+                    if isinstance(city_settings.get(season), dict):
+                        _apply(
+                            cells,
+                            city_settings[season],
+                            season_months(season, hemisphere),
+                        )
+            return [
+                tuple(cell[field] for field in THRESHOLD_DTYPE.names) for cell in cells
+            ]
+
+        rows = [build_row()]
+        city_rows = {}
+        for city, city_settings in cities.items():
+            city_rows[city.lower()] = len(rows)
+            rows.append(build_row(city_settings))
+
+        return cls(np.array(rows, dtype=THRESHOLD_DTYPE), city_rows, measure)
+
+    def row(self, city):
+        """Return the table row of a city (0 if it has no profile)"""
+        if not city:
+            return 0
+        return self.city_rows.get(city.lower(), 0)
+
+    def rows(self, cities):
+        """Return the table rows of many cities"""
+        return np.array([self.row(city) for city in cities], dtype=np.intp)
+
+    def limits(self, city, month):
+        """
+        Return the limits for a city in a month (1-12)
+
+        Returns:
+            numpy.void: Record with min, max, max_humidity and max_wind_speed
+        """
+        return self.table[self.row(city), month - 1]
+
+    def comfort_limits(self, city, weather_data):
+        """Return the (min, max) comfortable temperature for a city's observation"""
+        limits = self.limits(city, observation_month(weather_data))
+        return float(limits["min"]), float(limits["max"])
+
+    def record_limits(self, records, rows, utc_offsets=0):
+        """
+        Look up the limits of many history records at once
+
+        Args:
+            records: Array with OBSERVATION_DTYPE fields
+            rows: Table row per record (or one row for all of them)
+            utc_offsets: Seconds east of UTC of each record's city (or one
+                         for all of them); history records don't store it,
+                         so without it months are taken in UTC
+
+        Returns:
+            numpy.ndarray: THRESHOLD_DTYPE limits per record
+        """
+        # The observation time picks the month, falling back to the run time
+        times = np.where(records["dt"] > 0, records["dt"], records["ts"])
+        return self.table[rows, local_months(times, utc_offsets) - 1]
+
+    def comfortable_records(self, records, rows, utc_offsets=0):
+        """
+        Check many history records at once
+
+        Args:
+            records: Array with OBSERVATION_DTYPE fields
+            rows: Table row per record (or one row for all of them)
+            utc_offsets: Seconds east of UTC (see record_limits)
+
+        Returns:
+            numpy.ndarray: True where the record is comfortable
+        """
+        return self.within_limits(
+            records, self.record_limits(records, rows, utc_offsets)
+        )
+
+    def within_limits(self, records, limits):
+        """
+        Check many history records against limits already looked up
+
+        Args:
+            records: Array with OBSERVATION_DTYPE fields
+            limits: THRESHOLD_DTYPE limits per record (see record_limits)
+
+        Returns:
+            numpy.ndarray: True where the record is comfortable
+        """
+        value = records[self.measure]
+        # NaN compares False, so a missing temperature is never comfortable,
+        # while missing humidity or wind never disqualifies
+        return (
+            (value >= limits["min"])
+            & (value <= limits["max"])
+            & ~(records["humidity"] > limits["max_humidity"])
+            & ~(records["wind_speed"] > limits["max_wind_speed"])
+        )
+
+    def is_comfortable(self, weather_data, city=None):
+        """
+        Check one observation against the profile of its city
+
+        Args:
+            weather_data: Weather data from the API
+            city: City the observation is for (optional)
+
+        Returns:
+            bool: True if conditions are comfortable
+        """
+        if not weather_data:
+            return False
+        main = weather_data.get("main", {})
+        value = main.get(self.measure)
+        if value is None:
+            return False
+
+        limits = self.limits(city, observation_month(weather_data))
+        humidity = main.get("humidity")
+        wind_speed = weather_data.get("wind", {}).get("speed")
+        return bool(
+            limits["min"] <= value <= limits["max"]
+            and not (humidity is not None and humidity > limits["max_humidity"])
+            and not (wind_speed is not None and wind_speed > limits["max_wind_speed"])
+        )
+
+
+def get_comfort_table(config):
+    """
+    Return the compiled comfort table of a configuration
+
+    load_config compiles it once; configurations built any other way (such
+    as DEFAULT_CONFIG itself) are compiled on every call rather than
+    modified.
+    """
+    table = config.get("comfort_table")
+    if table is None:
+        table = ComfortTable.from_config(config)
+    return table
+
+
+def comfort_limits(config, city, weather_data):
+    """
+    Return the (min, max) comfortable temperature of a city's profile
+
+    Used to describe an observation with the limits it was judged by.
+    """
+    if not weather_data:
+        return (
+            config["temperature"]["min_comfortable"],
+            config["temperature"]["max_comfortable"],
+        )
+    return get_comfort_table(config).comfort_limits(city, weather_data)
+
+
+def comfort_signature(config):
+    """
+    Reduce the comfort settings to what change detection compares
+
+    Returns:
+        tuple: (min_temp, max_temp, digest of the compiled ComfortTable)
+    """
+    return (
+        config["temperature"]["min_comfortable"],
+        config["temperature"]["max_comfortable"],
+        get_comfort_table(config).digest(),
+    )
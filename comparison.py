@@ -0,0 +1,65 @@
+from weather_api import is_rainy, is_sunny, is_temperature_comfortable
+
+
+def compare_weather(
+    our_city_weather,
+    their_city_weather,
+    min_temp,
+    max_temp,
+    comfort=None,
+    our_city=None,
+    their_city=None,
+):
+    """
+    Compare the conditions of two cities
+
+    Args:
+        our_city_weather: Weather data for our city
+        their_city_weather: Weather data for their city
+        min_temp: Minimum comfortable temperature (Celsius)
+        max_temp: Maximum comfortable temperature (Celsius)
+        comfort: comfort.ComfortTable to check comfort with instead of
+                 min_temp/max_temp (optional)
+        our_city: Name of our city, to pick its comfort profile
+        their_city: Name of their city, to pick its comfort profile
+
+    Returns:
+        dict: Individual condition checks and the advantage reason
+              ("weather", "temperature", "both" or None)
+    """
+    our_city_sunny = is_sunny(our_city_weather)
+    their_city_rainy = is_rainy(their_city_weather)
+    if comfort is not None:
+        our_temp_comfortable = comfort.is_comfortable(our_city_weather, our_city)
+        their_temp_comfortable = comfort.is_comfortable(
+            their_city_weather, their_city
+        )
+    else:
+        our_temp_comfortable = is_temperature_comfortable(
+            our_city_weather, min_temp, max_temp
+        )
+        their_temp_comfortable = is_temperature_comfortable(
+            their_city_weather, min_temp, max_temp
+        )
+
+    # Only count weather as better if we have good weather (sunny) AND they have bad weather (rainy)
+    weather_better = our_city_sunny and their_city_rainy
+
+    # Only count temperature as better if our temperature is comfortable AND theirs is not
+    temp_better = our_temp_comfortable and not their_temp_comfortable
+
+    reason = None
+    if weather_better and temp_better:
+        reason = "both"
+    elif weather_better:
+        reason = "weather"
+    elif temp_better:
+        reason = "temperature"
+
+    return {
+        "our_city_sunny": our_city_sunny,
+        "their_city_rainy": their_city_rainy,
+        "our_temp_comfortable": our_temp_comfortable,
+        "their_temp_comfortable": their_temp_comfortable,
+        "reason": reason,
+    }
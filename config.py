@@ -3,13 +3,36 @@ import tomli
 import logging
 import subprocess
 
+from comfort import ComfortTable
+
 logger = logging.getLogger("weathermark.config")
 
 # Default configuration
 DEFAULT_CONFIG = {
     "cities": {"our_city": "Brisbane", "their_city": "Melbourne"},
     "temperature": {"min_comfortable": 18, "max_comfortable": 26},
-    "message": {"signature": "WeatherMark"},
+    "comfort": {
+        "measure": "temp",
+        "hemisphere": "south",
+        "max_humidity": 0,
+        "max_wind_speed": 0,
+        "seasons": {},
+        "cities": {},
+    },
+    "polling": {"min_interval": 60, "max_interval": 3600, "grace": 30},
+    "api": {
+        "base_url": "https://api.openweathermap.org/data/2.5",
+        "country": "au",
+        "calls_per_minute": 60,
+        "cache_max_age": 600,
+        "cache_max_stale": 3600,
+        "conditional_requests": True,
+    },
+    "message": {
+        "signature": "WeatherMark",
+        "reuse_rendered": False,
+        "render_cache_size": 1024,
+    },
     "email": {
         "enabled": False,
         "from": "your_email@example.com",
@@ -18,7 +41,59 @@ DEFAULT_CONFIG = {
         "smtp_port": 587,
         "timeout": 15,
     },
-    "sms": {"enabled": False, "from_number": "+1234567890", "to_numbers": ["+1234567890"]},
+    "sms": {
+        "enabled": False,
+        "from_number": "+1234567890",
+        "to_numbers": ["+1234567890"],
+    },
+    "providers": {
+        "order": ["openweathermap"],
+        "route": False,
+        "file": "observations.json",
+        "openweathermap_cost": 0.0,
+    },
+    "delivery": {
+        "failure_threshold": 3,
+        "reset_seconds": 60,
+        "initial_concurrency": 4,
+        "max_concurrency": 16,
+        "latency_target": 2.0,
+        "outbox": ".weathermark_outbox.db",
+        "retry_seconds": 60,
+        "max_attempts": 8,
+    },
+    "history": {"enabled": False, "directory": "history", "calendar": True},
+    "pipeline": {
+        "queue_size": 100,
+        "fetch_concurrency": 10,
+        "fetch_timeout": 10,
+        "send_workers": 4,
+    },
+    "stream": {"concurrency": 16},
+    "server": {
+        "host": "127.0.0.1",
+        "port": 8080,
+        "compare_ttl": 60,
+        "observation_ttl": 60,
+    },
+    "forecast": {
+        "cache_dir": ".forecast_cache",
+        "refresh_minutes": 180,
+        "lead_minutes": 0,
+    },
+    "notifications": {
+        "change_detection": True,
+        "state_file": ".weathermark_state.json",
+        "cooldown_minutes": 60,
+        "dedup_window_minutes": 360,
+        "digest": False,
+        "digest_window_minutes": 0,
+    },
+    "subscriptions": {
+        "enabled": False,
+        "path": "subscriptions.db",
+        "chunk_size": 1000,
+    },
     "logging": {
         "level": "INFO",
         "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -71,6 +146,18 @@ def load_config(config_file="config.toml"):
                 if "temperature" in file_config:
                     config["temperature"].update(file_config["temperature"])
 
+                # Merge comfort profiles
+                if "comfort" in file_config:
+                    config["comfort"].update(file_config["comfort"])
+
+                # Merge adaptive polling settings
+                if "polling" in file_config:
+                    config["polling"].update(file_config["polling"])
+
+                # Merge API settings
+                if "api" in file_config:
+                    config["api"].update(file_config["api"])
+
                 # Merge message settings
                 if "message" in file_config:
                     config["message"].update(file_config["message"])
@@ -83,6 +170,42 @@ def load_config(config_file="config.toml"):
                 if "sms" in file_config:
                     config["sms"].update(file_config["sms"])
 
+                # Merge delivery settings
+                if "delivery" in file_config:
+                    config["delivery"].update(file_config["delivery"])
+
+                # Merge provider settings
+                if "providers" in file_config:
+                    config["providers"].update(file_config["providers"])
+
+                # Merge history settings
+                if "history" in file_config:
+                    config["history"].update(file_config["history"])
+
+                # Merge pipeline settings
+                if "pipeline" in file_config:
+                    config["pipeline"].update(file_config["pipeline"])
+
+                # Merge stream settings
+                if "stream" in file_config:
+                    config["stream"].update(file_config["stream"])
+
+                # Merge server settings
+                if "server" in file_config:
+                    config["server"].update(file_config["server"])
+
+                # Merge forecast settings
+                if "forecast" in file_config:
+                    config["forecast"].update(file_config["forecast"])
+
+                # Merge notification settings
+                if "notifications" in file_config:
+                    config["notifications"].update(file_config["notifications"])
+
+                # Merge subscription settings
+                if "subscriptions" in file_config:
+                    config["subscriptions"].update(file_config["subscriptions"])
+
                 # Merge logging settings
                 if "logging" in file_config:
                     config["logging"].update(file_config["logging"])
@@ -96,9 +219,32 @@ def load_config(config_file="config.toml"):
         logger.error(f"Error loading configuration: {e}")
         logger.warning("Using default configuration")
 
+    # Compile comfort profiles into a lookup table once
+    config["comfort_table"] = ComfortTable.from_config(config)
+
     return config
 
 
+def get_city_pairs(config):
+    """
+    Get the (our_city, their_city) pairs to compare
+
+    Uses [cities] pairs when configured, otherwise the single
+    our_city/their_city pair.
+    """
+    pairs = config["cities"].get("pairs")
+    if not pairs:
+        return [(config["cities"]["our_city"], config["cities"]["their_city"])]
+
+    valid_pairs = []
+    for pair in pairs:
+        if len(pair) == 2 and all(isinstance(city, str) for city in pair):
+            valid_pairs.append((pair[0], pair[1]))
+        else:
+            logger.warning(f"Ignoring invalid city pair: {pair}")
+    return valid_pairs
+
+
 def get_credentials(config):
     """Get all credentials for API, email and SMS services"""
     # Weather API key
@@ -130,4 +276,3 @@ def get_credentials(config):
         )
 
     return api_key, config
-
@@ -0,0 +1,116 @@
+import json
+import logging
+
+# orjson parses responses several times faster when it is installed
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+logger = logging.getLogger("weathermark.decoding")
+
+# Top-level fields of a weather response that WeatherMark reads
+WEATHER_FIELDS = ("id", "name", "dt", "timezone", "coord", "cod")
+# Fields kept from the first weather condition
+CONDITION_FIELDS = ("id", "main", "description")
+# Fields kept from "main"
+MAIN_FIELDS = ("temp", "feels_like", "humidity")
+
+
+def loads(body):
+    """
+    Parse a JSON document from bytes or text
+
+    Uses orjson when available and the standard library otherwise.
+
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def dumps(obj):
+    """
+    Serialise to one line of JSON (bytes, without a newline)
+
+    Uses orjson when available and the standard library otherwise.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def project_weather(data):
+    """
+    Keep only the fields of a weather response that WeatherMark uses
+
+    The result has the same shape as the response: id, name, dt, timezone,
+    coord, the first weather condition (id, main, description), temp,
+    feels_like and humidity in main, the wind speed and sys.country.
+    Everything else (clouds, visibility, sunrise, ...) is dropped so it
+    isn't kept in caches, history or replay logs. /group responses carry
+    the UTC offset in sys.timezone; it is moved to timezone.
+
+    Args:
+        data: Decoded response for one city
+
+    Returns:
+        dict: Projected weather data
+    """
+    if not isinstance(data, dict):
+        return data
+
+    projected = {key: data[key] for key in WEATHER_FIELDS if key in data}
+    if "weather" in data:
+        projected["weather"] = [
+            {key: condition[key] for key in CONDITION_FIELDS if key in condition}
+            for condition in (data["weather"] or [])[:1]
+        ]
+    if "main" in data:
+        main = data["main"] or {}
+        projected["main"] = {key: main[key] for key in MAIN_FIELDS if key in main}
+    if "wind" in data:
+        wind = data["wind"] or {}
+        projected["wind"] = {"speed": wind["speed"]} if "speed" in wind else {}
+    sys_fields = data.get("sys") or {}
+    country = sys_fields.get("country")
+    if country is not None:
+        projected["sys"] = {"country": country}
+    if "timezone" not in projected and "timezone" in sys_fields:
+        projected["timezone"] = sys_fields["timezone"]
+    return projected
+
+
+def project_list(data):
+    """
+    Project every city of a multi-city (/group or /find) response
+
+    Returns:
+        dict: {"cnt": ..., "list": [projected weather data, ...]}
+    """
+    if not isinstance(data, dict):
+        return data
+    cities = [project_weather(entry) for entry in data.get("list") or []]
+    return {"cnt": data.get("cnt", len(cities)), "list": cities}
+
+
+def decode(body, project=None):
+    """
+    Parse a response body and optionally project it
+
+    Args:
+        body: Raw response bytes
+        project: Function reducing the parsed document (optional)
+
+    Returns:
+        The decoded (and projected) document
+
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    data = loads(body)
+    return project(data) if project else data
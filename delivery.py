@@ -0,0 +1,354 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import gauge, increment
+
+logger = logging.getLogger("weathermark.delivery")
+
+# Circuit breaker states (the value of their state gauge)
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+DEFAULT_SETTINGS = {
+    "failure_threshold": 3,
+    "reset_seconds": 60,
+    "initial_concurrency": 4,
+    "max_concurrency": 16,
+    "latency_target": 2.0,
+}
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    message TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    recipients TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_by_next_attempt ON outbox (next_attempt);
+"""
+
+
+class CircuitBreaker:
+    """
+    Stop calling a channel endpoint that keeps failing
+
+    After failure_threshold consecutive failures the breaker opens and
+    calls fail fast instead of waiting out their timeouts. Once
+    reset_timeout seconds have passed it is half open: one trial call is
+    let through, and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=60, clock=time.time):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened = None
+        self.trial = None  # When the running half open trial call started
+        self.lock = threading.Condition()
+        self.publish()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return CLOSED
+        if self.clock() - self.opened >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def publish(self):
+        gauge(f"sender.breaker.{self.name}.state", STATE_VALUES[self.state])
+
+    def allow(self):
+        """
+        Check whether a call may be made (False: fail fast)
+
+        While half open, only the first caller gets to make its trial call.
+        The others wait for its outcome, unless it hasn't reported back
+        within reset_timeout seconds.
+        """
+        with self.lock:
+            while True:
+                state = self.state
+                if state == CLOSED:
+                    return True
+                if state == OPEN:
+                    increment(f"sender.breaker.{self.name}.rejected")
+                    return False
+                waited = self.clock() - self.trial if self.trial is not None else None
+                if waited is None or waited >= self.reset_timeout:
+                    self.trial = self.clock()
+                    return True
+                self.lock.wait(self.reset_timeout - waited)
+
+    async def allow_async(self):
+        """Like allow, but waits for a running trial call off the event loop"""
+        if self.state == CLOSED:
+            return True
+        return await asyncio.to_thread(self.allow)
+
+    def record_success(self):
+        with self.lock:
+            if self.opened is not None:
+                logger.info(f"Circuit for {self.name} closed again")
+            self.failures = 0
+            self.opened = None
+            self.trial = None
+            self.lock.notify_all()
+        self.publish()
+
+    def record_failure(self):
+        with self.lock:
+            self.trial = None
+            self.lock.notify_all()
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                self.opened is None and self.failures >= self.failure_threshold
+            ):
+                logger.warning(
+                    f"Circuit for {self.name} opened after {self.failures} failures"
+                )
+                increment(f"sender.breaker.{self.name}.opened")
+                self.opened = self.clock()
+        self.publish()
+
+
+class AdaptiveLimit:
+    """
+    Number of concurrent sends an endpoint is trusted with (AIMD)
+
+    Each fast success adds 1/limit, so the limit grows by about one per
+    round of sends; an error or a send slower than latency_target halves
+    it, backing off quickly when the provider struggles.
+    """
+
+    def __init__(self, name, initial=4, minimum=1, maximum=16, latency_target=2.0):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.lock = threading.Lock()
+        self.publish()
+
+    @property
+    def size(self):
+        return int(self.limit)
+
+    def publish(self):
+        gauge(f"sender.concurrency.{self.name}.limit", self.size)
+
+    def record(self, latency, ok=True):
+        """Adjust the limit for the outcome of one send"""
+        with self.lock:
+            if ok and latency <= self.latency_target:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            else:
+                self.limit = max(self.minimum, self.limit / 2)
+        self.publish()
+
+
+class Outbox:
+    """
+    Sends that failed or were failed fast, kept in SQLite for a later run
+
+    Entries are retried with exponential backoff until they go through or
+    have been attempted max_attempts times.
+    """
+
+    def __init__(self, path, retry_seconds=60, max_attempts=8, clock=time.time):
+        self.path = path
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(OUTBOX_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT count(*) FROM outbox").fetchone()[0]
+
+    def add(self, channel, message, subject, recipients):
+        """Keep a send to retry later"""
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO outbox"
+                " (channel, message, subject, recipients, next_attempt)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    channel,
+                    message,
+                    subject,
+                    json.dumps(list(recipients)),
+                    self.clock() + self.retry_seconds,
+                ),
+            )
+        increment(f"sender.outbox.{channel}.deferred")
+
+    def due(self, now=None):
+        """
+        Return the entries ready for another attempt
+
+        Returns:
+            list: Dicts with id, channel, message, subject, recipients
+                  and attempts
+        """
+        now = self.clock() if now is None else now
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, channel, message, subject, recipients, attempts"
+                " FROM outbox WHERE next_attempt <= ? ORDER BY id",
+                (now,),
+            ).fetchall()
+        return [
+            {
+                "id": row[0],
+                "channel": row[1],
+                "message": row[2],
+                "subject": row[3],
+                "recipients": json.loads(row[4]),
+                "attempts": row[5],
+            }
+            for row in rows
+        ]
+
+    def settle(self, entry, failed):
+        """
+        Record the outcome of retrying an entry
+
+        Args:
+            entry: Entry from due()
+            failed: Recipients that still didn't get the message
+        """
+        attempts = entry["attempts"] + 1
+        with self.lock, self.db:
+            if not failed:
+                self.db.execute("DELETE FROM outbox WHERE id = ?", (entry["id"],))
+            elif attempts >= self.max_attempts:
+                logger.error(
+                    f"Giving up on {entry['channel']} message '{entry['subject']}'"
+                    f" to {len(failed)} recipients after {attempts} retries"
+                )
+                increment(f"sender.outbox.{entry['channel']}.dropped")
+                self.db.execute("DELETE FROM outbox WHERE id = ?", (entry["id"],))
+            else:
+                self.db.execute(
+                    "UPDATE outbox SET recipients = ?, attempts = ?,"
+                    " next_attempt = ? WHERE id = ?",
+                    (
+                        json.dumps(list(failed)),
+                        attempts,
+                        self.clock() + self.retry_seconds * 2**attempts,
+                        entry["id"],
+                    ),
+                )
+
+
+# Shared state of every channel endpoint
+_settings = dict(DEFAULT_SETTINGS)
+_breakers = {}
+_limits = {}
+_registry_lock = threading.Lock()
+_outbox_settings = None  # The [delivery] section, until the outbox is opened
+outbox = None
+
+
+def configure(settings):
+    """
+    Apply the [delivery] settings and forget every endpoint's state
+
+    Args:
+        settings: The [delivery] config section
+    """
+    global outbox, _outbox_settings
+    with _registry_lock:
+        _settings.clear()
+        _settings.update(DEFAULT_SETTINGS)
+        _settings.update(
+            {key: settings[key] for key in DEFAULT_SETTINGS if key in settings}
+        )
+        _breakers.clear()
+        _limits.clear()
+        if outbox is not None:
+            outbox.close()
+            outbox = None
+        _outbox_settings = settings if settings.get("outbox") else None
+
+
+def open_outbox(create=True):
+    """
+    Return the outbox, opening it on first use
+
+    Runs that never defer a send don't touch the database file.
+
+    Args:
+        create: Create the database if it doesn't exist yet (a run with
+                nothing to defer has nothing to drain from a missing file)
+
+    Returns:
+        Outbox: The outbox, or None if it is disabled (or not created yet)
+    """
+    global outbox
+    with _registry_lock:
+        if outbox is None and _outbox_settings is not None:
+            path = _outbox_settings["outbox"]
+            if not create and not os.path.exists(path):
+                return None
+            outbox = Outbox(
+                path,
+                _outbox_settings.get("retry_seconds", 60),
+                _outbox_settings.get("max_attempts", 8),
+            )
+        return outbox
+
+
+def breaker(channel, endpoint):
+    """Return the circuit breaker of a channel endpoint"""
+    name = f"{channel}.{endpoint}"
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name, _settings["failure_threshold"], _settings["reset_seconds"]
+            )
+        return _breakers[name]
+
+
+def limit(channel, endpoint):
+    """Return the adaptive concurrency limit of a channel endpoint"""
+    name = f"{channel}.{endpoint}"
+    with _registry_lock:
+        if name not in _limits:
+            _limits[name] = AdaptiveLimit(
+                name,
+                _settings["initial_concurrency"],
+                1,
+                _settings["max_concurrency"],
+                _settings["latency_target"],
+            )
+        return _limits[name]
+
+
+def defer(channel, message, subject, recipients):
+    """Keep a failed send in the outbox for a later run (if enabled)"""
+    if not recipients:
+        return
+    if open_outbox() is None:
+        logger.warning(f"No outbox configured - {len(recipients)} {channel} sends lost")
+        return
+    outbox.add(channel, message, subject, recipients)
+    logger.info(f"Deferred {channel} message to {len(recipients)} recipients")
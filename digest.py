@@ -0,0 +1,102 @@
+import logging
+import time
+
+logger = logging.getLogger("weathermark.digest")
+
+# Digest key for notifications that go to every configured recipient
+ALL_RECIPIENTS = "*"
+
+
+class DigestQueue:
+    """
+    Collect notifications per recipient and release them as one digest
+
+    The first notification for a recipient opens a window; once it has been
+    open for window seconds, everything collected for that recipient is due
+    and is sent as a single message.
+    """
+
+    def __init__(self, window=0, clock=time.time):
+        self.window = window
+        self.clock = clock
+        self.batches = {}  # recipient -> {"opened": time, "sections": [...]}
+
+    def __len__(self):
+        return sum(len(batch["sections"]) for batch in self.batches.values())
+
+    def add(self, recipient, message, subject):
+        """Queue a rendered (message, subject) for a recipient"""
+        batch = self.batches.setdefault(
+            recipient, {"opened": self.clock(), "sections": []}
+        )
+        batch["sections"].append((message, subject))
+
+    def due(self, force=False):
+        """
+        Take the batches whose window has closed
+
+        Args:
+            force: Take every batch regardless of its window
+
+        Returns:
+            list: (recipient, [(message, subject), ...]) tuples
+        """
+        now = self.clock()
+        due = [
+            recipient
+            for recipient, batch in self.batches.items()
+            if force or now - batch["opened"] >= self.window
+        ]
+        return [
+            (recipient, self.batches.pop(recipient)["sections"]) for recipient in due
+        ]
+
+
+def strip_signature(message, signature):
+    """Remove the signature construct_message appends to a message"""
+    suffix = f"\n\n-- {signature}"
+    if signature and message.endswith(suffix):
+        return message[: -len(suffix)]
+    return message
+
+
+def construct_digest(sections, signature=None):
+    """
+    Combine rendered notifications into one message
+
+    Args:
+        sections: List of (message, subject) from construct_message
+        signature: Signature the sections were rendered with; it is moved
+                   to the end of the digest so it appears only once
+
+    Returns:
+        tuple: (message, subject)
+    """
+    if len(sections) == 1:
+        return sections[0]
+
+    parts = [f"{len(sections)} weather wins to report!"]
+    for message, subject in sections:
+        parts.append(f"== {subject} ==\n{strip_signature(message, signature)}")
+    message = "\n\n".join(parts)
+    if signature:
+        message += f"\n\n-- {signature}"
+    return message, f"Weather digest: {len(sections)} wins"
+
+
+def digest_queue(config):
+    """
+    Return the digest queue of a configuration
+
+    Returns:
+        DigestQueue: The queue, or None when [notifications] digest is off
+    """
+    settings = config["notifications"]
+    if not settings.get("digest"):
+        return None
+    queue = config.get("digest_queue")
+    if queue is None:
+        queue = config["digest_queue"] = DigestQueue(
+            settings.get("digest_window_minutes", 0) * 60
+        )
+    return queue
@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from history import OBSERVATION_DTYPE, REASONS, advantage_codes, encode_observation
+from weather_api import api_url, fetch_json, get_weather, location_query
+
+logger = logging.getLogger("weathermark.forecast")
+
+# The 5 day forecast has one slot every 3 hours
+SLOT_SECONDS = 3 * 60 * 60
+FORECAST_SLOTS = 40
+
+
+def forecast_url(city, api_key):
+    """Build the 5 day / 3 hour forecast URL for a city"""
+    return api_url("forecast", api_key, f"{location_query(city)}&cnt={FORECAST_SLOTS}")
+
+
+def project_slot(slot, timezone=None):
+    """
+    Keep only the fields of a forecast slot that comparisons and messages use
+
+    Args:
+        slot: Forecast slot (or current weather data)
+        timezone: UTC offset of the city in seconds (forecast responses
+                  give it once, in city.timezone)
+    """
+    main = slot.get("main", {})
+    wind = slot.get("wind", {})
+    projected = {
+        "dt": slot.get("dt"),
+        "weather": slot.get("weather", [])[:1],
+        "main": {
+            key: main[key] for key in ("temp", "feels_like", "humidity") if key in main
+        },
+        "wind": {"speed": wind["speed"]} if "speed" in wind else {},
+    }
+    timezone = slot.get("timezone", timezone)
+    if timezone is not None:
+        projected["timezone"] = timezone
+    return projected
+
+
+def mock_forecast(city, mock_type, now=None):
+    """Build a forecast from mock current weather, one slot every 3 hours"""
+    start = int(now if now is not None else time.time())
+    start -= start % SLOT_SECONDS
+    slots = []
+    for i in range(FORECAST_SLOTS):
+        slot = project_slot(get_weather(city, None, mock_type))
+        slot["dt"] = start + i * SLOT_SECONDS
+        slots.append(slot)
+    return slots
+
+
+def forecast_cache_path(city, cache_dir):
+    """Return the path of the cached forecast for a city"""
+    slug = city.strip().lower().replace(" ", "_")
+    return os.path.join(cache_dir, f"{slug}.forecast.json")
+
+
+def load_cached_forecast(city, cache_dir):
+    """
+    Load a cached forecast
+
+    Returns:
+        tuple: (slots, fetched_at), or (None, None) if nothing is cached
+    """
+    try:
+        with open(forecast_cache_path(city, cache_dir), "r") as f:
+            cached = json.load(f)
+        return cached["slots"], cached["fetched_at"]
+    except FileNotFoundError:
+        return None, None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Ignoring unreadable forecast cache for {city}: {e}")
+        return None, None
+
+
+def save_cached_forecast(city, cache_dir, slots, fetched_at):
+    """Cache a forecast so later runs don't refetch it"""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(forecast_cache_path(city, cache_dir), "w") as f:
+            json.dump({"fetched_at": fetched_at, "slots": slots}, f)
+    except OSError as e:
+        logger.error(f"Failed to cache forecast for {city}: {e}")
+
+
+def get_forecast(city, api_key, cache_dir, max_age, mock_type=None, now=None):
+    """
+    Get the forecast slots for a city, fetching at most once per max_age
+
+    Args:
+        city: The city to get the forecast for
+        api_key: OpenWeatherMap API key
+        cache_dir: Directory for cached forecasts
+        max_age: Seconds before a cached forecast is refreshed
+        mock_type: Type of condition to mock (optional)
+        now: Current time (default: now)
+
+    Returns:
+        list: Forecast slots in time order, or None if unavailable
+    """
+    if mock_type:
+        return mock_forecast(city, mock_type, now)
+
+    now = now if now is not None else time.time()
+    slots, fetched_at = load_cached_forecast(city, cache_dir)
+    if slots is not None and now - fetched_at < max_age:
+        logger.debug(f"Using cached forecast for {city}")
+        return slots
+
+    if not api_key:
+        logger.error("No API key provided")
+        return slots
+
+    data = fetch_json(forecast_url(city, api_key), f"forecast for {city}")
+    if not data or "list" not in data:
+        if slots is not None:
+            logger.warning(f"Using outdated cached forecast for {city}")
+        return slots
+
+    timezone = (data.get("city") or {}).get("timezone")
+    slots = [project_slot(slot, timezone) for slot in data["list"]]
+    save_cached_forecast(city, cache_dir, slots, now)
+    return slots
+
+
+def encode_series(slots):
+    """Pack forecast slots into history records keyed by slot time"""
+    if not slots:
+        return np.zeros(0, dtype=OBSERVATION_DTYPE)
+    return np.concatenate([encode_observation(slot, ts=slot["dt"]) for slot in slots])
+
+
+def advantage_windows(
+    our_slots,
+    their_slots,
+    min_temp,
+    max_temp,
+    comfort=None,
+    our_city=None,
+    their_city=None,
+):
+    """
+    Find every future window in which our city has the advantage
+
+    Slots are compared vectorized with the same rules as main, and
+    consecutive slots with the same reason are merged into one window.
+    With a comfort.ComfortTable, each city's comfort profile is used
+    instead of min_temp/max_temp.
+
+    Returns:
+        list: Dicts with start, end (seconds since epoch), reason and the
+              indexes of the first our/their slot of the window
+    """
+    ours = encode_series(our_slots)
+    theirs = encode_series(their_slots)
+    _, our_index, their_index = np.intersect1d(
+        ours["ts"], theirs["ts"], return_indices=True
+    )
+    if not len(our_index):
+        return []
+
+    ours = ours[our_index]
+    theirs = theirs[their_index]
+    our_comfortable = their_comfortable = None
+    if comfort is not None:
+        our_comfortable = comfort.comfortable_records(
+            ours, comfort.row(our_city), our_slots[0].get("timezone") or 0
+        )
+        their_comfortable = comfort.comfortable_records(
+            theirs, comfort.row(their_city), their_slots[0].get("timezone") or 0
+        )
+    codes = advantage_codes(
+        ours, theirs, min_temp, max_temp, our_comfortable, their_comfortable
+    )
+    times = ours["ts"]
+
+    # A window ends where the reason changes or a slot is missing
+    breaks = np.flatnonzero((np.diff(codes) != 0) | (np.diff(times) != SLOT_SECONDS))
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks + 1, [len(codes)]))
+
+    return [
+        {
+            "start": int(times[start]),
+            "end": int(times[end - 1]) + SLOT_SECONDS,
+            "reason": REASONS[codes[start]],
+            "our_slot": int(our_index[start]),
+            "their_slot": int(their_index[start]),
+        }
+        for start, end in zip(starts, ends)
+        if codes[start]
+    ]
+
+
+def schedule_notifications(windows, lead_time=0):
+    """Add the time each window's notification should go out"""
+    return [dict(window, send_at=window["start"] - lead_time) for window in windows]
+
+
+def next_send_at(schedule, now):
+    """
+    Return when the next scheduled notification should go out
+
+    Returns:
+        float: Earliest send_at after now, or None if nothing is scheduled
+    """
+    upcoming = [
+        notification["send_at"]
+        for notification in schedule
+        if notification["send_at"] > now
+    ]
+    return min(upcoming, default=None)
+
+
+def schedule_path(cache_dir):
+    """Return the path of the persisted notification schedule"""
+    return os.path.join(cache_dir, "schedule.json")
+
+
+def load_schedule(cache_dir):
+    """
+    Load the notification schedule of the last forecast run
+
+    Returns:
+        list: Scheduled notifications (empty if there is none)
+    """
+    try:
+        with open(schedule_path(cache_dir), "r") as f:
+            schedule = json.load(f)
+        if isinstance(schedule, list):
+            return schedule
+        logger.warning("Ignoring invalid forecast schedule")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable forecast schedule: {e}")
+    return []
+
+
+def save_schedule(cache_dir, schedule):
+    """Persist the notification schedule (atomically)"""
+    path = schedule_path(cache_dir)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(schedule, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        logger.error(f"Failed to save forecast schedule: {e}")
+
+
+def due_notifications(schedule, now):
+    """Return the scheduled notifications that should be sent now"""
+    return [
+        notification
+        for notification in schedule
+        if notification["send_at"] <= now < notification["end"]
+    ]
+
+
+def carried_over(previous, schedule, now):
+    """
+    Return saved notifications the refreshed schedule no longer has
+
+    A forecast starts at the next slot, so a window that began since the
+    last run drops out of it (or comes back with a later start). The saved
+    notifications of windows that haven't ended yet are kept so a run
+    started by cron still sends them.
+
+    Args:
+        previous: Notifications of the pair saved by the last run
+        schedule: Notifications of the pair scheduled from the new forecast
+        now: Current time (seconds since epoch)
+
+    Returns:
+        list: Saved notifications to keep, in time order
+    """
+    starts = {notification["start"] for notification in schedule}
+    return sorted(
+        (
+            notification
+            for notification in previous
+            if notification["start"] not in starts and notification["end"] > now
+        ),
+        key=lambda notification: notification["start"],
+    )
@@ -0,0 +1,245 @@
+import csv
+import heapq
+import logging
+import math
+import os
+from functools import lru_cache
+
+logger = logging.getLogger("weathermark.gazetteer")
+
+# Bundled city table: name, country, OpenWeatherMap id (optional), lat, lon
+GAZETTEER_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "gazetteer.csv"
+)
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def to_xyz(lat, lon):
+    """Convert latitude/longitude in degrees to a point on the unit sphere"""
+    lat = math.radians(lat)
+    lon = math.radians(lon)
+    return (
+        math.cos(lat) * math.cos(lon),
+        math.cos(lat) * math.sin(lon),
+        math.sin(lat),
+    )
+
+
+def chord_to_km(chord):
+    """Convert a straight-line distance on the unit sphere to great-circle km"""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def km_to_chord(km):
+    """Convert a great-circle distance in km to a distance on the unit sphere"""
+    return 2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)
+
+
+def _distance2(a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+class KDTree:
+    """
+    Static 3-d tree over points on the unit sphere
+
+    Points are stored as 3-d unit vectors, so straight-line distance is
+    monotonic in great-circle distance and there are no problems at the
+    antimeridian.
+    """
+
+    def __init__(self, points):
+        """
+        Args:
+            points: Iterable of (xyz, item) tuples
+        """
+        self.root = self._build(list(points), 0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda point: point[0][axis])
+        mid = len(points) // 2
+        return (
+            points[mid],
+            axis,
+            self._build(points[:mid], depth + 1),
+            self._build(points[mid + 1 :], depth + 1),
+        )
+
+    def nearest(self, xyz, k=1):
+        """
+        Find the k points closest to xyz
+
+        Returns:
+            list: (chord distance, item) tuples, closest first
+        """
+        best = []  # max-heap of (-distance2, counter, item)
+        counter = 0
+
+        def visit(node):
+            nonlocal counter
+            if node is None:
+                return
+            (point, item), axis, left, right = node
+            distance2 = _distance2(point, xyz)
+            if len(best) < k:
+                heapq.heappush(best, (-distance2, counter, item))
+            elif distance2 < -best[0][0]:
+                heapq.heapreplace(best, (-distance2, counter, item))
+            counter += 1
+
+            delta = xyz[axis] - point[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            visit(near)
+            if len(best) < k or delta * delta < -best[0][0]:
+                visit(far)
+
+        visit(self.root)
+        return [
+            (math.sqrt(-distance2), item)
+            for distance2, _, item in sorted(best, reverse=True)
+        ]
+
+    def within(self, xyz, radius):
+        """
+        Find every point within a chord distance of xyz
+
+        Returns:
+            list: (chord distance, item) tuples, closest first
+        """
+        radius2 = radius * radius
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            (point, item), axis, left, right = node
+            distance2 = _distance2(point, xyz)
+            if distance2 <= radius2:
+                found.append((math.sqrt(distance2), item))
+
+            delta = xyz[axis] - point[axis]
+            if delta - radius <= 0:
+                stack.append(left)
+            if delta + radius >= 0:
+                stack.append(right)
+        found.sort(key=lambda result: result[0])
+        return found
+
+
+class Gazetteer:
+    """
+    Local city table with name and nearest-neighbour lookups
+
+    Names are resolved without any geocoding request, so weather fetches
+    can go by OpenWeatherMap id or coordinates instead of free text.
+    """
+
+    def __init__(self, entries):
+        """
+        Args:
+            entries: Iterable of dicts with name, country, id, lat and lon
+        """
+        self.entries = list(entries)
+        self.by_name = {}
+        for entry in self.entries:
+            self.by_name.setdefault(entry["name"].lower(), []).append(entry)
+        self.tree = KDTree(
+            (to_xyz(entry["lat"], entry["lon"]), entry) for entry in self.entries
+        )
+
+    @classmethod
+    def from_csv(cls, path):
+        """Load a gazetteer from a name,country,id,lat,lon CSV file"""
+        entries = []
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                entries.append(
+                    {
+                        "name": row["name"],
+                        "country": row["country"].upper(),
+                        "id": int(row["id"]) if row["id"] else None,
+                        "lat": float(row["lat"]),
+                        "lon": float(row["lon"]),
+                    }
+                )
+        logger.debug(f"Loaded {len(entries)} cities from {path}")
+        return cls(entries)
+
+    def lookup(self, name, country=None):
+        """
+        Find a city by name (case-insensitive)
+
+        Args:
+            name: City name
+            country: ISO country code to restrict the match to (optional)
+
+        Returns:
+            dict: The gazetteer entry, or None if the city is unknown
+        """
+        for entry in self.by_name.get(name.strip().lower(), []):
+            if country is None or entry["country"] == country.upper():
+                return entry
+        return None
+
+    def nearest(self, lat, lon, k=1):
+        """
+        Find the k cities closest to a coordinate
+
+        Returns:
+            list: (distance in km, entry) tuples, closest first
+        """
+        return [
+            (chord_to_km(chord), entry)
+            for chord, entry in self.tree.nearest(to_xyz(lat, lon), k)
+        ]
+
+    def within(self, lat, lon, radius_km):
+        """
+        Find every city within radius_km of a coordinate
+
+        Returns:
+            list: (distance in km, entry) tuples, closest first
+        """
+        return [
+            (chord_to_km(chord), entry)
+            for chord, entry in self.tree.within(
+                to_xyz(lat, lon), km_to_chord(radius_km)
+            )
+        ]
+
+    def cities_within(self, city, radius_km, country=None):
+        """
+        List the other cities within radius_km of a city
+
+        Returns:
+            list: City names, closest first (empty if the city is unknown)
+        """
+        entry = self.lookup(city, country)
+        if entry is None:
+            logger.warning(f"{city} is not in the gazetteer")
+            return []
+        return [
+            other["name"]
+            for _, other in self.within(entry["lat"], entry["lon"], radius_km)
+            if other is not entry
+        ]
+
+
+@lru_cache(maxsize=None)
+def load_gazetteer(path=GAZETTEER_FILE):
+    """
+    Load (once) and return the gazetteer
+
+    Returns:
+        Gazetteer: The loaded gazetteer (empty if the file can't be read)
+    """
+    try:
+        return Gazetteer.from_csv(path)
+    except (OSError, KeyError, ValueError) as e:
+        logger.error(f"Failed to load gazetteer {path}: {e}")
+        return Gazetteer([])
@@ -0,0 +1,289 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+from weather_api import is_rainy, is_sunny
+
+logger = logging.getLogger("weathermark.history")
+
+# Fixed-width record written for every stored observation. Records are only
+# ever appended, so each city file is sorted by "ts" and can be range-scanned
+# with a binary search directly over the memory map.
+OBSERVATION_DTYPE = np.dtype(
+    [
+        ("ts", "<i8"),  # Run timestamp, shared by every city fetched in a run
+        ("dt", "<i8"),  # OpenWeatherMap observation time
+        ("condition_id", "<i2"),  # OpenWeatherMap condition code
+        ("flags", "u1"),  # FLAG_* bits
+        ("humidity", "u1"),
+        ("temp", "<f8"),  # NaN when the observation had no temperature
+        ("feels_like", "<f4"),
+        ("wind_speed", "<f4"),
+    ]
+)
+
+# Condition flags, evaluated with the same rules as weather_api at record time
+FLAG_SUNNY = 1
+FLAG_RAINY = 2
+
+# Reason codes returned by advantage_codes(), indexed into REASONS
+REASON_NONE = 0
+REASON_WEATHER = 1
+REASON_TEMPERATURE = 2
+REASON_BOTH = 3
+REASONS = (None, "weather", "temperature", "both")
+
+_EMPTY = np.zeros(0, dtype=OBSERVATION_DTYPE)
+
+
+def city_history_path(city, directory):
+    """Return the path of the history file for a city"""
+    slug = city.strip().lower().replace(" ", "_")
+    return os.path.join(directory, f"{slug}.obs")
+
+
+def encode_observation(weather_data, ts=None):
+    """
+    Pack weather data from the API into a single history record
+
+    Args:
+        weather_data: Weather data from API
+        ts: Run timestamp (default: now)
+
+    Returns:
+        numpy.ndarray: One-element array with OBSERVATION_DTYPE
+    """
+    record = np.zeros(1, dtype=OBSERVATION_DTYPE)
+    main = weather_data.get("main", {})
+    conditions = weather_data.get("weather") or [{}]
+
+    flags = 0
+    if is_sunny(weather_data):
+        flags |= FLAG_SUNNY
+    if is_rainy(weather_data):
+        flags |= FLAG_RAINY
+
+    record["ts"] = int(ts if ts is not None else time.time())
+    record["dt"] = weather_data.get("dt", 0)
+    record["condition_id"] = conditions[0].get("id", 0)
+    record["flags"] = flags
+    record["humidity"] = main.get("humidity", 0)
+    record["temp"] = main.get("temp", np.nan)
+    record["feels_like"] = main.get("feels_like", np.nan)
+    record["wind_speed"] = weather_data.get("wind", {}).get("speed", np.nan)
+    return record
+
+
+def record_observation(city, weather_data, directory, ts=None):
+    """
+    Append an observation to the history file for a city
+
+    Args:
+        city: Name of the city
+        weather_data: Weather data from API
+        directory: History directory
+        ts: Run timestamp (default: now)
+
+    Returns:
+        bool: Success status
+    """
+    if not weather_data:
+        return False
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        record = encode_observation(weather_data, ts)
+        with open(city_history_path(city, directory), "ab") as f:
+            f.write(record.tobytes())
+        logger.debug(f"Recorded observation for {city} at {int(record['ts'][0])}")
+        return True
+    except (OSError, TypeError, ValueError) as e:
+        logger.error(f"Failed to record observation for {city}: {e}")
+        return False
+
+
+def load_history(city, directory):
+    """
+    Memory-map the history file for a city
+
+    Returns:
+        numpy.ndarray: Read-only record array (empty if there is no history)
+    """
+    path = city_history_path(city, directory)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return _EMPTY
+
+    count = size // OBSERVATION_DTYPE.itemsize
+    if size % OBSERVATION_DTYPE.itemsize:
+        logger.warning(f"Ignoring truncated trailing record in {path}")
+    if count == 0:
+        return _EMPTY
+
+    return np.memmap(path, dtype=OBSERVATION_DTYPE, mode="r", shape=(count,))
+
+
+def time_window(records, start=None, end=None):
+    """
+    Return the records with start <= ts < end as a view (no copy)
+
+    Args:
+        records: Record array sorted by ts
+        start: First run timestamp to include (default: no lower bound)
+        end: Run timestamp to stop before (default: no upper bound)
+    """
+    ts = records["ts"]
+    lo = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+    hi = len(records) if end is None else int(np.searchsorted(ts, end, side="left"))
+    return records[lo:hi]
+
+
+def query(city, directory, start=None, end=None):
+    """Memory-map a city's history and return the view for a time window"""
+    return time_window(load_history(city, directory), start, end)
+
+
+def align_pair(our_records, their_records):
+    """
+    Match up the observations of two cities taken in the same run
+
+    Returns:
+        tuple: (our_index, their_index) arrays selecting the matching records
+    """
+    _, our_index, their_index = np.intersect1d(
+        our_records["ts"], their_records["ts"], return_indices=True
+    )
+    return our_index, their_index
+
+
+def comfortable(records, min_temp, max_temp):
+    """Vectorized equivalent of weather_api.is_temperature_comfortable"""
+    temp = records["temp"]
+    # NaN compares False, matching the missing-temperature case
+    return (temp >= min_temp) & (temp <= max_temp)
+
+
+def advantage_codes(
+    our_records,
+    their_records,
+    min_temp,
+    max_temp,
+    our_comfortable=None,
+    their_comfortable=None,
+):
+    """
+    Compute the reason code for every aligned pair of records
+
+    Uses the same rules as main: weather is better when we are sunny and
+    they are rainy, temperature is better when ours is comfortable and
+    theirs is not.
+
+    Args:
+        our_records: Records for our city
+        their_records: Records for their city, aligned with ours
+        min_temp: Minimum comfortable temperature
+        max_temp: Maximum comfortable temperature
+        our_comfortable: Precomputed comfort of our records, e.g. from a
+                         comfort.ComfortTable (overrides min/max_temp)
+        their_comfortable: Precomputed comfort of their records
+
+    Returns:
+        numpy.ndarray: REASON_* code per record
+    """
+    if our_comfortable is None:
+        our_comfortable = comfortable(our_records, min_temp, max_temp)
+    if their_comfortable is None:
+        their_comfortable = comfortable(their_records, min_temp, max_temp)
+
+    our_sunny = (our_records["flags"] & FLAG_SUNNY) != 0
+    their_rainy = (their_records["flags"] & FLAG_RAINY) != 0
+    weather_better = our_sunny & their_rainy
+    temp_better = our_comfortable & ~their_comfortable
+    return weather_better * REASON_WEATHER + temp_better * REASON_TEMPERATURE
+
+
+def pair_advantages(
+    our_city, their_city, directory, min_temp, max_temp, start=None, end=None
+):
+    """Return (ts, reason codes) for the aligned runs of a city pair"""
+    ours = query(our_city, directory, start, end)
+    theirs = query(their_city, directory, start, end)
+    if len(ours) == len(theirs) and np.array_equal(ours["ts"], theirs["ts"]):
+        # Both cities were recorded in every run, so the views already line up
+        return ours["ts"], advantage_codes(ours, theirs, min_temp, max_temp)
+
+    our_index, their_index = align_pair(ours, theirs)
+    codes = advantage_codes(ours[our_index], theirs[their_index], min_temp, max_temp)
+    return ours["ts"][our_index], codes
+
+
+def win_rate(our_city, their_city, directory, min_temp, max_temp, start=None, end=None):
+    """
+    Summarize how often our city had the advantage over their city
+
+    Returns:
+        dict: Sample count, win count, win rate and a count per reason
+    """
+    _, codes = pair_advantages(
+        our_city, their_city, directory, min_temp, max_temp, start, end
+    )
+    counts = np.bincount(codes, minlength=len(REASONS))
+    samples = int(len(codes))
+    wins = samples - int(counts[REASON_NONE])
+
+    return {
+        "samples": samples,
+        "wins": wins,
+        "win_rate": wins / samples if samples else 0.0,
+        "weather": int(counts[REASON_WEATHER]),
+        "temperature": int(counts[REASON_TEMPERATURE]),
+        "both": int(counts[REASON_BOTH]),
+    }
+
+
+def run_lengths(mask):
+    """Return the lengths of every run of True values in a boolean array"""
+    padded = np.concatenate(([False], np.asarray(mask, dtype=bool), [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges[1::2] - edges[::2]
+
+
+def streaks(our_city, their_city, directory, min_temp, max_temp, start=None, end=None):
+    """
+    Measure winning streaks (consecutive runs with any advantage)
+
+    Returns:
+        dict: Longest streak, current streak and number of streaks
+    """
+    _, codes = pair_advantages(
+        our_city, their_city, directory, min_temp, max_temp, start, end
+    )
+    wins = codes != REASON_NONE
+    lengths = run_lengths(wins)
+
+    return {
+        "longest": int(lengths.max()) if len(lengths) else 0,
+        "current": int(lengths[-1]) if len(wins) and wins[-1] else 0,
+        "count": int(len(lengths)),
+    }
+
+
+def temperature_percentiles(
+    city, directory, percentiles=(10, 50, 90), start=None, end=None
+):
+    """
+    Compute temperature percentiles for a city over a time window
+
+    Returns:
+        dict: Percentile -> temperature (None when there is no data)
+    """
+    temps = query(city, directory, start, end)["temp"]
+    temps = temps[~np.isnan(temps)]
+    if not len(temps):
+        return {p: None for p in percentiles}
+
+    values = np.percentile(temps, percentiles)
+    return {p: float(v) for p, v in zip(percentiles, values)}
@@ -1,18 +1,75 @@
 import argparse
+import asyncio
+import functools
 import logging
+import os
+import random
+import sys
+import time
 
 # Import modules
-from config import get_credentials, load_config
-from message_constructor import construct_message
-from message_sender import send_message
+from change_detection import (
+    load_state,
+    pair_changed,
+    pair_key,
+    record_evaluation,
+    save_state,
+)
+from comfort import comfort_limits, comfort_signature, get_comfort_table
+from comparison import compare_weather
+from config import get_city_pairs, get_credentials, load_config
+from forecast import (
+    advantage_windows,
+    carried_over,
+    due_notifications,
+    get_forecast,
+    load_schedule,
+    next_send_at,
+    save_schedule,
+    schedule_notifications,
+)
+import delivery
+from digest import ALL_RECIPIENTS, construct_digest, digest_queue
+from gazetteer import load_gazetteer
+from message_constructor import construct_message, message_cache
+from metrics import log_metrics
+from message_sender import build_sender_config, retry_deferred, send_message
+from pipeline import main_async, record_history
+from polling import PollScheduler, cache_limits
+from profiling import install_signal_toggle, profiled
+from providers import build_provider
+from regional import (
+    compare_region,
+    construct_region_message,
+    get_region,
+    region_center,
+)
+from server import serve
+from sharding import evaluate_pairs_sharded
+from streaming import read_pairs, stream_pairs
+from subscriptions import (
+    SubscriptionStore,
+    pair_topic,
+    region_topic,
+    subscription_fanout,
+)
+from tracing import configure_tracing, flush_traces, span
 from weather_api import (
+    enable_cache,
+    enable_conditional_requests,
     get_temperature,
     get_weather,
-    is_rainy,
-    is_sunny,
-    is_temperature_comfortable,
+    prioritize_cities,
+    set_base_url,
+    set_country,
+    set_rate_limit,
+    start_recording,
+    start_replay,
+    stop_recording,
 )
 
+logger = logging.getLogger("weathermark")
+
 
 # Parse command-line arguments
 def parse_args():
@@ -35,203 +92,979 @@ def parse_args():
         help="Type of condition to mock (weather, temperature, or both)",
     )
 
+    # Ignore change detection state
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Evaluate and notify even if no observation changed",
+    )
+
+    # Capture or replay API traffic
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="Capture every API response to a replay log",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="PATH",
+        help="Serve API responses from a replay log instead of the network",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        metavar="X",
+        help="Replay X times faster than recorded, or 0 for no delays (default: 1)",
+    )
+
+    # Tracing
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Append OTLP/JSON traces of each run to PATH and log phase latencies",
+    )
+
+    # Profiling
+    parser.add_argument(
+        "--profile",
+        choices=["cprofile", "sampling"],
+        help="Profile the run with cProfile (pstats) or a sampling profiler (flamegraph stacks)",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default="profile",
+        metavar="DIR",
+        help="Directory for profile output (default: profile)",
+    )
+    parser.add_argument(
+        "--profile-seconds",
+        type=int,
+        default=30,
+        metavar="N",
+        help="With --interval, SIGUSR1 profiles the running process for N seconds (default: 30)",
+    )
+
+    # Nearby cities from the gazetteer
+    parser.add_argument(
+        "--within",
+        type=float,
+        metavar="KM",
+        help="Compare our city against every known city within KM kilometres",
+    )
+
+    # One request for a whole region
+    parser.add_argument(
+        "--region",
+        type=int,
+        metavar="N",
+        help="Compare our city against the N closest cities in a single API call",
+    )
+
+    # Asyncio pipeline
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Run fetch, compare, render and send as a concurrent pipeline",
+    )
+
+    # Process pool evaluation
+    parser.add_argument(
+        "--workers",
+        type=int,
+        metavar="N",
+        help="Compare and render pairs on N worker processes",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Seed for message selection with --workers (default: random)",
+    )
+
+    # Forecast mode
+    parser.add_argument(
+        "--forecast",
+        action="store_true",
+        help="Compare the 5 day forecasts and notify ahead of advantage windows",
+    )
+
+    # Repeat the comparison instead of exiting after one run
+    parser.add_argument(
+        "--interval",
+        type=int,
+        metavar="SECONDS",
+        help="Keep running and compare again every SECONDS seconds",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Keep running and poll each city when a new observation is expected, "
+        "more often when a pair is close to flipping (see [polling])",
+    )
+
+    # Compare pairs read line by line, writing NDJSON results
+    parser.add_argument(
+        "--stream",
+        nargs="?",
+        const="-",
+        metavar="PATH",
+        help="Compare the pairs read from PATH (default: stdin), one "
+        '"our city,their city" or "their city" per line, and write one JSON '
+        "result per pair to stdout",
+    )
+
+    # Answer comparisons over HTTP
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run an HTTP API for comparisons and observations (see [server])",
+    )
+
+    # Load recipients into the subscription store
+    parser.add_argument(
+        "--import-subscribers",
+        metavar="CSV",
+        help="Add the recipients in CSV to the subscription store and exit",
+    )
+
     # Debug mode
     parser.add_argument("--debug", action="store_true", help="Enable debug logging")
 
     return parser.parse_args()
 
 
-def main():
-    # Parse command-line arguments
-    args = parse_args()
+def notify(message, subject, config, topic=None):
+    """
+    Send the message via configured channels, or queue it
 
-    # Load configuration
-    config = load_config(args.config)
+    With subscriptions enabled the message is queued for the subscribers of
+    its topic; with digests enabled it is queued for the digest.
 
-    # Configure logging
-    logging_level = getattr(logging, config["logging"]["level"])
-    logging.basicConfig(level=logging_level, format=config["logging"]["format"])
-    logger = logging.getLogger("weathermark")
+    Args:
+        message: The message content
+        subject: Email subject
+        config: Loaded configuration (with credentials)
+        topic: Subscription topic of the advantage (see subscriptions.py)
+    """
+    fanout = subscription_fanout(config)
+    if fanout is not None and topic:
+        fanout.add(topic, message, subject)
+        return
 
-    # Enable debug logging if requested
-    if args.debug:
-        logging.getLogger().setLevel(logging.DEBUG)
-        logger.debug("Debug logging enabled")
+    queue = digest_queue(config)
+    if queue is not None:
+        queue.add(ALL_RECIPIENTS, message, subject)
+        logger.info(f"Queued for the digest ({len(queue)} notifications pending)")
+        return
+    deliver(message, subject, config)
 
-    # Get city names from config
-    OUR_CITY = config["cities"]["our_city"]
-    THEIR_CITY = config["cities"]["their_city"]
 
-    # Get credentials
-    api_key, config = get_credentials(config)
+def send_digests(config, force=False):
+    """
+    Send every digest whose window has closed
 
-    # Check if we should use mock data
-    use_mock = args.mock
-    if use_mock:
-        logger.info(f"Using mock weather data mode: {use_mock}")
+    Args:
+        config: Loaded configuration (with credentials)
+        force: Send all pending digests regardless of their window
+    """
+    queue = digest_queue(config)
+    if queue is None:
+        return
+    for recipient, sections in queue.due(force):
+        message, subject = construct_digest(sections, config["message"]["signature"])
+        logger.info(f"Sending digest of {len(sections)} notifications")
+        deliver(message, subject, config)
+
+
+def send_subscriptions(config):
+    """Send the queued advantages to their subscribers, chunk by chunk"""
+    fanout = subscription_fanout(config)
+    if fanout is None or not len(fanout):
+        return
+    sends = 0
+    for emails, phones, message, subject in fanout.deliveries(
+        time.time(),
+        config["notifications"]["digest"],
+        config["message"]["signature"],
+    ):
+        deliver(message, subject, config, emails, phones)
+        sends += 1
+    logger.info(f"Sent {sends} messages to subscribers")
+
+
+def deliver(message, subject, config, emails=None, phones=None):
+    """
+    Send the message via configured channels
+
+    Args:
+        message: The message content
+        subject: Email subject
+        config: Loaded configuration (with credentials)
+        emails: Email recipients instead of [email] to (optional)
+        phones: SMS recipients instead of [sms] to_numbers (optional)
+    """
+    sender_config = build_sender_config(config, subject)
+    if sender_config is None:
+        return
+
+    # Address subscribers instead of the configured recipients
+    if emails is not None and "email_config" in sender_config:
+        sender_config["email_config"]["receiver_email"] = emails
+        sender_config["send_email"] = sender_config["send_email"] and bool(emails)
+    if phones is not None and "sms_config" in sender_config:
+        sender_config["sms_config"]["to_numbers"] = phones
+        sender_config["sms_config"].pop("to_number", None)
+        sender_config["send_sms"] = sender_config["send_sms"] and bool(phones)
+
+    # Only attempt to send if at least one channel is enabled
+    if sender_config.get("send_email", False) or sender_config.get("send_sms", False):
+        logger.info("Sending message...")
+        send_results = send_message(message, sender_config)
+
+        # Log the results
+        for channel, success in send_results.items():
+            if success:
+                logger.info(f"Message sent successfully via {channel}")
+            else:
+                logger.error(f"Failed to send message via {channel}")
+    else:
+        logger.warning(
+            "No messaging channels enabled or all were skipped due to missing credentials"
+        )
+
+
+def process_pair(
+    our_city, their_city, our_city_weather, their_city_weather, config, state=None
+):
+    """
+    Compare a pair of cities and notify if our city has better conditions
 
-    # Get weather data for both cities
-    our_city_weather = get_weather(OUR_CITY, api_key, use_mock)
-    their_city_weather = get_weather(THEIR_CITY, api_key, use_mock)
+    Args:
+        our_city: Name of our city
+        their_city: Name of their city
+        our_city_weather: Weather data for our city
+        their_city_weather: Weather data for their city
+        config: Loaded configuration (with credentials)
+        state: Change detection state to check and update (optional)
+
+    Returns:
+        str: The advantage reason, or None if there is none or the pair
+             was skipped because nothing changed
+    """
+    min_temp = config["temperature"]["min_comfortable"]
+    max_temp = config["temperature"]["max_comfortable"]
+    comfort_range = comfort_signature(config)
+
+    # Skip the pair entirely if neither observation changed since last run
+    track_state = bool(state is not None and our_city_weather and their_city_weather)
+    if track_state and not pair_changed(
+        state, our_city, their_city, our_city_weather, their_city_weather, comfort_range
+    ):
+        logger.info(f"No new observations for {our_city} vs {their_city} - skipping")
+        return None
 
     # Log current weather information
     if our_city_weather:
         logger.info(
-            f"{OUR_CITY}: {our_city_weather['weather'][0]['main']} - {our_city_weather['weather'][0]['description']}"
+            f"{our_city}: {our_city_weather['weather'][0]['main']} - {our_city_weather['weather'][0]['description']}"
         )
     if their_city_weather:
         logger.info(
-            f"{THEIR_CITY}: {their_city_weather['weather'][0]['main']} - {their_city_weather['weather'][0]['description']}"
+            f"{their_city}: {their_city_weather['weather'][0]['main']} - {their_city_weather['weather'][0]['description']}"
         )
 
-    # Compare weather conditions
-    our_city_sunny = is_sunny(our_city_weather)
-    their_city_rainy = is_rainy(their_city_weather)
-
-    # Compare temperature conditions
-    min_temp = config["temperature"]["min_comfortable"]
-    max_temp = config["temperature"]["max_comfortable"]
-    our_temp_comfortable = is_temperature_comfortable(
-        our_city_weather, min_temp, max_temp
-    )
-    their_temp_comfortable = is_temperature_comfortable(
-        their_city_weather, min_temp, max_temp
-    )
+    # Compare weather and temperature conditions
+    with span("compare", our_city=our_city, their_city=their_city):
+        comparison = compare_weather(
+            our_city_weather,
+            their_city_weather,
+            min_temp,
+            max_temp,
+            get_comfort_table(config),
+            our_city,
+            their_city,
+        )
+    our_temp_comfortable = comparison["our_temp_comfortable"]
+    their_temp_comfortable = comparison["their_temp_comfortable"]
+    # The comfort profile of each city for its observation
+    our_limits = comfort_limits(config, our_city, our_city_weather)
+    their_limits = comfort_limits(config, their_city, their_city_weather)
 
     # Log temperature information
     our_temp = get_temperature(our_city_weather)
     their_temp = get_temperature(their_city_weather)
     if our_temp and their_temp:
         logger.info(
-            f"Temperature - {OUR_CITY}: {our_temp}°C, {THEIR_CITY}: {their_temp}°C"
+            f"Temperature - {our_city}: {our_temp}°C, {their_city}: {their_temp}°C"
         )
-        logger.info(f"Comfort range: {min_temp}°C - {max_temp}°C")
+        if our_limits == their_limits:
+            logger.info(f"Comfort range: {our_limits[0]:g}°C - {our_limits[1]:g}°C")
+        else:
+            logger.info(
+                f"Comfort range - {our_city}: {our_limits[0]:g}°C - {our_limits[1]:g}°C, {their_city}: {their_limits[0]:g}°C - {their_limits[1]:g}°C"
+            )
         logger.info(
-            f"Temperature comfort - {OUR_CITY}: {our_temp_comfortable}, {THEIR_CITY}: {their_temp_comfortable}"
+            f"Temperature comfort - {our_city}: {our_temp_comfortable}, {their_city}: {their_temp_comfortable}"
         )
 
-    # Determine why we have better conditions
-    # Only count weather as better if we have good weather (sunny) AND they have bad weather (rainy)
-    weather_better = our_city_sunny and their_city_rainy
-
-    # Only count temperature as better if our temperature is comfortable AND theirs is not
-    temp_better = our_temp_comfortable and not their_temp_comfortable
-
     # Determine message reason
-    reason = None
-    if weather_better and temp_better:
-        reason = "both"
-        logger.info(f"Better in {OUR_CITY}! (weather and temperature)")
-    elif weather_better:
-        reason = "weather"
-        logger.info(f"Better in {OUR_CITY}! (weather)")
-    elif temp_better:
-        reason = "temperature"
-        logger.info(f"Better in {OUR_CITY}! (temperature)")
+    reason = comparison["reason"]
+    if reason == "both":
+        logger.info(f"Better in {our_city}! (weather and temperature)")
+    elif reason:
+        logger.info(f"Better in {our_city}! ({reason})")
+
+    # Only notify when the advantage flipped and no cooldown applies
+    send = bool(reason)
+    if track_state:
+        send = record_evaluation(
+            state,
+            our_city,
+            their_city,
+            our_city_weather,
+            their_city_weather,
+            comfort_range,
+            reason,
+            config["notifications"],
+        )
 
     # Check if our city has better conditions
-    if reason:
+    if reason and send:
         # Construct and display the message
         message, subject = construct_message(
             our_city_weather,
             their_city_weather,
-            OUR_CITY,
-            THEIR_CITY,
-            min_temp,
-            max_temp,
+            our_city,
+            their_city,
+            *our_limits,
             reason,
             config["message"]["signature"],
+            cache=message_cache(config),
+            their_limits=their_limits,
         )
         logger.info(f"Subject: {subject}")
         logger.info(message)
 
-        # Send the message via configured channels
-        if config["email"]["enabled"] or config["sms"]["enabled"]:
-            # Prepare sender configuration
-            sender_config = {
-                "send_email": config["email"]["enabled"],
-                "send_sms": config["sms"]["enabled"],
-                "subject": subject,
-            }
-
-            # Add channel-specific configs if enabled
-            if config["email"]["enabled"]:
-                # Skip email if no password available
-                if not config["email"].get("password"):
-                    logger.warning("No email password available - skipping email")
-                    sender_config["send_email"] = False
-                else:
-                    # Prepare email config
-                    email_config = config["email"].copy()
-                    # Convert string 'to' to list if needed (for backward compatibility)
-                    if "to" in email_config and isinstance(email_config["to"], str):
-                        email_config["to"] = [email_config["to"]]
-                    # Map 'to' field to 'receiver_email' expected by send_email
-                    if "to" in email_config:
-                        email_config["receiver_email"] = email_config.pop("to")
-                    # Map 'from' field to 'sender_email' expected by send_email
-                    if "from" in email_config:
-                        email_config["sender_email"] = email_config.pop("from")
-                    sender_config["email_config"] = email_config
-
-            if config["sms"]["enabled"]:
-                # Skip SMS if credentials are missing
-                if not config["sms"].get("account_sid") or not config["sms"].get(
-                    "auth_token"
-                ):
-                    logger.warning("Missing Twilio credentials - skipping SMS")
-                    sender_config["send_sms"] = False
-                else:
-                    # Prepare SMS config
-                    sms_config = config["sms"].copy()
-                    # Handle both old and new config formats for backward compatibility
-                    if "to_number" in sms_config and "to_numbers" not in sms_config:
-                        sms_config["to_numbers"] = [sms_config["to_number"]]
-                    sender_config["sms_config"] = sms_config
-
-            # Only attempt to send if at least one channel is enabled
-            if sender_config.get("send_email", False) or sender_config.get(
-                "send_sms", False
-            ):
-                logger.info("Sending message...")
-                send_results = send_message(message, sender_config)
-
-                # Log the results
-                for channel, success in send_results.items():
-                    if success:
-                        logger.info(f"Message sent successfully via {channel}")
-                    else:
-                        logger.error(f"Failed to send message via {channel}")
-            else:
-                logger.warning(
-                    "No messaging channels enabled or all were skipped due to missing credentials"
-                )
+        notify(message, subject, config, pair_topic(our_city, their_city))
+    elif reason:
+        logger.info(f"Advantage for {our_city} already reported - not notifying")
     else:
         conditions = []
 
         # Weather conditions
-        if our_city_sunny:
-            conditions.append(f"{OUR_CITY} is sunny")
+        if comparison["our_city_sunny"]:
+            conditions.append(f"{our_city} is sunny")
         else:
-            conditions.append(f"{OUR_CITY} is not sunny")
-        if their_city_rainy:
-            conditions.append(f"{THEIR_CITY} is rainy")
+            conditions.append(f"{our_city} is not sunny")
+        if comparison["their_city_rainy"]:
+            conditions.append(f"{their_city} is rainy")
         else:
-            conditions.append(f"{THEIR_CITY} is not rainy")
+            conditions.append(f"{their_city} is not rainy")
 
         # Temperature conditions
         if our_temp_comfortable:
-            conditions.append(f"{OUR_CITY} temperature is comfortable")
+            conditions.append(f"{our_city} temperature is comfortable")
         else:
-            conditions.append(f"{OUR_CITY} temperature is not comfortable")
+            conditions.append(f"{our_city} temperature is not comfortable")
         if not their_temp_comfortable:
-            conditions.append(f"{THEIR_CITY} temperature is not comfortable")
+            conditions.append(f"{their_city} temperature is not comfortable")
         else:
-            conditions.append(f"{THEIR_CITY} temperature is comfortable")
+            conditions.append(f"{their_city} temperature is comfortable")
 
-        logger.info(f"No advantage for {OUR_CITY} detected")
+        logger.info(f"No advantage for {our_city} detected")
         logger.info(f"Conditions: {', '.join(conditions)}")
 
+    return reason
+
+
+def process_pairs_sharded(pairs, weather, config, workers, seed, state=None):
+    """
+    Compare and render pairs across worker processes, then notify
+
+    Args:
+        pairs: List of (our_city, their_city) tuples
+        weather: Dictionary of city -> weather data
+        config: Loaded configuration (with credentials)
+        workers: Number of worker processes
+        seed: Seed for message rendering
+        state: Change detection state to check and update (optional)
+    """
+    comfort_range = comfort_signature(config)
+
+    # Only ship pairs with new observations to the workers
+    if state is not None:
+        pairs = [
+            (our_city, their_city)
+            for our_city, their_city in pairs
+            if not (weather[our_city] and weather[their_city])
+            or pair_changed(
+                state,
+                our_city,
+                their_city,
+                weather[our_city],
+                weather[their_city],
+                comfort_range,
+            )
+        ]
+
+    for result in evaluate_pairs_sharded(weather, pairs, config, workers, seed):
+        our_city = result["our_city"]
+        their_city = result["their_city"]
+        reason = result["reason"]
+
+        send = bool(reason)
+        if state is not None and weather[our_city] and weather[their_city]:
+            send = record_evaluation(
+                state,
+                our_city,
+                their_city,
+                weather[our_city],
+                weather[their_city],
+                comfort_range,
+                reason,
+                config["notifications"],
+            )
+
+        if reason and send:
+            logger.info(f"Better in {our_city} than {their_city}! ({reason})")
+            logger.info(f"Subject: {result['subject']}")
+            logger.info(result["message"])
+            notify(
+                result["message"],
+                result["subject"],
+                config,
+                pair_topic(our_city, their_city),
+            )
+
+
+def run(
+    pairs,
+    cities,
+    api_key,
+    config,
+    use_mock=None,
+    state=None,
+    workers=None,
+    seed=None,
+    known_weather=None,
+):
+    """
+    Fetch every city once and process each pair
+
+    Args:
+        pairs: List of (our_city, their_city) tuples
+        cities: Unique cities to fetch, in priority order
+        api_key: OpenWeatherMap API key
+        config: Loaded configuration (with credentials)
+        use_mock: Type of condition to mock (optional)
+        state: Change detection state (optional)
+        workers: Evaluate pairs on this many worker processes (optional)
+        seed: Seed for message rendering on workers (default: random)
+        known_weather: Earlier weather data for cities of the pairs that
+                       aren't fetched again (optional)
+
+    Returns:
+        dict: City -> weather data for the fetched cities
+    """
+    # Get weather data once per city, however many pairs it is in
+    observations = build_provider(config, api_key, use_mock).fetch_many(cities)
+    fetched = {
+        city: observation.to_weather_data() if observation else None
+        for city, observation in observations.items()
+    }
+    weather = dict(known_weather or {})
+    weather.update(fetched)
+
+    # Store observations for history queries (mock data would skew the stats)
+    if config["history"]["enabled"]:
+        if use_mock:
+            logger.debug("Not recording mock observations to history")
+        else:
+            record_history(pairs, cities, fetched, config, int(time.time()))
+
+    if workers:
+        if seed is None:
+            seed = random.randrange(2**32)
+        process_pairs_sharded(pairs, weather, config, workers, seed, state)
+    else:
+        for our_city, their_city in pairs:
+            process_pair(
+                our_city,
+                their_city,
+                weather[our_city],
+                weather[their_city],
+                config,
+                state,
+            )
+
+    if state is not None:
+        save_state(config["notifications"]["state_file"], state)
+
+    return fetched
+
+
+def run_forecast(pairs, cities, api_key, config, use_mock=None, state=None):
+    """
+    Compare each pair's forecasts and notify when an advantage window is due
+
+    The notifications of every upcoming window are scheduled and saved to
+    the forecast cache directory, with the slots their messages are built
+    from. Each run sends the ones that are due, including saved ones whose
+    window started since the last run; with --interval, run_loop wakes up
+    at the next scheduled time.
+
+    Args:
+        pairs: List of (our_city, their_city) tuples
+        cities: Unique cities to fetch, in priority order
+        api_key: OpenWeatherMap API key
+        config: Loaded configuration (with credentials)
+        use_mock: Type of condition to mock (optional)
+        state: Change detection state, used to notify each window once (optional)
+
+    Returns:
+        list: Scheduled notifications of every pair (see forecast.py)
+    """
+    min_temp = config["temperature"]["min_comfortable"]
+    max_temp = config["temperature"]["max_comfortable"]
+    settings = config["forecast"]
+    now = time.time()
+    scheduled = []
+
+    previous = {}
+    for notification in load_schedule(settings["cache_dir"]):
+        pair = (notification.get("our_city"), notification.get("their_city"))
+        previous.setdefault(pair, []).append(notification)
+
+    # One forecast per city replaces a current weather poll every slot
+    forecasts = {
+        city: get_forecast(
+            city,
+            api_key,
+            settings["cache_dir"],
+            settings["refresh_minutes"] * 60,
+            use_mock,
+            now,
+        )
+        for city in cities
+    }
+
+    for our_city, their_city in pairs:
+        our_slots = forecasts[our_city]
+        their_slots = forecasts[their_city]
+        windows = []
+        if not our_slots or not their_slots:
+            logger.error(f"No forecast for {our_city} vs {their_city}")
+        else:
+            windows = advantage_windows(
+                our_slots,
+                their_slots,
+                min_temp,
+                max_temp,
+                get_comfort_table(config),
+                our_city,
+                their_city,
+            )
+            if not windows:
+                logger.info(f"No forecast advantage for {our_city} over {their_city}")
+        for window in windows:
+            start = time.strftime("%a %H:%M", time.localtime(window["start"]))
+            end = time.strftime("%a %H:%M", time.localtime(window["end"]))
+            logger.info(
+                f"Forecast: better in {our_city} than {their_city} from {start} to {end} ({window['reason']})"
+            )
+
+        schedule = [
+            dict(
+                notification,
+                our_city=our_city,
+                their_city=their_city,
+                our_weather=our_slots[notification["our_slot"]],
+                their_weather=their_slots[notification["their_slot"]],
+            )
+            for notification in schedule_notifications(
+                windows, settings["lead_minutes"] * 60
+            )
+        ]
+        schedule = (
+            carried_over(previous.get((our_city, their_city), []), schedule, now)
+            + schedule
+        )
+        scheduled.extend(schedule)
+
+        key = f"forecast|{pair_key(our_city, their_city)}"
+        for notification in due_notifications(schedule, now):
+            if state is not None:
+                # A window overlapping one already sent is the same advantage
+                entry = state.get(key, {})
+                start = notification["start"]
+                if entry.get("notified_start") == start or start < entry.get(
+                    "notified_end", 0
+                ):
+                    logger.info(
+                        f"Forecast advantage for {our_city} already reported - not notifying"
+                    )
+                    continue
+                state[key] = {
+                    "notified_start": notification["start"],
+                    "notified_end": notification["end"],
+                }
+
+            message, subject = construct_message(
+                notification["our_weather"],
+                notification["their_weather"],
+                our_city,
+                their_city,
+                *comfort_limits(config, our_city, notification["our_weather"]),
+                notification["reason"],
+                config["message"]["signature"],
+                cache=message_cache(config),
+                their_limits=comfort_limits(
+                    config, their_city, notification["their_weather"]
+                ),
+            )
+            logger.info(f"Subject: {subject}")
+            logger.info(message)
+            notify(message, subject, config, pair_topic(our_city, their_city))
+
+    if state is not None:
+        save_state(config["notifications"]["state_file"], state)
+
+    save_schedule(settings["cache_dir"], scheduled)
+    return scheduled
+
+
+def run_region(our_city, count, api_key, config, use_mock=None, state=None):
+    """
+    Compare our city against every city around it, fetched in one request
+
+    Notifies when our city has the advantage over the whole region.
+
+    Args:
+        our_city: Name of our city
+        count: Number of nearby cities to compare against
+        api_key: OpenWeatherMap API key
+        config: Loaded configuration (with credentials)
+        use_mock: Type of condition to mock (optional)
+        state: Change detection state, used to notify each streak once (optional)
+
+    Returns:
+        dict: City name -> advantage reason for each city in the region
+    """
+    our_city_weather = get_weather(our_city, api_key, use_mock)
+    center = region_center(our_city, our_city_weather, config["api"]["country"])
+    if not our_city_weather or center is None:
+        logger.error(f"Could not locate {our_city} for a regional comparison")
+        return {}
+
+    # Ask for one extra city since the closest one is usually our own
+    region = get_region(center[0], center[1], count + 1, api_key, use_mock)
+    region = {
+        city: weather_data
+        for city, weather_data in region.items()
+        if city.lower() != our_city.lower()
+    }
+    region = dict(list(region.items())[:count])
+
+    reasons = compare_region(
+        our_city_weather,
+        region,
+        config["temperature"]["min_comfortable"],
+        config["temperature"]["max_comfortable"],
+        get_comfort_table(config),
+        our_city,
+    )
+    for city, reason in reasons.items():
+        if reason:
+            logger.info(f"Better in {our_city} than {city}! ({reason})")
+    wins = sum(1 for reason in reasons.values() if reason)
+    logger.info(f"{our_city} has the advantage over {wins} of {len(reasons)} cities")
+
+    beats_all = bool(reasons) and wins == len(reasons)
+    send = beats_all
+    if state is not None:
+        key = f"region|{our_city}"
+        send = beats_all and not state.get(key, {}).get("beats_all")
+        state[key] = {"beats_all": beats_all}
+        save_state(config["notifications"]["state_file"], state)
+
+    if send:
+        message, subject = construct_region_message(
+            our_city, reasons, config["message"]["signature"]
+        )
+        logger.info(f"Subject: {subject}")
+        logger.info(message)
+        notify(message, subject, config, region_topic(our_city))
+    elif beats_all:
+        logger.info(f"Regional advantage for {our_city} already reported - not notifying")
+
+    return reasons
+
+
+def run_once(args, pairs, cities, api_key, config, use_mock, state):
+    """
+    Run the selected mode once
+
+    Returns:
+        float: When the next forecast notification is scheduled (or None)
+    """
+    if args.region:
+        run_region(
+            config["cities"]["our_city"],
+            args.region,
+            api_key,
+            config,
+            use_mock,
+            state,
+        )
+    elif args.forecast:
+        schedule = run_forecast(pairs, cities, api_key, config, use_mock, state)
+        return next_send_at(schedule, time.time())
+    elif args.use_async:
+        asyncio.run(main_async(pairs, cities, api_key, config, use_mock, state))
+    else:
+        run(
+            pairs,
+            cities,
+            api_key,
+            config,
+            use_mock,
+            state,
+            args.workers,
+            args.seed,
+        )
+
+
+def run_adaptive(args, pairs, api_key, config, use_mock, state):
+    """Keep running, fetching each city only when it is due (--adaptive)"""
+    settings = config["polling"]
+    scheduler = PollScheduler(
+        settings["min_interval"],
+        settings["max_interval"],
+        settings["grace"],
+        comfort=get_comfort_table(config),
+        min_temp=config["temperature"]["min_comfortable"],
+        max_temp=config["temperature"]["max_comfortable"],
+    )
+
+    while True:
+        due_pairs, due_cities = scheduler.due(pairs)
+        if due_pairs:
+            with span("run"):
+                retry_deferred(config)
+                weather = run(
+                    due_pairs,
+                    due_cities,
+                    api_key,
+                    config,
+                    use_mock,
+                    state,
+                    args.workers,
+                    args.seed,
+                    known_weather=scheduler.weather,
+                )
+                send_digests(config)
+                send_subscriptions(config)
+            fresh = [
+                city
+                for city in due_cities
+                if scheduler.observe(city, weather.get(city))
+            ]
+            scheduler.schedule(pairs, due_cities)
+            flush_traces()
+            log_metrics()
+            logger.info(
+                f"Polled {len(due_cities)} cities ({len(fresh)} with new observations)"
+            )
+
+        wait = max(0.0, scheduler.next_poll(pairs) - time.time())
+        logger.debug(f"Next poll in {wait:.0f}s")
+        time.sleep(wait)
+
+
+def run_stream(path, config, api_key, use_mock=None):
+    """Compare the pairs read from path ("-": stdin), writing NDJSON to stdout"""
+    fetch = functools.partial(get_weather, api_key=api_key, mock_type=use_mock)
+    source = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        counts = stream_pairs(
+            read_pairs(source, config["cities"]["our_city"]),
+            fetch,
+            sys.stdout.buffer,
+            config["stream"]["concurrency"],
+            config["temperature"]["min_comfortable"],
+            config["temperature"]["max_comfortable"],
+            get_comfort_table(config),
+        )
+    except BrokenPipeError:
+        # The reader closed the pipe (e.g. | head): stop quietly. Python
+        # flushes stdout again at exit, so point it at devnull first.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.close(devnull)
+        logger.debug("Output closed - stopped streaming")
+        return
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    logger.info(
+        f"Streamed {counts['pairs']} pairs ({counts['advantages']} advantages, "
+        f"{counts['errors']} errors)"
+    )
+
+
+def run_loop(args, pairs, cities, api_key, config, use_mock, state):
+    """Run the selected mode once, or every --interval seconds"""
+    if args.adaptive:
+        if args.region or args.forecast or args.use_async:
+            logger.warning("--adaptive only applies to pair comparisons, ignoring it")
+        else:
+            run_adaptive(args, pairs, api_key, config, use_mock, state)
+            return
+
+    while True:
+        with span("run"):
+            retry_deferred(config)
+            wake_at = run_once(args, pairs, cities, api_key, config, use_mock, state)
+            send_digests(config, force=not args.interval)
+            send_subscriptions(config)
+        flush_traces()
+        log_metrics()
+
+        # Keep comparing on a fixed schedule if requested
+        if not args.interval:
+            break
+        delay = args.interval
+        if wake_at is not None:
+            # Wake up early for a scheduled forecast notification
+            delay = min(delay, max(wake_at - time.time(), 0))
+        time.sleep(delay)
+
+
+def main():
+    # Parse command-line arguments
+    args = parse_args()
+
+    # Load configuration
+    config = load_config(args.config)
+
+    # Configure logging
+    logging_level = getattr(logging, config["logging"]["level"])
+    logging.basicConfig(level=logging_level, format=config["logging"]["format"])
+
+    # Enable debug logging if requested
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+        logger.debug("Debug logging enabled")
+
+    if args.import_subscribers:
+        store = SubscriptionStore(config["subscriptions"]["path"])
+        count = store.import_csv(args.import_subscribers)
+        store.close()
+        logger.info(
+            f"Imported {count} subscribers into {config['subscriptions']['path']}"
+        )
+        return
+
+    # Resolve city names for the configured country
+    set_base_url(config["api"]["base_url"])
+    set_country(config["api"]["country"])
+
+    # Get city pairs from config
+    pairs = get_city_pairs(config)
+
+    # Or compare our city against every city nearby
+    if args.within:
+        our_city = config["cities"]["our_city"]
+        nearby = load_gazetteer().cities_within(
+            our_city, args.within, config["api"]["country"]
+        )
+        logger.info(f"{len(nearby)} cities within {args.within:g} km of {our_city}")
+        pairs = [(our_city, city) for city in nearby]
+    cities = prioritize_cities(pairs)
+
+    # Get credentials
+    api_key, config = get_credentials(config)
+
+    # Check if we should use mock data
+    use_mock = args.mock
+    if use_mock:
+        logger.info(f"Using mock weather data mode: {use_mock}")
+
+    # Replayed runs never touch the network, history or state
+    if args.replay:
+        start_replay(args.replay, args.replay_speed)
+        api_key = api_key or "replay"
+        config["history"]["enabled"] = False
+    elif args.record:
+        start_recording(args.record)
+
+    # Pace API calls to stay within the OpenWeatherMap quota
+    if not use_mock and not args.replay:
+        set_rate_limit(config["api"]["calls_per_minute"])
+
+    # Keep observations between runs so repeat fetches can be coalesced
+    if not use_mock:
+        max_age = config["api"]["cache_max_age"]
+        max_stale = config["api"]["cache_max_stale"]
+        if args.adaptive:
+            max_age, max_stale = cache_limits(
+                max_age, max_stale, config["polling"]["min_interval"]
+            )
+        enable_cache(max_age, max_stale)
+
+    # Avoid downloading and parsing observations that haven't changed
+    if not use_mock and not args.replay and config["api"]["conditional_requests"]:
+        enable_conditional_requests()
+
+    # Fail fast on degraded SMTP servers and Twilio numbers, keeping their
+    # sends for a later run (replayed runs don't keep failed sends)
+    delivery_settings = dict(config["delivery"])
+    if args.replay:
+        delivery_settings["outbox"] = ""
+    delivery.configure(delivery_settings)
+
+    # Stream and server modes only compare: no state, history or notifications
+    if args.stream:
+        run_stream(args.stream, config, api_key, use_mock)
+        stop_recording()
+        return
+    if args.serve:
+        try:
+            serve(config, api_key, use_mock)
+        finally:
+            stop_recording()
+        return
+
+    # Load change detection state (mock data and --force always evaluate)
+    state = None
+    state_file = config["notifications"]["state_file"]
+    if (
+        config["notifications"]["change_detection"]
+        and not use_mock
+        and not args.force
+        and not args.replay
+    ):
+        state = load_state(state_file)
+
+    # Export spans for every run if requested
+    if args.trace:
+        configure_tracing(args.trace)
+
+    # Allow profiling a long-running process without restarting it
+    if args.interval or args.adaptive:
+        install_signal_toggle(args.profile_dir, args.profile_seconds)
+
+    try:
+        if args.profile:
+            with profiled(args.profile, args.profile_dir):
+                run_loop(args, pairs, cities, api_key, config, use_mock, state)
+        else:
+            run_loop(args, pairs, cities, api_key, config, use_mock, state)
+    finally:
+        stop_recording()
+        configure_tracing(None)
+
 
 if __name__ == "__main__":
     main()
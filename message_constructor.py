@@ -1,5 +1,9 @@
 import logging
 import random
+from collections import OrderedDict
+from functools import lru_cache
+
+from tracing import traced
 
 logger = logging.getLogger("weathermark.message")
 
@@ -127,6 +131,7 @@ TEMPERATURE_STATEMENTS = [
 ]
 
 
+@lru_cache(maxsize=512)
 def get_temperature_condition(temp, min_comfortable, max_comfortable):
     """Determine if temperature is too hot, too cold, or just right"""
     if temp < min_comfortable:
@@ -137,6 +142,7 @@ def get_temperature_condition(temp, min_comfortable, max_comfortable):
         return "comfortable"
 
 
+@lru_cache(maxsize=512)
 def get_weather_emoji(weather_description):
     """Return an appropriate emoji based on the weather description"""
     weather_description = weather_description.lower()
@@ -165,6 +171,7 @@ def get_weather_emoji(weather_description):
         return "🌡️"  # Default to thermometer if no match
 
 
+@lru_cache(maxsize=512)
 def get_temperature_emoji(
     temp, min_comfortable, max_comfortable, show_comfortable=True
 ):
@@ -193,6 +200,97 @@ def get_temperature_emoji(
         return ""  # No emoji
 
 
+class MessageCache:
+    """
+    LRU cache of rendered messages keyed by their render key
+
+    Pairs with the same rounded temperatures, descriptions, reason, cities
+    and signature render to interchangeable messages, so the first one
+    rendered can be reused for the rest.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return the cached (message, subject) for a key, or None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        """Store a rendered (message, subject), evicting the least recently used"""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+def render_key(
+    our_city_data,
+    their_city_data,
+    our_city,
+    their_city,
+    min_comfortable,
+    max_comfortable,
+    reason,
+    signature,
+    their_limits=None,
+):
+    """
+    Return everything a rendered message depends on, apart from the RNG
+
+    Returns:
+        tuple: Hashable key for MessageCache
+    """
+    return (
+        our_city_data["weather"][0]["description"],
+        their_city_data["weather"][0]["description"],
+        round(our_city_data["main"]["temp"]),
+        round(their_city_data["main"]["temp"]),
+        our_city,
+        their_city,
+        min_comfortable,
+        max_comfortable,
+        reason,
+        signature,
+        their_limits,
+    )
+
+
+def message_cache(config):
+    """
+    Return the render cache of a configuration
+
+    Reusing a rendered message gives every identical comparison the same
+    randomly chosen wording, so it is only done when [message]
+    reuse_rendered is set.
+
+    Returns:
+        MessageCache: The cache, or None when reuse is off
+    """
+    settings = config["message"]
+    if not settings.get("reuse_rendered"):
+        return None
+    cache = config.get("message_cache")
+    if cache is None:
+        cache = config["message_cache"] = MessageCache(
+            settings.get("render_cache_size", 1024)
+        )
+    return cache
+
+
+@traced("construct_message", "reason")
 def construct_message(
     our_city_data,
     their_city_data,
@@ -202,6 +300,9 @@ def construct_message(
     max_comfortable=26,
     reason="weather",
     signature="WeatherMark",
+    rng=None,
+    cache=None,
+    their_limits=None,
 ):
     """
     Construct a message based on weather data when our city has better weather
@@ -211,16 +312,54 @@ def construct_message(
         their_city_data: Weather data for their city
         our_city: Name of our city
         their_city: Name of their city
-        min_comfortable: Minimum comfortable temperature (Celsius)
-        max_comfortable: Maximum comfortable temperature (Celsius)
+        min_comfortable: Minimum comfortable temperature (Celsius) in our city
+        max_comfortable: Maximum comfortable temperature (Celsius) in our city
         reason: The reason for the better conditions ("weather", "temperature", or "both")
         signature: Signature to include at the end of the message
+        rng: random.Random instance used to pick statements (optional,
+             default: the global random module)
+        cache: MessageCache to reuse an identical earlier rendering from
+               (optional; rng is only drawn from on a miss)
+        their_limits: (min, max) comfortable temperature in their city, when
+                      its comfort profile differs from ours (optional)
 
     Returns:
         tuple: (message, subject) where message is the formatted message and 
                subject is a dynamic subject line for email
     """
+    if cache is not None:
+        key = render_key(
+            our_city_data,
+            their_city_data,
+            our_city,
+            their_city,
+            min_comfortable,
+            max_comfortable,
+            reason,
+            signature,
+            their_limits,
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            logger.debug(f"Reusing rendered {reason} message")
+            return cached
+        rendered = construct_message(
+            our_city_data,
+            their_city_data,
+            our_city,
+            their_city,
+            min_comfortable,
+            max_comfortable,
+            reason,
+            signature,
+            rng,
+            their_limits=their_limits,
+        )
+        cache.put(key, rendered)
+        return rendered
+
     logger.debug(f"Constructing message with {reason} data")
+    rng = rng or random
 
     # Get weather descriptions
     our_weather = our_city_data["weather"][0]["description"]
@@ -231,16 +370,15 @@ def construct_message(
     their_temp = round(their_city_data["main"]["temp"])
 
     # Determine temperature conditions
-    their_temp_condition = get_temperature_condition(
-        their_temp, min_comfortable, max_comfortable
-    )
+    their_min, their_max = their_limits or (min_comfortable, max_comfortable)
+    their_temp_condition = get_temperature_condition(their_temp, their_min, their_max)
 
     # Select random greeting
-    greeting = random.choice(GREETINGS)
+    greeting = rng.choice(GREETINGS)
 
     # Determine which type of statement to use based on the reason
     if reason == "weather" or reason == "both":
-        weather_statement = random.choice(WEATHER_STATEMENTS).format(
+        weather_statement = rng.choice(WEATHER_STATEMENTS).format(
             our_city=our_city, their_city=their_city
         )
     else:
@@ -260,7 +398,7 @@ def construct_message(
             # but just in case, use the generic statements
             temp_statements = TEMPERATURE_STATEMENTS[24:]
 
-        temp_statement = random.choice(temp_statements).format(
+        temp_statement = rng.choice(temp_statements).format(
             our_city=our_city, their_city=their_city
         )
     else:
@@ -303,7 +441,7 @@ def construct_message(
         our_temp, min_comfortable, max_comfortable, show_comfortable=True
     )
     their_temp_emoji = get_temperature_emoji(
-        their_temp, min_comfortable, max_comfortable, show_comfortable=False
+        their_temp, their_min, their_max, show_comfortable=False
     )
 
     # Add specific conditions with emojis
@@ -335,12 +473,12 @@ def construct_message(
             subj for subj in SUBJECT_LINES 
             if not any(w in subj.lower() for w in ["weather", "sunshine", "forecast"])
         ]
-        subject = random.choice(temp_subjects or SUBJECT_LINES).format(
+        subject = rng.choice(temp_subjects or SUBJECT_LINES).format(
             our_city=our_city, their_city=their_city
         )
     else:
         # Use any subject line for weather or both reasons
-        subject = random.choice(SUBJECT_LINES).format(
+        subject = rng.choice(SUBJECT_LINES).format(
             our_city=our_city, their_city=their_city
         )
 
@@ -1,11 +1,18 @@
+import asyncio
+import contextvars
+import functools
 import logging
 import smtplib
 import socket
 import time
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 
+import delivery
+from tracing import span, traced
+
 # For SMS, we'll use Twilio
 try:
     from twilio.rest import Client as TwilioClient
@@ -14,13 +21,53 @@ try:
 except ImportError:
     TWILIO_AVAILABLE = False
 
+# Twilio's native asyncio client (needs aiohttp)
+try:
+    from twilio.http.async_http_client import AsyncTwilioHttpClient
+
+    TWILIO_ASYNC_AVAILABLE = TWILIO_AVAILABLE
+except ImportError:
+    TWILIO_ASYNC_AVAILABLE = False
+
 logger = logging.getLogger("weathermark.sender")
 
 
+def email_recipients(config):
+    """Return the receiver_email of an email config as a list"""
+    # Ensure recipients list is a list (for backward compatibility)
+    recipients = config["receiver_email"]
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    return list(recipients)
+
+
+def sms_recipients(config):
+    """Return the to_numbers (and legacy to_number) of an SMS config"""
+    recipients = list(config.get("to_numbers", []))
+    # Handle legacy single recipient config
+    if isinstance(config.get("to_number"), str):
+        recipients.append(config["to_number"])
+    return recipients
+
+
+def email_breaker(config):
+    """Return the circuit breaker of an email config's SMTP server"""
+    return delivery.breaker("email", f"{config['smtp_server']}:{config['smtp_port']}")
+
+
+def sms_endpoint(config):
+    """Return the endpoint name of an SMS config's Twilio sender"""
+    return f"twilio:{config['from_number']}"
+
+
+@traced("send_email")
 def send_email(message, subject, config):
     """
     Send an email with the weather message to all recipients
 
+    Recipients the message couldn't be sent to, including all of them while
+    the SMTP server's circuit breaker is open, are deferred to the outbox.
+
     Args:
         message: The message content
         subject: Email subject
@@ -35,16 +82,36 @@ def send_email(message, subject, config):
     Returns:
         bool: Success status
     """
+    failed = email_failures(message, subject, config)
+    if failed is None:
+        return False
+    delivery.defer("email", message, subject, failed)
+    return not failed
+
+
+def email_failures(message, subject, config):
+    """
+    Send an email to all recipients (takes the same arguments as send_email)
+
+    Returns:
+        list: Recipients the email wasn't sent to, or None if the server
+              rejected the credentials (retrying won't help)
+    """
     logger.debug("Preparing to send email")
     timeout = config.get("timeout", 10)  # Default timeout of 10 seconds
-    
-    # Ensure recipients list is a list (for backward compatibility)
-    recipients = config["receiver_email"]
-    if isinstance(recipients, str):
-        recipients = [recipients]
-    
-    # Track success for each recipient
-    all_success = True
+    recipients = email_recipients(config)
+
+    # Don't wait out the timeout of a server that keeps failing
+    breaker = email_breaker(config)
+    if not breaker.allow():
+        logger.warning(
+            f"SMTP server {config['smtp_server']} is failing - not sending email"
+        )
+        return recipients
+
+    # Track the recipients we couldn't send to
+    failed = []
+    timed_out = False
 
     try:
         # Debug info
@@ -55,12 +122,14 @@ def send_email(message, subject, config):
         # Connect to server with timeout
         start_time = time.time()
         try:
-            server = smtplib.SMTP(
-                config["smtp_server"], config["smtp_port"], timeout=timeout
-            )
+            with span("smtp.connect", server=config["smtp_server"]):
+                server = smtplib.SMTP(
+                    config["smtp_server"], config["smtp_port"], timeout=timeout
+                )
         except (socket.timeout, socket.gaierror, ConnectionRefusedError) as e:
             logger.error(f"Failed to connect to SMTP server: {e}")
-            return False
+            breaker.record_failure()
+            return recipients
 
         logger.debug("SMTP connection established")
 
@@ -69,15 +138,17 @@ def send_email(message, subject, config):
             server.sock.settimeout(timeout)
 
             # Start TLS
-            server.starttls()
+            with span("smtp.starttls"):
+                server.starttls()
             logger.debug("TLS started")
 
             # Login
-            server.login(config["sender_email"], config["password"])
+            with span("smtp.login"):
+                server.login(config["sender_email"], config["password"])
             logger.debug("Login successful")
             
             # Send to each recipient
-            for recipient in recipients:
+            for index, recipient in enumerate(recipients):
                 try:
                     # Create message
                     email = MIMEMultipart()
@@ -89,17 +160,31 @@ def send_email(message, subject, config):
                     email.attach(MIMEText(message, "plain"))
                     
                     # Send message
-                    server.send_message(email)
+                    with span("smtp.send", recipient=recipient):
+                        server.send_message(email)
                     logger.info(f"Email sent successfully to {recipient}")
+                except socket.timeout:
+                    # The rest would wait out the timeout too: leave them
+                    # for the outbox
+                    logger.error(f"SMTP send timed out after {timeout} seconds")
+                    breaker.record_failure()
+                    failed.extend(recipients[index:])
+                    timed_out = True
+                    break
                 except Exception as e:
                     logger.error(f"Failed to send email to {recipient}: {e}")
-                    all_success = False
+                    failed.append(recipient)
 
             # Close connection
-            server.quit()
+            try:
+                server.quit()
+            except Exception:
+                pass
+            if not timed_out:
+                breaker.record_success()
 
             elapsed = time.time() - start_time
-            if all_success:
+            if not failed:
                 logger.info(
                     f"Email sent successfully to all recipients in {elapsed:.2f} seconds"
                 )
@@ -107,38 +192,49 @@ def send_email(message, subject, config):
                 logger.warning(
                     f"Email sending completed with some failures in {elapsed:.2f} seconds"
                 )
-            return all_success
+            return failed
 
         except smtplib.SMTPAuthenticationError:
+            # Retrying with the same credentials can't succeed
             logger.error("SMTP authentication failed. Check username and password.")
-            server.quit()
-            return False
+            breaker.record_failure()
+            try:
+                server.quit()
+            except Exception:
+                pass
+            return None
 
         except socket.timeout:
             logger.error(f"SMTP operation timed out after {timeout} seconds")
+            breaker.record_failure()
             try:
                 server.quit()
             except:
                 pass
-            return False
+            return recipients
 
         except Exception as e:
             logger.error(f"SMTP error during sending: {e}")
+            breaker.record_failure()
             try:
                 server.quit()
             except:
                 pass
-            return False
+            return recipients
 
     except Exception as e:
         logger.error(f"Failed to send email: {e}")
-        return False
+        breaker.record_failure()
+        return recipients
 
 
 def send_sms(message, config):
     """
     Send an SMS with the weather message using Twilio to all recipients
 
+    Recipients the message couldn't be sent to, including the rest of them
+    once the sender's circuit breaker opens, are deferred to the outbox.
+
     Args:
         message: The message content
         config: Dictionary containing SMS configuration:
@@ -154,43 +250,84 @@ def send_sms(message, config):
         logger.error("Twilio package not installed. Install with: pip install twilio")
         return False
 
-    logger.debug("Preparing to send SMS")
-    
-    # Ensure recipients list is a list (for backward compatibility)
-    recipients = config.get("to_numbers", [])
-    if "to_number" in config:
-        # Handle legacy single recipient config
-        if isinstance(config["to_number"], str):
-            recipients.append(config["to_number"])
-    
-    if not recipients:
+    if not sms_recipients(config):
         logger.error("No SMS recipients specified")
         return False
-    
-    # Track success for each recipient
-    all_success = True
+
+    failed = sms_failures(message, config)
+    delivery.defer("sms", message, "", failed)
+    return not failed
+
+
+def sms_failures(message, config):
+    """
+    Send an SMS to all recipients (takes the same arguments as send_sms)
+
+    Recipients are sent to in rounds of as many concurrent requests as the
+    sender's adaptive limit allows, and the rest are failed fast as soon as
+    its circuit breaker opens.
+
+    Returns:
+        list: Recipients the SMS wasn't sent to
+    """
+    logger.debug("Preparing to send SMS")
+    recipients = sms_recipients(config)
+
+    endpoint = sms_endpoint(config)
+    breaker = delivery.breaker("sms", endpoint)
+    limit = delivery.limit("sms", endpoint)
 
     try:
         # Initialize Twilio client
         client = TwilioClient(config["account_sid"], config["auth_token"])
-        
-        # Send to each recipient
-        for recipient in recipients:
-            try:
-                # Send message
+    except Exception as e:
+        logger.error(f"Failed to initialize Twilio client: {e}")
+        return recipients
+
+    def send_one(recipient):
+        start = time.perf_counter()
+        try:
+            # Send message
+            with span("twilio.create", recipient=recipient):
                 sms = client.messages.create(
                     body=message, from_=config["from_number"], to=recipient
                 )
-                logger.info(f"SMS sent successfully to {recipient} (SID: {sms.sid})")
-            except Exception as e:
-                logger.error(f"Failed to send SMS to {recipient}: {e}")
-                all_success = False
-        
-        return all_success
+        except Exception as e:
+            logger.error(f"Failed to send SMS to {recipient}: {e}")
+            breaker.record_failure()
+            limit.record(time.perf_counter() - start, ok=False)
+            return False
+        logger.info(f"SMS sent successfully to {recipient} (SID: {sms.sid})")
+        breaker.record_success()
+        limit.record(time.perf_counter() - start)
+        return True
+
+    failed = []
+    pending = recipients
+    with ThreadPoolExecutor(limit.maximum) as pool:
+        while pending:
+            if not breaker.allow():
+                logger.warning(
+                    f"Twilio sender {config['from_number']} is failing"
+                    f" - not sending to {len(pending)} recipients"
+                )
+                failed.extend(pending)
+                break
+            # Only one trial send while the breaker is half open
+            size = 1 if breaker.state == delivery.HALF_OPEN else limit.size
+            batch, pending = pending[:size], pending[size:]
+            # Run in copies of our context so the spans keep their parent
+            sent = [
+                pool.submit(contextvars.copy_context().run, send_one, recipient)
+                for recipient in batch
+            ]
+            failed.extend(
+                recipient
+                for recipient, future in zip(batch, sent)
+                if not future.result()
+            )
 
-    except Exception as e:
-        logger.error(f"Failed to initialize Twilio client: {e}")
-        return False
+    return failed
 
 
 def send_message(message, config):
@@ -229,3 +366,227 @@ def send_message(message, config):
             results["sms"] = False
 
     return results
+
+
+def build_sender_config(config, subject):
+    """
+    Prepare the send_message configuration from the loaded config
+
+    Returns:
+        dict: Sender configuration, or None if no channel is enabled
+    """
+    if not config["email"]["enabled"] and not config["sms"]["enabled"]:
+        return None
+
+    # Prepare sender configuration
+    sender_config = {
+        "send_email": config["email"]["enabled"],
+        "send_sms": config["sms"]["enabled"],
+        "subject": subject,
+    }
+
+    # Add channel-specific configs if enabled
+    if config["email"]["enabled"]:
+        # Skip email if no password available
+        if not config["email"].get("password"):
+            logger.warning("No email password available - skipping email")
+            sender_config["send_email"] = False
+        else:
+            # Prepare email config
+            email_config = config["email"].copy()
+            # Convert string 'to' to list if needed (for backward compatibility)
+            if "to" in email_config and isinstance(email_config["to"], str):
+                email_config["to"] = [email_config["to"]]
+            # Map 'to' field to 'receiver_email' expected by send_email
+            if "to" in email_config:
+                email_config["receiver_email"] = email_config.pop("to")
+            # Map 'from' field to 'sender_email' expected by send_email
+            if "from" in email_config:
+                email_config["sender_email"] = email_config.pop("from")
+            sender_config["email_config"] = email_config
+
+    if config["sms"]["enabled"]:
+        # Skip SMS if credentials are missing
+        if not config["sms"].get("account_sid") or not config["sms"].get("auth_token"):
+            logger.warning("Missing Twilio credentials - skipping SMS")
+            sender_config["send_sms"] = False
+        else:
+            # Prepare SMS config
+            sms_config = config["sms"].copy()
+            # Handle both old and new config formats for backward compatibility
+            if "to_number" in sms_config and "to_numbers" not in sms_config:
+                sms_config["to_numbers"] = [sms_config["to_number"]]
+            sender_config["sms_config"] = sms_config
+
+    return sender_config
+
+
+def retry_deferred(config):
+    """
+    Retry the sends in the outbox that are due again
+
+    Entries whose channel is no longer configured stay in the outbox.
+
+    Args:
+        config: Loaded configuration (with credentials)
+
+    Returns:
+        int: Number of entries retried
+    """
+    outbox = delivery.open_outbox(create=False)
+    if outbox is None:
+        return 0
+
+    retried = 0
+    for entry in outbox.due():
+        sender_config = build_sender_config(config, entry["subject"])
+        channel = entry["channel"]
+        if sender_config is None or not sender_config.get(f"send_{channel}"):
+            continue
+
+        if channel == "email":
+            email_config = dict(
+                sender_config["email_config"], receiver_email=entry["recipients"]
+            )
+            failed = email_failures(entry["message"], entry["subject"], email_config)
+            if failed is None:
+                # Keep it for when the credentials have been fixed
+                continue
+        else:
+            sms_config = dict(sender_config["sms_config"], to_numbers=entry["recipients"])
+            sms_config.pop("to_number", None)
+            failed = sms_failures(entry["message"], sms_config)
+
+        outbox.settle(entry, failed)
+        retried += 1
+
+    if retried:
+        logger.info(f"Retried {retried} deferred sends")
+    return retried
+
+
+async def send_email_async(message, subject, config):
+    """
+    Send an email without blocking the event loop
+
+    smtplib is synchronous, so the send runs in the default executor.
+    Takes the same arguments as send_email.
+
+    Returns:
+        bool: Success status
+    """
+    loop = asyncio.get_running_loop()
+    # Run in a copy of our context so the SMTP spans keep their parent
+    send = functools.partial(
+        contextvars.copy_context().run, send_email, message, subject, config
+    )
+    return await loop.run_in_executor(None, send)
+
+
+async def send_sms_async(message, config):
+    """
+    Send an SMS to all recipients using Twilio's asyncio client
+
+    Sends concurrently in rounds limited like send_sms, and falls back to
+    running send_sms in the default executor when the async client is
+    unavailable. Takes the same arguments as send_sms.
+
+    Returns:
+        bool: Success status
+    """
+    if not TWILIO_ASYNC_AVAILABLE:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, send_sms, message, config)
+
+    recipients = sms_recipients(config)
+    if not recipients:
+        logger.error("No SMS recipients specified")
+        return False
+
+    endpoint = sms_endpoint(config)
+    breaker = delivery.breaker("sms", endpoint)
+    limit = delivery.limit("sms", endpoint)
+
+    http_client = AsyncTwilioHttpClient()
+    try:
+        client = TwilioClient(
+            config["account_sid"], config["auth_token"], http_client=http_client
+        )
+    except Exception as e:
+        logger.error(f"Failed to initialize Twilio client: {e}")
+        await http_client.close()
+        delivery.defer("sms", message, "", recipients)
+        return False
+
+    async def send_one(recipient):
+        start = time.perf_counter()
+        try:
+            with span("twilio.create", recipient=recipient):
+                sms = await client.messages.create_async(
+                    body=message, from_=config["from_number"], to=recipient
+                )
+        except Exception as e:
+            logger.error(f"Failed to send SMS to {recipient}: {e}")
+            breaker.record_failure()
+            limit.record(time.perf_counter() - start, ok=False)
+            return False
+        logger.info(f"SMS sent successfully to {recipient} (SID: {sms.sid})")
+        breaker.record_success()
+        limit.record(time.perf_counter() - start)
+        return True
+
+    # Only the recipients that weren't sent to are deferred
+    failed = []
+    pending = recipients
+    try:
+        while pending:
+            if not await breaker.allow_async():
+                logger.warning(
+                    f"Twilio sender {config['from_number']} is failing"
+                    f" - not sending to {len(pending)} recipients"
+                )
+                failed.extend(pending)
+                break
+            size = 1 if breaker.state == delivery.HALF_OPEN else limit.size
+            batch, pending = pending[:size], pending[size:]
+            results = await asyncio.gather(*(send_one(r) for r in batch))
+            failed.extend(r for r, ok in zip(batch, results) if not ok)
+    finally:
+        await http_client.close()
+
+    delivery.defer("sms", message, "", failed)
+    return not failed
+
+
+async def send_message_async(message, config):
+    """
+    Send message via the specified channels concurrently
+
+    Takes the same arguments as send_message.
+
+    Returns:
+        dict: Status of each sending method
+    """
+    subject = config.get("subject", "Weather Update")
+    channels = {}
+
+    if config.get("send_email", False):
+        if "email_config" in config:
+            channels["email"] = send_email_async(
+                message, subject, config["email_config"]
+            )
+        else:
+            logger.error("Email sending enabled but no email_config provided")
+
+    if config.get("send_sms", False):
+        if "sms_config" in config:
+            channels["sms"] = send_sms_async(message, config["sms_config"])
+        else:
+            logger.error("SMS sending enabled but no sms_config provided")
+
+    results = dict(zip(channels, await asyncio.gather(*channels.values())))
+    if config.get("send_email", False) and "email" not in results:
+        results["email"] = False
+    if config.get("send_sms", False) and "sms" not in results:
+        results["sms"] = False
+    return results
@@ -0,0 +1,96 @@
+import logging
+import threading
+
+logger = logging.getLogger("weathermark.metrics")
+
+
+class Metrics:
+    """
+    In-process counters, gauges and summaries
+
+    Counters only go up; gauges hold the latest value of a state (such as
+    a circuit breaker's); summaries keep the count, sum and maximum of the
+    values observed, which is enough for per-poll averages without keeping
+    every sample.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self.lock:
+            summary = self.summaries.setdefault(
+                name, {"count": 0, "sum": 0.0, "max": 0.0}
+            )
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+
+    def snapshot(self):
+        """
+        Copy the current values
+
+        Returns:
+            dict: {"counters": name -> value,
+                   "gauges": name -> value,
+                   "summaries": name -> {"count", "sum", "max"}}
+        """
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "summaries": {
+                    name: dict(summary) for name, summary in self.summaries.items()
+                },
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.summaries.clear()
+
+
+# Metrics shared by every module
+metrics = Metrics()
+
+
+def increment(name, value=1):
+    """Add to a counter of the shared metrics"""
+    metrics.increment(name, value)
+
+
+def gauge(name, value):
+    """Set a gauge of the shared metrics"""
+    metrics.set_gauge(name, value)
+
+
+def observe(name, value):
+    """Record a value in a summary of the shared metrics"""
+    metrics.observe(name, value)
+
+
+def log_metrics():
+    """Log every metric of the shared metrics (at debug level)"""
+    snapshot = metrics.snapshot()
+    for name, value in sorted(snapshot["counters"].items()):
+        logger.debug(f"{name}: {value}")
+    for name, value in sorted(snapshot["gauges"].items()):
+        logger.debug(f"{name}: {value}")
+    for name, summary in sorted(snapshot["summaries"].items()):
+        mean = summary["sum"] / summary["count"] if summary["count"] else 0.0
+        logger.debug(
+            f"{name}: {summary['count']} x, mean {mean:.6f}, max {summary['max']:.6f}"
+        )
+    return snapshot
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from calendar_cache import record_run
+from change_detection import pair_changed, record_evaluation, save_state
+from comfort import comfort_limits, comfort_signature, get_comfort_table
+from comparison import compare_weather
+from digest import ALL_RECIPIENTS, digest_queue
+from history import record_observation
+from message_constructor import construct_message, message_cache
+from message_sender import build_sender_config, send_message_async
+from providers import build_fallback_provider
+from subscriptions import pair_topic, subscription_fanout
+from weather_api import get_weather_async
+
+logger = logging.getLogger("weathermark.pipeline")
+
+# Marks the end of a stage's input
+DONE = object()
+
+
+async def fetch_stage(
+    session, pairs, cities, api_key, config, use_mock, out_queue, weather
+):
+    """
+    Fetch every city and queue each pair as soon as both of its cities arrive
+
+    A pair therefore only waits for its own slowest fetch, not the batch.
+    get_weather_async already falls back to a stale cached observation;
+    cities it has no data for at all are fetched from the configured
+    providers other than OpenWeatherMap (on a thread).
+
+    Args:
+        weather: Dict filled with city -> weather data as fetches complete
+    """
+    pairs_by_city = {}
+    for pair in pairs:
+        for city in set(pair):
+            pairs_by_city.setdefault(city, []).append(pair)
+
+    queued = set()
+    semaphore = asyncio.Semaphore(config["pipeline"]["fetch_concurrency"])
+    provider = None if use_mock else build_fallback_provider(config)
+
+    async def fetch(city):
+        async with semaphore:
+            weather_data = await get_weather_async(session, city, api_key, use_mock)
+        if not weather_data and provider:
+            observation = await asyncio.to_thread(provider.fetch, city)
+            weather_data = observation.to_weather_data() if observation else None
+        weather[city] = weather_data
+
+        # Collect ready pairs before awaiting so no pair is queued twice
+        ready = []
+        for our_city, their_city in pairs_by_city[city]:
+            pair = (our_city, their_city)
+            if our_city in weather and their_city in weather and pair not in queued:
+                queued.add(pair)
+                ready.append(pair)
+
+        for our_city, their_city in ready:
+            await out_queue.put(
+                (our_city, their_city, weather[our_city], weather[their_city])
+            )
+
+    await asyncio.gather(*(fetch(city) for city in cities))
+    await out_queue.put(DONE)
+
+
+def record_history(pairs, cities, weather, config, run_ts):
+    """
+    Store a run's observations for history queries (blocking IO)
+
+    Shared by the sync and async runs. With [history] calendar enabled,
+    the advantage calendars of the pairs are updated too.
+
+    Args:
+        pairs: List of (our_city, their_city) tuples compared in the run
+        cities: Cities fetched in the run
+        weather: City -> weather data fetched in the run
+        config: Loaded configuration
+        run_ts: Run timestamp
+    """
+    history_dir = config["history"]["directory"]
+    for city in cities:
+        record_observation(city, weather.get(city), history_dir, run_ts)
+    if config["history"]["calendar"]:
+        record_run(
+            pairs,
+            weather,
+            history_dir,
+            run_ts,
+            config["temperature"]["min_comfortable"],
+            config["temperature"]["max_comfortable"],
+            get_comfort_table(config),
+        )
+
+
+async def compare_stage(in_queue, out_queue, config, state, results):
+    """Compare each pair and queue the ones that should be notified"""
+    min_temp = config["temperature"]["min_comfortable"]
+    max_temp = config["temperature"]["max_comfortable"]
+    comfort_range = comfort_signature(config)
+    comfort = get_comfort_table(config)
+    settings = config["notifications"]
+
+    while True:
+        item = await in_queue.get()
+        if item is DONE:
+            await out_queue.put(DONE)
+            return
+
+        our_city, their_city, our_city_weather, their_city_weather = item
+        track_state = bool(
+            state is not None and our_city_weather and their_city_weather
+        )
+        if track_state and not pair_changed(
+            state,
+            our_city,
+            their_city,
+            our_city_weather,
+            their_city_weather,
+            comfort_range,
+        ):
+            logger.info(
+                f"No new observations for {our_city} vs {their_city} - skipping"
+            )
+            continue
+
+        reason = compare_weather(
+            our_city_weather,
+            their_city_weather,
+            min_temp,
+            max_temp,
+            comfort,
+            our_city,
+            their_city,
+        )["reason"]
+        results[(our_city, their_city)] = reason
+
+        send = bool(reason)
+        if track_state:
+            send = record_evaluation(
+                state,
+                our_city,
+                their_city,
+                our_city_weather,
+                their_city_weather,
+                comfort_range,
+                reason,
+                settings,
+            )
+
+        if not reason:
+            logger.info(f"No advantage for {our_city} over {their_city} detected")
+        elif send:
+            logger.info(f"Better in {our_city} than {their_city}! ({reason})")
+            await out_queue.put(item + (reason,))
+        else:
+            logger.info(f"Advantage for {our_city} already reported - not notifying")
+
+
+async def render_stage(in_queue, out_queue, config, send_workers):
+    """Render a message for each advantage"""
+    cache = message_cache(config)
+    digest = digest_queue(config)
+    fanout = subscription_fanout(config)
+
+    while True:
+        item = await in_queue.get()
+        if item is DONE:
+            for _ in range(send_workers):
+                await out_queue.put(DONE)
+            return
+
+        our_city, their_city, our_city_weather, their_city_weather, reason = item
+        message, subject = construct_message(
+            our_city_weather,
+            their_city_weather,
+            our_city,
+            their_city,
+            *comfort_limits(config, our_city, our_city_weather),
+            reason,
+            config["message"]["signature"],
+            cache=cache,
+            their_limits=comfort_limits(config, their_city, their_city_weather),
+        )
+        logger.info(f"Subject: {subject}")
+        logger.info(message)
+        if fanout is not None:
+            fanout.add(pair_topic(our_city, their_city), message, subject)
+            continue
+        if digest is not None:
+            digest.add(ALL_RECIPIENTS, message, subject)
+            continue
+        await out_queue.put((message, subject))
+
+
+async def send_stage(in_queue, config):
+    """Send rendered messages via the configured channels"""
+    while True:
+        item = await in_queue.get()
+        if item is DONE:
+            return
+
+        message, subject = item
+        sender_config = build_sender_config(config, subject)
+        if not sender_config:
+            continue
+        if not sender_config["send_email"] and not sender_config["send_sms"]:
+            logger.warning(
+                "No messaging channels enabled or all were skipped due to missing credentials"
+            )
+            continue
+
+        send_results = await send_message_async(message, sender_config)
+        for channel, success in send_results.items():
+            if success:
+                logger.info(f"Message sent successfully via {channel}")
+            else:
+                logger.error(f"Failed to send message via {channel}")
+
+
+async def main_async(pairs, cities, api_key, config, use_mock=None, state=None):
+    """
+    Run fetch -> compare -> render -> send as a streaming pipeline
+
+    The stages are connected by bounded queues, so a slow stage applies
+    backpressure to the ones before it.
+
+    Args:
+        pairs: List of (our_city, their_city) tuples
+        cities: Unique cities to fetch, in priority order
+        api_key: OpenWeatherMap API key
+        config: Loaded configuration (with credentials)
+        use_mock: Type of condition to mock (optional)
+        state: Change detection state (optional)
+
+    Returns:
+        dict: (our_city, their_city) -> advantage reason for each
+              evaluated pair
+    """
+    settings = config["pipeline"]
+    compare_queue = asyncio.Queue(settings["queue_size"])
+    render_queue = asyncio.Queue(settings["queue_size"])
+    send_queue = asyncio.Queue(settings["queue_size"])
+    send_workers = settings["send_workers"]
+    results = {}
+    weather = {}
+    run_ts = int(time.time())
+
+    timeout = aiohttp.ClientTimeout(total=settings["fetch_timeout"])
+    connector = aiohttp.TCPConnector(limit=settings["fetch_concurrency"])
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        await asyncio.gather(
+            fetch_stage(
+                session,
+                pairs,
+                cities,
+                api_key,
+                config,
+                use_mock,
+                compare_queue,
+                weather,
+            ),
+            compare_stage(compare_queue, render_queue, config, state, results),
+            render_stage(render_queue, send_queue, config, send_workers),
+            *(send_stage(send_queue, config) for _ in range(send_workers)),
+        )
+
+    # Mock data would skew the stats; the memmap IO stays off the event loop
+    if config["history"]["enabled"] and not use_mock:
+        await asyncio.to_thread(record_history, pairs, cities, weather, config, run_ts)
+
+    if state is not None:
+        save_state(config["notifications"]["state_file"], state)
+
+    return results
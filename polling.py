@@ -0,0 +1,217 @@
+import logging
+import math
+import time
+
+logger = logging.getLogger("weathermark.polling")
+
+# Weight of the newest sample in the cadence and volatility averages
+SMOOTHING = 0.3
+
+# Degrees from a comfort boundary at which a flip counts as unlikely
+TEMP_SCALE = 3.0
+
+# Stations that never changed dt are assumed to report this often (seconds)
+DEFAULT_CADENCE = 600
+
+
+def cache_limits(max_age, max_stale, min_interval):
+    """
+    Cap the observation cache so every planned poll reaches the API
+
+    Polls are at least min_interval apart. A cached (or stale) observation
+    younger than that would hand a poll the report it already saw, which
+    observe() counts as a miss and backs off on.
+
+    Returns:
+        tuple: (max_age, max_stale) for weather_api.enable_cache
+    """
+    limit = min_interval / 2
+    return min(max_age, limit), min(max_stale, limit)
+
+
+class PollScheduler:
+    """
+    Decide when each city is worth fetching again
+
+    Every observation teaches the scheduler two things about a city: how
+    often its station reports (the spacing of the OpenWeatherMap dt field)
+    and how volatile it is (how much condition and temperature moved
+    between reports). Cities are polled just after their next report is
+    expected when they are volatile or when a pair they are in is close to
+    flipping under the sunny/rainy/comfort rules; stable cities far from a
+    flip skip reports, and cities whose report didn't change back off.
+    """
+
+    def __init__(
+        self,
+        min_interval=60,
+        max_interval=3600,
+        grace=30,
+        default_cadence=DEFAULT_CADENCE,
+        comfort=None,
+        min_temp=18,
+        max_temp=26,
+        clock=time.time,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.grace = grace
+        self.default_cadence = default_cadence
+        self.comfort = comfort
+        self.min_temp = min_temp
+        self.max_temp = max_temp
+        self.clock = clock
+        self.cities = {}  # city -> state dict
+        self.weather = {}  # city -> latest weather data
+
+    def state(self, city):
+        return self.cities.setdefault(
+            city,
+            {
+                "dt": None,
+                "cadence": self.default_cadence,
+                "volatility": 1.0,
+                "temp": None,
+                "condition": None,
+                "misses": 0,
+                "next_poll": 0.0,
+            },
+        )
+
+    def observe(self, city, weather_data):
+        """
+        Learn from a newly fetched observation
+
+        Returns:
+            bool: True if it was a new report (dt moved on)
+        """
+        state = self.state(city)
+        if not weather_data:
+            state["misses"] += 1
+            return False
+        self.weather[city] = weather_data
+
+        dt = weather_data.get("dt")
+        if dt is None or dt == state["dt"]:
+            state["misses"] += 1
+            return False
+
+        if state["dt"] is not None and dt > state["dt"]:
+            state["cadence"] = (1 - SMOOTHING) * state["cadence"] + SMOOTHING * (
+                dt - state["dt"]
+            )
+
+        condition = (weather_data.get("weather") or [{}])[0].get("id")
+        temp = weather_data.get("main", {}).get("temp")
+        if state["dt"] is not None:
+            if condition != state["condition"]:
+                change = 1.0
+            elif temp is not None and state["temp"] is not None:
+                change = min(1.0, abs(temp - state["temp"]) / TEMP_SCALE)
+            else:
+                change = 0.0
+            state["volatility"] = (1 - SMOOTHING) * state[
+                "volatility"
+            ] + SMOOTHING * change
+
+        state.update(dt=dt, condition=condition, temp=temp, misses=0)
+        return True
+
+    def comfort_limits(self, city, weather_data):
+        """Return the (min, max) comfortable temperature for a city"""
+        if self.comfort is None:
+            return self.min_temp, self.max_temp
+        return self.comfort.comfort_limits(city, weather_data)
+
+    def flip_closeness(self, city, weather_data):
+        """
+        How close a city's temperature is to changing its comfort verdict
+
+        Returns:
+            float: 1.0 on a comfort boundary, falling towards 0 away from it
+        """
+        temp = (weather_data or {}).get("main", {}).get("temp")
+        if temp is None:
+            return 1.0
+        low, high = self.comfort_limits(city, weather_data)
+        margin = min(abs(temp - low), abs(temp - high))
+        return math.exp(-margin / TEMP_SCALE)
+
+    def pair_urgency(self, pairs):
+        """
+        Score each city by the pair closest to flipping that it is in
+
+        A pair can flip when either city's temperature crosses a comfort
+        boundary or either city's condition changes, so its score is the
+        largest closeness or volatility of its two cities.
+
+        Returns:
+            dict: City -> urgency between 0 and 1
+        """
+        urgency = {}
+        for pair in pairs:
+            score = 0.0
+            for city in pair:
+                state = self.state(city)
+                score = max(
+                    score,
+                    self.flip_closeness(city, self.weather.get(city)),
+                    state["volatility"],
+                )
+            for city in pair:
+                urgency[city] = max(urgency.get(city, 0.0), score)
+        return urgency
+
+    def schedule(self, pairs, cities, now=None):
+        """
+        Plan the next poll of the cities just fetched
+
+        Args:
+            pairs: Every pair being compared (for the urgency scores)
+            cities: Cities that were just fetched and observed
+            now: Current time (default: the scheduler's clock)
+
+        Returns:
+            dict: City -> time of its next poll
+        """
+        now = self.clock() if now is None else now
+        urgency = self.pair_urgency(pairs)
+
+        for city in cities:
+            state = self.state(city)
+            if state["dt"] is None:
+                wait = self.min_interval
+            elif state["misses"]:
+                # The report we expected hasn't arrived yet: back off
+                wait = self.min_interval * 2 ** (state["misses"] - 1)
+            else:
+                # Skip more reports the calmer the city and its pairs are
+                skipped = math.floor((1.0 - urgency.get(city, 1.0)) * 4)
+                expected = state["dt"] + state["cadence"] * (1 + skipped)
+                wait = expected + self.grace - now
+            wait = min(max(wait, self.min_interval), self.max_interval)
+            state["next_poll"] = now + wait
+        return {city: self.state(city)["next_poll"] for city in cities}
+
+    def due(self, pairs, now=None):
+        """
+        Split off the pairs that need fresh data
+
+        Returns:
+            tuple: (pairs with a city due for polling, list of due cities)
+        """
+        now = self.clock() if now is None else now
+        cities = list(
+            dict.fromkeys(
+                city
+                for pair in pairs
+                for city in pair
+                if self.state(city)["next_poll"] <= now
+            )
+        )
+        due_pairs = [pair for pair in pairs if pair[0] in cities or pair[1] in cities]
+        return due_pairs, cities
+
+    def next_poll(self, pairs):
+        """Return the earliest planned poll of any city in the pairs"""
+        return min(self.state(city)["next_poll"] for pair in pairs for city in pair)
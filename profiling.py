@@ -0,0 +1,266 @@
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger("weathermark.profiling")
+
+# Modules broken out in the rollups; everything else is "other"
+PROFILED_MODULES = ("weather_api", "message_constructor", "message_sender", "config")
+
+# Seconds between samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+
+def module_name(filename):
+    """Return the module name of a source file"""
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def rollup_key(filename):
+    """Return the rollup bucket of a source file"""
+    module = module_name(filename)
+    return module if module in PROFILED_MODULES else "other"
+
+
+class SamplingProfiler:
+    """
+    Low-overhead profiler that periodically samples every thread's stack
+
+    The profiled code runs at full speed; a background thread wakes up
+    every interval and records the current stack of all other threads.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self.run, name="weathermark-sampler", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Record the stack of every thread except the sampler"""
+        me = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_name))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """
+        Render the samples in the collapsed-stack format used by flamegraph tools
+
+        Returns:
+            list: "module:function;module:function count" lines
+        """
+        lines = []
+        for stack, count in self.stacks.most_common():
+            frames = ";".join(
+                f"{module_name(filename)}:{function}" for filename, function in stack
+            )
+            lines.append(f"{frames} {count}")
+        return lines
+
+    def rollup(self):
+        """
+        Share of samples spent in each module
+
+        Returns:
+            dict: Module -> {"self": samples with the module on top,
+                             "total": samples with the module anywhere}
+        """
+        rollup = {key: {"self": 0, "total": 0} for key in PROFILED_MODULES}
+        rollup["other"] = {"self": 0, "total": 0}
+        for stack, count in self.stacks.items():
+            if not stack:
+                continue
+            rollup[rollup_key(stack[-1][0])]["self"] += count
+            for key in {rollup_key(filename) for filename, _ in stack}:
+                rollup[key]["total"] += count
+        return rollup
+
+
+def stats_rollup(stats):
+    """
+    Time spent in each module according to cProfile
+
+    Returns:
+        dict: Module -> {"self": seconds in the module's own code,
+                         "calls": number of calls into the module}
+    """
+    rollup = {key: {"self": 0.0, "calls": 0} for key in PROFILED_MODULES}
+    rollup["other"] = {"self": 0.0, "calls": 0}
+    for (filename, _, _), (_, calls, self_time, _, _) in stats.stats.items():
+        key = rollup_key(filename)
+        rollup[key]["self"] += self_time
+        rollup[key]["calls"] += calls
+    return rollup
+
+
+def write_rollup(rollup, path, unit):
+    """Write and log a per-module rollup"""
+    lines = []
+    for module, values in rollup.items():
+        fields = ", ".join(
+            (
+                f"{name} {value:.3f}{unit}"
+                if isinstance(value, float)
+                else f"{name} {value}"
+            )
+            for name, value in values.items()
+        )
+        lines.append(f"{module}: {fields}")
+        logger.info(f"Profile {module}: {fields}")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def output_prefix(output_dir):
+    """Return the path prefix for a new set of profile files"""
+    os.makedirs(output_dir, exist_ok=True)
+    return os.path.join(output_dir, time.strftime("weathermark-%Y%m%d-%H%M%S"))
+
+
+def save_sampling_profile(profiler, output_dir):
+    """
+    Write a sampling profile as collapsed stacks plus a module rollup
+
+    Returns:
+        str: Path of the collapsed-stack file
+    """
+    prefix = output_prefix(output_dir)
+    folded = f"{prefix}.folded"
+    with open(folded, "w") as f:
+        f.write("\n".join(profiler.collapsed()) + "\n")
+    write_rollup(profiler.rollup(), f"{prefix}.rollup.txt", "")
+    logger.info(f"Wrote {profiler.samples} samples to {folded}")
+    return folded
+
+
+def save_cprofile(profile, output_dir):
+    """
+    Write a cProfile run as pstats plus a module rollup
+
+    Returns:
+        str: Path of the pstats file
+    """
+    prefix = output_prefix(output_dir)
+    path = f"{prefix}.pstats"
+    profile.dump_stats(path)
+    write_rollup(stats_rollup(pstats.Stats(path)), f"{prefix}.rollup.txt", "s")
+    logger.info(f"Wrote profile to {path} (view with: python -m pstats {path})")
+    return path
+
+
+@contextmanager
+def profiled(mode, output_dir):
+    """
+    Profile the enclosed block
+
+    Args:
+        mode: "cprofile" (deterministic, pstats output) or "sampling"
+              (low overhead, collapsed stacks for flamegraphs)
+        output_dir: Directory for the profile files
+    """
+    if mode == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            save_cprofile(profile, output_dir)
+    else:
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            save_sampling_profile(profiler, output_dir)
+
+
+def install_signal_toggle(output_dir, seconds):
+    """
+    Let a running process be profiled on demand
+
+    The first signal starts the sampling profiler for the given number of
+    seconds; another signal stops it early. Either way the profile is then
+    written to output_dir.
+
+    Returns:
+        bool: True if the handler was installed (needs SIGUSR1)
+    """
+    signum = getattr(signal, "SIGUSR1", None)
+    if signum is None:
+        logger.debug("Signal profiling toggle not supported on this platform")
+        return False
+
+    state = {"profiler": None, "timer": None}
+    lock = threading.Lock()
+
+    def finish():
+        with lock:
+            profiler, state["profiler"] = state["profiler"], None
+            timer, state["timer"] = state["timer"], None
+        if profiler is None:
+            return
+        if timer is not None:
+            timer.cancel()
+        profiler.stop()
+        save_sampling_profile(profiler, output_dir)
+
+    def toggle(signum, frame):
+        with lock:
+            running = state["profiler"] is not None
+            if not running:
+                profiler = SamplingProfiler()
+                profiler.start()
+                timer = threading.Timer(seconds, finish)
+                timer.daemon = True
+                state.update(profiler=profiler, timer=timer)
+                timer.start()
+        if running:
+            # Write the files off the signal handler
+            threading.Thread(target=finish, daemon=True).start()
+            logger.info("Profiling stopped")
+        else:
+            logger.info(f"Profiling for {seconds} seconds")
+
+    signal.signal(signum, toggle)
+    logger.info(
+        f"Send {signal.Signals(signum).name} to PID {os.getpid()} to profile for {seconds}s"
+    )
+    return True
@@ -0,0 +1,400 @@
+import abc
+import json
+import logging
+import math
+from collections import namedtuple
+
+import weather_api
+from decoding import project_list
+from gazetteer import load_gazetteer
+from weather_api import api_url, fetch_json, get_weather
+
+logger = logging.getLogger("weathermark.providers")
+
+
+class Observation(
+    namedtuple(
+        "Observation",
+        [
+            "city",
+            "dt",
+            "condition_id",
+            "condition",
+            "description",
+            "temp",
+            "feels_like",
+            "humidity",
+            "wind_speed",
+            "timezone",
+        ],
+        defaults=[None],
+    )
+):
+    """
+    Compact observation every provider normalizes into
+
+    Only the fields the comparisons, messages and history use are kept.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_weather_data(cls, city, weather_data):
+        """
+        Normalize an OpenWeatherMap-shaped response
+
+        Returns:
+            Observation: The observation, or None if there is no usable data
+        """
+        if not weather_data or not weather_data.get("weather"):
+            return None
+        conditions = weather_data["weather"][0]
+        main = weather_data.get("main", {})
+        return cls(
+            city=city,
+            dt=weather_data.get("dt"),
+            condition_id=conditions.get("id"),
+            condition=conditions.get("main", ""),
+            description=conditions.get("description", ""),
+            temp=main.get("temp"),
+            feels_like=main.get("feels_like"),
+            humidity=main.get("humidity"),
+            wind_speed=weather_data.get("wind", {}).get("speed"),
+            timezone=weather_data.get("timezone"),
+        )
+
+    def to_weather_data(self):
+        """Convert back to the weather data shape used by the rest of WeatherMark"""
+        main = {
+            key: value
+            for key, value in (
+                ("temp", self.temp),
+                ("feels_like", self.feels_like),
+                ("humidity", self.humidity),
+            )
+            if value is not None
+        }
+        weather_data = {
+            "name": self.city,
+            "dt": self.dt,
+            "weather": [
+                {
+                    "id": self.condition_id,
+                    "main": self.condition,
+                    "description": self.description,
+                }
+            ],
+            "main": main,
+            "wind": {"speed": self.wind_speed} if self.wind_speed is not None else {},
+        }
+        if self.timezone is not None:
+            weather_data["timezone"] = self.timezone
+        return weather_data
+
+
+class WeatherProvider(abc.ABC):
+    """
+    Base class for weather sources
+
+    Subclasses implement fetch, and fetch_batch when the source can return
+    several cities per call. The class attributes describe the source so
+    requests can be routed to the cheapest and fastest one.
+    """
+
+    name = "provider"
+    # Cities returned by one call
+    batch_size = 1
+    # Call quota (None means unlimited)
+    calls_per_minute = None
+    # Cost of one call
+    cost_per_call = 0.0
+    # Typical seconds per call
+    latency = 0.5
+
+    @abc.abstractmethod
+    def fetch(self, city):
+        """
+        Fetch the current observation for one city
+
+        Returns:
+            Observation: The observation, or None if unavailable
+        """
+
+    def fetch_batch(self, cities):
+        """
+        Fetch up to batch_size cities
+
+        Returns:
+            dict: City -> Observation (or None)
+        """
+        return {city: self.fetch(city) for city in cities}
+
+    def iter_observations(self, cities):
+        """
+        Yield (city, Observation or None) for every city, batch by batch
+
+        Callers can start working on early batches while later ones are
+        still being fetched.
+        """
+        cities = list(cities)
+        for start in range(0, len(cities), self.batch_size):
+            batch = cities[start : start + self.batch_size]
+            observations = self.fetch_batch(batch)
+            for city in batch:
+                yield city, observations.get(city)
+
+    def fetch_many(self, cities):
+        """
+        Fetch many cities in as few calls as the source allows
+
+        Returns:
+            dict: City -> Observation (or None), in the given order
+        """
+        return dict(self.iter_observations(cities))
+
+    def estimate(self, count):
+        """
+        Estimate the cost and time of fetching count cities
+
+        Returns:
+            tuple: (cost, seconds)
+        """
+        calls = math.ceil(count / self.batch_size)
+        if self.calls_per_minute:
+            seconds = max(calls * 60 / self.calls_per_minute, calls * self.latency)
+        else:
+            seconds = calls * self.latency
+        return calls * self.cost_per_call, seconds
+
+
+class OpenWeatherMapProvider(WeatherProvider):
+    """
+    Current weather from OpenWeatherMap
+
+    Cities with a fresh observation in the get_weather cache are served
+    from it. Of the rest, those with a gazetteer id are fetched up to 20 at
+    a time from the /group endpoint; anything still missing goes through
+    get_weather (and so the cache) one by one.
+    """
+
+    name = "openweathermap"
+    batch_size = 20
+    calls_per_minute = 60
+
+    def __init__(self, api_key, calls_per_minute=60, cost_per_call=0.0):
+        self.api_key = api_key
+        self.calls_per_minute = calls_per_minute
+        self.cost_per_call = cost_per_call
+
+    def fetch(self, city):
+        return Observation.from_weather_data(city, get_weather(city, self.api_key))
+
+    def fetch_batch(self, cities):
+        if not self.api_key:
+            logger.error("No API key provided")
+            return {}
+
+        observations = {}
+        cache = weather_api.weather_cache
+        if cache:
+            for city in cities:
+                weather_data = cache.peek(city)
+                if weather_data:
+                    observations[city] = Observation.from_weather_data(
+                        city, weather_data
+                    )
+
+        gazetteer = load_gazetteer()
+        ids = {}
+        for city in cities:
+            if observations.get(city) is not None:
+                continue
+            entry = gazetteer.lookup(city, weather_api.country_code)
+            if entry is not None and entry["id"] is not None:
+                ids[entry["id"]] = city
+
+        if len(ids) > 1:
+            query = "id=" + ",".join(str(city_id) for city_id in ids)
+            data = fetch_json(
+                api_url("group", self.api_key, query),
+                f"weather data for {len(ids)} cities",
+                project_list,
+            )
+            for weather_data in (data or {}).get("list", []):
+                city = ids.get(weather_data.get("id"))
+                if city is None:
+                    continue
+                observations[city] = Observation.from_weather_data(city, weather_data)
+                # Later get_weather calls can reuse the batch
+                if cache:
+                    cache.put(city, weather_data)
+
+        for city in cities:
+            if observations.get(city) is None:
+                observations[city] = self.fetch(city)
+        return observations
+
+
+class MockProvider(WeatherProvider):
+    """Mock observations from get_weather (see --mock)"""
+
+    name = "mock"
+    batch_size = 100
+    latency = 0.0
+
+    def __init__(self, mock_type):
+        self.mock_type = mock_type
+
+    def fetch(self, city):
+        return Observation.from_weather_data(
+            city, get_weather(city, None, self.mock_type)
+        )
+
+
+class FileProvider(WeatherProvider):
+    """
+    Observations from a JSON file of city -> OpenWeatherMap response
+
+    Useful offline, for reproducing a run, or as the last fallback.
+    """
+
+    name = "file"
+    batch_size = 1000
+    latency = 0.001
+
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+
+    def load(self):
+        """Read the file once, keyed by lowercase city name"""
+        if self.data is None:
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+                self.data = {city.lower(): value for city, value in data.items()}
+            except (OSError, ValueError, AttributeError) as e:
+                logger.error(f"Failed to read observations from {self.path}: {e}")
+                self.data = {}
+        return self.data
+
+    def fetch(self, city):
+        return Observation.from_weather_data(city, self.load().get(city.lower()))
+
+
+class FallbackProvider(WeatherProvider):
+    """
+    Try providers in turn, passing on only the cities that are still missing
+
+    With route set, providers are tried cheapest and fastest first for the
+    number of cities requested instead of in the given order.
+    """
+
+    name = "fallback"
+
+    def __init__(self, providers, route=False):
+        self.providers = list(providers)
+        self.route = route
+        self.batch_size = max(
+            (provider.batch_size for provider in self.providers), default=1
+        )
+
+    def fetch(self, city):
+        return self.fetch_many([city]).get(city)
+
+    def iter_observations(self, cities):
+        missing = list(cities)
+        providers = self.providers
+        if self.route:
+            providers = rank_providers(providers, len(missing))
+
+        for provider in providers:
+            if not missing:
+                return
+            still_missing = []
+            for city, observation in provider.iter_observations(missing):
+                if observation is None:
+                    still_missing.append(city)
+                else:
+                    yield city, observation
+            if still_missing:
+                logger.info(
+                    f"{provider.name} had no data for {len(still_missing)} cities"
+                )
+            missing = still_missing
+
+        for city in missing:
+            yield city, None
+
+
+def rank_providers(providers, count):
+    """
+    Order providers by estimated cost, then time, for fetching count cities
+
+    Returns:
+        list: Providers, cheapest and fastest first (ties keep their order)
+    """
+    return sorted(providers, key=lambda provider: provider.estimate(count))
+
+
+def build_provider(config, api_key, mock_type=None):
+    """
+    Build the provider chain from the [providers] config section
+
+    Args:
+        config: Loaded configuration
+        api_key: OpenWeatherMap API key
+        mock_type: Type of condition to mock (overrides the configuration)
+
+    Returns:
+        WeatherProvider: The provider to fetch observations from
+    """
+    if mock_type:
+        return MockProvider(mock_type)
+
+    settings = config["providers"]
+    providers = []
+    for name in settings["order"]:
+        if name == "openweathermap":
+            providers.append(
+                OpenWeatherMapProvider(
+                    api_key,
+                    config["api"]["calls_per_minute"],
+                    settings["openweathermap_cost"],
+                )
+            )
+        elif name == "file":
+            providers.append(FileProvider(settings["file"]))
+        else:
+            logger.warning(f"Unknown weather provider: {name}")
+
+    if not providers:
+        logger.warning("No weather providers configured, using OpenWeatherMap")
+        providers.append(
+            OpenWeatherMapProvider(api_key, config["api"]["calls_per_minute"])
+        )
+    if len(providers) == 1:
+        return providers[0]
+    return FallbackProvider(providers, settings["route"])
+
+
+def build_fallback_provider(config):
+    """
+    Build the providers that back up OpenWeatherMap in the [providers] chain
+
+    For callers that already fetched from OpenWeatherMap themselves (the
+    async pipeline), so a failed city isn't requested from it twice.
+
+    Returns:
+        WeatherProvider: The other configured providers, or None if there
+                         are none
+    """
+    settings = config["providers"]
+    providers = [
+        FileProvider(settings["file"]) for name in settings["order"] if name == "file"
+    ]
+    if not providers:
+        return None
+    if len(providers) == 1:
+        return providers[0]
+    return FallbackProvider(providers, settings["route"])
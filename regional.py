@@ -0,0 +1,150 @@
+import logging
+
+import numpy as np
+
+from decoding import project_list
+from gazetteer import load_gazetteer
+from history import REASONS, advantage_codes, encode_observation
+from weather_api import api_url, fetch_json, get_weather
+
+logger = logging.getLogger("weathermark.regional")
+
+# The most cities OpenWeatherMap returns from one /find request
+MAX_REGION_CITIES = 50
+
+
+def find_url(lat, lon, count, api_key):
+    """Build the URL for the cities closest to a coordinate"""
+    return api_url("find", api_key, f"lat={lat}&lon={lon}&cnt={count}")
+
+
+def normalize_station(station):
+    """
+    Reshape a /find result into the per-city shape of a weather response
+
+    Returns:
+        dict: Weather data usable by is_sunny, is_rainy and
+              is_temperature_comfortable
+    """
+    return {
+        "id": station.get("id"),
+        "name": station.get("name"),
+        "coord": station.get("coord", {}),
+        "dt": station.get("dt"),
+        "weather": station.get("weather") or [],
+        "main": station.get("main", {}),
+        "wind": station.get("wind", {}),
+        "sys": {"country": station.get("sys", {}).get("country")},
+    }
+
+
+def mock_region(lat, lon, count, mock_type):
+    """Build a region from mock weather for the closest gazetteer cities"""
+    region = {}
+    for _, entry in load_gazetteer().nearest(lat, lon, count):
+        weather_data = get_weather(entry["name"], None, mock_type)
+        weather_data["name"] = entry["name"]
+        region[entry["name"]] = weather_data
+    return region
+
+
+def get_region(lat, lon, count, api_key, mock_type=None):
+    """
+    Get current weather for the cities closest to a coordinate in one request
+
+    Args:
+        lat: Latitude of the centre
+        lon: Longitude of the centre
+        count: Number of cities (at most MAX_REGION_CITIES)
+        api_key: OpenWeatherMap API key
+        mock_type: Type of condition to mock (optional)
+
+    Returns:
+        dict: City name -> weather data, closest first (empty on error)
+    """
+    count = max(1, min(count, MAX_REGION_CITIES))
+    if mock_type:
+        return mock_region(lat, lon, count, mock_type)
+
+    if not api_key:
+        logger.error("No API key provided")
+        return {}
+
+    data = fetch_json(
+        find_url(lat, lon, count, api_key), f"cities around {lat},{lon}", project_list
+    )
+    if not data:
+        return {}
+
+    region = {}
+    for station in data.get("list", []):
+        weather_data = normalize_station(station)
+        if weather_data["name"] and weather_data["weather"]:
+            region.setdefault(weather_data["name"], weather_data)
+    return region
+
+
+def region_center(city, weather_data=None, country=None):
+    """
+    Find the coordinate to search around for a city
+
+    Returns:
+        tuple: (lat, lon), or None if the city can't be located
+    """
+    entry = load_gazetteer().lookup(city, country)
+    if entry is not None:
+        return entry["lat"], entry["lon"]
+    coord = (weather_data or {}).get("coord", {})
+    if "lat" in coord and "lon" in coord:
+        return coord["lat"], coord["lon"]
+    return None
+
+
+def compare_region(
+    our_weather, region, min_temp, max_temp, comfort=None, our_city=None
+):
+    """
+    Compare our city against every city of a region at once
+
+    Args:
+        our_weather: Weather data for our city
+        region: City name -> weather data
+        min_temp: Minimum comfortable temperature
+        max_temp: Maximum comfortable temperature
+        comfort: comfort.ComfortTable to use instead of min/max (optional)
+        our_city: Name of our city, to pick its comfort profile
+
+    Returns:
+        dict: City name -> advantage reason (or None)
+    """
+    if not our_weather or not region:
+        return {city: None for city in region}
+
+    ours = encode_observation(our_weather)
+    theirs = np.concatenate(
+        [encode_observation(weather_data) for weather_data in region.values()]
+    )
+    our_comfortable = their_comfortable = None
+    if comfort is not None:
+        our_comfortable = comfort.comfortable_records(ours, comfort.row(our_city))
+        their_comfortable = comfort.comfortable_records(theirs, comfort.rows(region))
+    codes = advantage_codes(
+        ours, theirs, min_temp, max_temp, our_comfortable, their_comfortable
+    )
+    return {city: REASONS[code] for city, code in zip(region, codes)}
+
+
+def construct_region_message(our_city, reasons, signature="WeatherMark"):
+    """
+    Construct a message for our city beating its whole region
+
+    Returns:
+        tuple: (message, subject)
+    """
+    cities = ", ".join(reasons)
+    message = (
+        f"G'day mate! {our_city} is beating every city around it right now!\n"
+        f"Better than {len(reasons)} nearby cities: {cities}.\n\n"
+        f"-- {signature}"
+    )
+    return message, f"Weather update: {our_city} vs the region"
@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger("weathermark.replay")
+
+# Every replay log starts with this line
+MAGIC = b"WEATHERMARK-REPLAY 1\n"
+
+# Each record is a big-endian length followed by zlib-compressed JSON
+LENGTH = struct.Struct(">I")
+
+
+def request_key(url):
+    """Identify a request independently of the API key it was made with"""
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != "appid"]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def write_record(f, record):
+    """Append one length-prefixed, compressed record"""
+    payload = zlib.compress(json.dumps(record, separators=(",", ":")).encode())
+    f.write(LENGTH.pack(len(payload)) + payload)
+
+
+def read_records(path):
+    """
+    Read every record of a replay log
+
+    A record cut short (for example by a crash while recording) ends the log.
+
+    Returns:
+        list: Records in the order they were captured
+    """
+    records = []
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a WeatherMark replay log")
+        while True:
+            header = f.read(LENGTH.size)
+            if not header:
+                break
+            payload = f.read(LENGTH.unpack(header)[0]) if len(header) == 4 else b""
+            try:
+                records.append(json.loads(zlib.decompress(payload)))
+            except (zlib.error, ValueError):
+                logger.warning(
+                    f"Truncated record in {path}, replaying {len(records)} records"
+                )
+                break
+    return records
+
+
+class Recorder:
+    """Capture API responses to a replay log"""
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "ab")
+        if new:
+            self.file.write(MAGIC)
+        self.count = 0
+
+    def record(self, url, body):
+        """
+        Capture one response
+
+        Args:
+            url: Requested URL (the API key is not stored)
+            body: Decoded response, or None if the request failed
+        """
+        record = {"t": self.clock(), "url": request_key(url), "body": body}
+        with self.lock:
+            write_record(self.file, record)
+            self.file.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+        logger.info(f"Recorded {self.count} responses to {self.path}")
+
+
+class Replayer:
+    """
+    Serve captured responses back in place of the API
+
+    Responses for the same request are served in the order they were
+    captured; once they run out the last one is repeated. Each response is
+    held back until its recorded offset from the first response, divided
+    by speed, so a run sees the original timing (speed 1), a compressed
+    version of it (speed > 1), or no delays at all (speed 0).
+    """
+
+    def __init__(self, path, speed=1.0, clock=time.monotonic):
+        self.speed = speed
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.last = {}
+        self.started = None
+
+        records = read_records(path)
+        self.first = records[0]["t"] if records else 0
+        for record in records:
+            self.responses.setdefault(record["url"], deque()).append(record)
+        logger.info(f"Replaying {len(records)} responses from {path}")
+
+    def take(self, url):
+        """
+        Get the next captured response for a URL
+
+        Returns:
+            tuple: (seconds to wait before responding, decoded body or None)
+        """
+        key = request_key(url)
+        with self.lock:
+            now = self.clock()
+            if self.started is None:
+                self.started = now
+
+            queue = self.responses.get(key)
+            if queue:
+                record = queue.popleft()
+                self.last[key] = record
+            elif key in self.last:
+                record = self.last[key]
+            else:
+                logger.error(f"No recorded response for {key}")
+                return 0.0, None
+
+        if not self.speed:
+            return 0.0, record["body"]
+        due = self.started + (record["t"] - self.first) / self.speed
+        return max(0.0, due - now), record["body"]
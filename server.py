@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+import weather_api
+from comfort import get_comfort_table
+from comparison import compare_weather
+from decoding import dumps
+from message_constructor import construct_message, message_cache
+from metrics import increment, metrics, observe
+from streaming import observation_summary
+from weather_api import get_weather_async
+
+logger = logging.getLogger("weathermark.server")
+
+
+class ResponseCache:
+    """
+    Rendered responses of an endpoint, with request coalescing
+
+    A response is reused for ttl seconds. While it is being produced,
+    identical requests wait for the same task instead of starting their
+    own, so a burst of requests for one pair costs one fetch.
+    """
+
+    def __init__(self, name, ttl, max_entries=10000, clock=time.monotonic):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = {}  # key -> (expires, status, body)
+        self.inflight = {}  # key -> asyncio.Task producing (status, body)
+
+    async def get(self, key, produce):
+        """
+        Return the cached response for key, producing it if needed
+
+        Args:
+            key: Hashable request key
+            produce: Coroutine function returning (status, body bytes)
+
+        Returns:
+            tuple: (status, body)
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > self.clock():
+            increment(f"server.{self.name}.cache_hits")
+            return entry[1], entry[2]
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(produce())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            increment(f"server.{self.name}.coalesced")
+
+        # Shielded, so a client disconnecting doesn't cancel the others' fetch
+        status, body = await asyncio.shield(task)
+        if status == 200 and self.ttl > 0:
+            if len(self.entries) >= self.max_entries:
+                self.prune()
+                if len(self.entries) >= self.max_entries:
+                    # Still full of fresh responses: drop the oldest
+                    del self.entries[next(iter(self.entries))]
+            self.entries[key] = (self.clock() + self.ttl, status, body)
+        return status, body
+
+    def prune(self):
+        """Forget expired responses"""
+        now = self.clock()
+        for key in [key for key, entry in self.entries.items() if entry[0] <= now]:
+            del self.entries[key]
+
+
+def json_response(status, body):
+    return web.Response(status=status, body=body, content_type="application/json")
+
+
+def error_body(message):
+    return dumps({"error": message})
+
+
+class WeatherServer:
+    """
+    HTTP API answering comparisons from warm state
+
+    Observations come from the get_weather cache when it holds a fresh
+    one and are otherwise fetched over one shared aiohttp session.
+    Messages are rendered with the configuration's message cache.
+    """
+
+    def __init__(self, config, api_key, use_mock=None):
+        self.config = config
+        self.api_key = api_key
+        self.use_mock = use_mock
+        self.comfort = get_comfort_table(config)
+        self.render_cache = message_cache(config)
+        self.session = None
+
+        settings = config["server"]
+        self.observations = ResponseCache("observation", settings["observation_ttl"])
+        self.comparisons = ResponseCache("compare", settings["compare_ttl"])
+        # Not cached (the weather cache does that), only coalesced
+        self.fetches = ResponseCache("fetch", 0)
+
+    def build_app(self):
+        app = web.Application(middlewares=[self.timed])
+        app.add_routes(
+            [
+                web.get("/compare", self.compare, name="compare"),
+                web.get("/observation/{city}", self.observation, name="observation"),
+                web.get("/metrics", self.metrics, name="metrics"),
+            ]
+        )
+        app.cleanup_ctx.append(self.client_session)
+        return app
+
+    async def client_session(self, app):
+        """Keep one connection pool for every fetch"""
+        pipeline = self.config["pipeline"]
+        timeout = aiohttp.ClientTimeout(total=pipeline["fetch_timeout"])
+        connector = aiohttp.TCPConnector(limit=pipeline["fetch_concurrency"])
+        async with aiohttp.ClientSession(
+            timeout=timeout, connector=connector
+        ) as self.session:
+            yield
+        self.session = None
+
+    @web.middleware
+    async def timed(self, request, handler):
+        start = time.perf_counter()
+        try:
+            return await handler(request)
+        finally:
+            name = request.match_info.route.name or "unmatched"
+            increment(f"server.requests.{name}")
+            observe("server.request_seconds", time.perf_counter() - start)
+
+    async def weather(self, city):
+        """
+        Return the weather of a city, from the warm cache when possible
+
+        Returns:
+            dict: Weather data, or None
+        """
+        cache = weather_api.weather_cache
+        if cache is not None and not self.use_mock:
+            weather_data = cache.peek(city)
+            if weather_data:
+                return weather_data
+
+        async def fetch():
+            weather_data = await get_weather_async(
+                self.session, city, self.api_key, self.use_mock
+            )
+            if cache is not None and not self.use_mock:
+                cache.put(city, weather_data)
+            return 200, weather_data
+
+        _, weather_data = await self.fetches.get(city.lower(), fetch)
+        return weather_data
+
+    async def observation(self, request):
+        city = request.match_info["city"]
+
+        async def produce():
+            weather_data = await self.weather(city)
+            if not weather_data:
+                return 502, error_body(f"No weather data for {city}")
+            summary = observation_summary(weather_data)
+            summary["city"] = city
+            return 200, dumps(summary)
+
+        return json_response(*await self.observations.get(city.lower(), produce))
+
+    async def compare(self, request):
+        our_city = request.query.get("our") or self.config["cities"]["our_city"]
+        their_city = request.query.get("their")
+        if not their_city:
+            return json_response(400, error_body("Missing query parameter: their"))
+
+        async def produce():
+            our_weather, their_weather = await asyncio.gather(
+                self.weather(our_city), self.weather(their_city)
+            )
+            for city, weather_data in (
+                (our_city, our_weather),
+                (their_city, their_weather),
+            ):
+                if not weather_data:
+                    return 502, error_body(f"No weather data for {city}")
+            return 200, dumps(
+                self.comparison(our_city, their_city, our_weather, their_weather)
+            )
+
+        key = (our_city.lower(), their_city.lower())
+        return json_response(*await self.comparisons.get(key, produce))
+
+    def comparison(self, our_city, their_city, our_weather, their_weather):
+        """Compare a pair and render its message if our city has the advantage"""
+        min_temp = self.config["temperature"]["min_comfortable"]
+        max_temp = self.config["temperature"]["max_comfortable"]
+        result = {"our_city": our_city, "their_city": their_city}
+        result.update(
+            compare_weather(
+                our_weather,
+                their_weather,
+                min_temp,
+                max_temp,
+                self.comfort,
+                our_city,
+                their_city,
+            )
+        )
+        result["our"] = observation_summary(our_weather)
+        result["their"] = observation_summary(their_weather)
+        if result["reason"]:
+            result["message"], result["subject"] = construct_message(
+                our_weather,
+                their_weather,
+                our_city,
+                their_city,
+                *self.comfort.comfort_limits(our_city, our_weather),
+                result["reason"],
+                self.config["message"]["signature"],
+                cache=self.render_cache,
+                their_limits=self.comfort.comfort_limits(their_city, their_weather),
+            )
+        return result
+
+    async def metrics(self, request):
+        self.observations.prune()
+        self.comparisons.prune()
+        return json_response(200, dumps(metrics.snapshot()))
+
+
+def serve(config, api_key, use_mock=None):
+    """Run the HTTP API until interrupted"""
+    settings = config["server"]
+    app = WeatherServer(config, api_key, use_mock).build_app()
+    logger.info(f"Serving on http://{settings['host']}:{settings['port']}")
+    web.run_app(
+        app,
+        host=settings["host"],
+        port=settings["port"],
+        print=None,
+        access_log=None,
+    )
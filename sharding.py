@@ -0,0 +1,272 @@
+import logging
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from comfort import get_comfort_table
+from history import OBSERVATION_DTYPE, REASONS, advantage_codes, encode_observation
+from message_constructor import MessageCache, construct_message
+
+logger = logging.getLogger("weathermark.sharding")
+
+# Observation record shared with the workers: the history record plus an
+# index into the description table, whether the city was fetched at all,
+# whether its conditions are comfortable under its comfort profile and that
+# profile's temperature range (NaN: the [temperature] range)
+SHARED_DTYPE = np.dtype(
+    OBSERVATION_DTYPE.descr
+    + [
+        ("description", "<i4"),
+        ("valid", "u1"),
+        ("comfortable", "u1"),
+        ("comfort_min", "<f4"),
+        ("comfort_max", "<f4"),
+    ]
+)
+PAIR_DTYPE = np.dtype([("our", "<i4"), ("their", "<i4")])
+
+# Pairs per shard. Shards don't depend on the worker count, so the seeded
+# per-shard RNGs render the same messages however many workers run them.
+SHARD_SIZE = 2048
+
+# Per-process state set up by _init_worker
+_worker = {}
+
+
+def _init_worker(obs_name, obs_count, pairs_name, pair_count, tables, settings):
+    """Map the shared observations and pairs into a worker process"""
+    obs_shm = shared_memory.SharedMemory(name=obs_name)
+    pairs_shm = shared_memory.SharedMemory(name=pairs_name)
+    _worker.update(
+        {
+            "shm": (obs_shm, pairs_shm),
+            "observations": np.ndarray(
+                (obs_count,), dtype=SHARED_DTYPE, buffer=obs_shm.buf
+            ),
+            "pairs": np.ndarray((pair_count,), dtype=PAIR_DTYPE, buffer=pairs_shm.buf),
+            "cities": tables[0],
+            "descriptions": tables[1],
+            "settings": settings,
+        }
+    )
+
+
+def _weather_data(record, descriptions):
+    """Rebuild the fields construct_message needs from a shared record"""
+    return {
+        "weather": [{"description": descriptions[record["description"]]}],
+        "main": {"temp": float(record["temp"])},
+    }
+
+
+def _limits(record, min_temp, max_temp):
+    """Return the (min, max) comfortable temperature of a shared record"""
+    if np.isnan(record["comfort_min"]):
+        return min_temp, max_temp
+    return float(record["comfort_min"]), float(record["comfort_max"])
+
+
+def evaluate_shard(shard_index, start, stop, seed):
+    """
+    Compare and render one slice of the shared pair table
+
+    Returns:
+        tuple: (reason codes for every pair in the slice,
+                list of (pair position, message, subject) for advantages)
+    """
+    observations = _worker["observations"]
+    pairs = _worker["pairs"][start:stop]
+    cities = _worker["cities"]
+    descriptions = _worker["descriptions"]
+    min_temp, max_temp, signature, cache_size = _worker["settings"]
+
+    ours = observations[pairs["our"]]
+    theirs = observations[pairs["their"]]
+    codes = advantage_codes(
+        ours,
+        theirs,
+        min_temp,
+        max_temp,
+        ours["comfortable"] != 0,
+        theirs["comfortable"] != 0,
+    ).astype(np.uint8)
+    codes[(ours["valid"] == 0) | (theirs["valid"] == 0)] = 0
+
+    # Seeded per shard so results don't depend on which worker ran it
+    rng = random.Random(f"{seed}:{shard_index}")
+    # A cache per shard keeps reuse independent of the worker schedule
+    cache = MessageCache(cache_size) if cache_size else None
+    rendered = []
+    for i in np.flatnonzero(codes):
+        message, subject = construct_message(
+            _weather_data(ours[i], descriptions),
+            _weather_data(theirs[i], descriptions),
+            cities[pairs["our"][i]],
+            cities[pairs["their"][i]],
+            *_limits(ours[i], min_temp, max_temp),
+            REASONS[codes[i]],
+            signature,
+            rng=rng,
+            cache=cache,
+            their_limits=_limits(theirs[i], min_temp, max_temp),
+        )
+        rendered.append((start + int(i), message, subject))
+
+    return codes, rendered
+
+
+def pack_observations(weather, cities, comfort=None):
+    """
+    Pack observations into a SHARED_DTYPE array
+
+    Args:
+        weather: Dictionary of city -> weather data
+        cities: Cities in table order
+        comfort: comfort.ComfortTable deciding the comfortable field
+
+    Returns:
+        tuple: (observation array, description table)
+    """
+    observations = np.zeros(len(cities), dtype=SHARED_DTYPE)
+    observations["comfort_min"] = observations["comfort_max"] = np.nan
+    descriptions = {}
+    utc_offsets = np.zeros(len(cities), dtype=np.int64)
+
+    for i, city in enumerate(cities):
+        weather_data = weather.get(city)
+        if not weather_data or not weather_data.get("weather"):
+            continue
+
+        record = encode_observation(weather_data)
+        for name in OBSERVATION_DTYPE.names:
+            observations[name][i] = record[name][0]
+        description = weather_data["weather"][0].get("description", "")
+        observations["description"][i] = descriptions.setdefault(
+            description, len(descriptions)
+        )
+        observations["valid"][i] = 1
+        utc_offsets[i] = weather_data.get("timezone") or 0
+
+    if comfort is not None:
+        valid = observations["valid"] != 0
+        limits = comfort.record_limits(
+            observations[valid],
+            comfort.rows(np.array(cities, dtype=object)[valid]),
+            utc_offsets[valid],
+        )
+        observations["comfort_min"][valid] = limits["min"]
+        observations["comfort_max"][valid] = limits["max"]
+        observations["comfortable"][valid] = comfort.within_limits(
+            observations[valid], limits
+        )
+
+    return observations, list(descriptions)
+
+
+def evaluate_pairs_sharded(weather, pairs, config, workers=None, seed=0):
+    """
+    Compare and render many pairs across a process pool
+
+    Observations and pairs are placed in shared memory once, and each worker
+    evaluates contiguous shards of the pair table. Every shard renders with
+    its own seeded RNG and results are merged in pair order, so the output
+    is identical for a given seed regardless of worker count or scheduling.
+    Pairs where either city has no weather data never have an advantage.
+
+    Args:
+        weather: Dictionary of city -> weather data
+        pairs: List of (our_city, their_city) tuples
+        config: Loaded configuration
+        workers: Number of worker processes (default: CPU count)
+        seed: Seed for message rendering
+
+    Returns:
+        list: One dict per pair with our_city, their_city, reason,
+              message and subject (message/subject are None without reason)
+    """
+    if not pairs:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    cities = list(dict.fromkeys(city for pair in pairs for city in pair))
+    city_index = {city: i for i, city in enumerate(cities)}
+
+    observations, descriptions = pack_observations(
+        weather, cities, get_comfort_table(config)
+    )
+    pair_table = np.array(
+        [(city_index[our], city_index[their]) for our, their in pairs],
+        dtype=PAIR_DTYPE,
+    )
+
+    settings = (
+        config["temperature"]["min_comfortable"],
+        config["temperature"]["max_comfortable"],
+        config["message"]["signature"],
+        (
+            config["message"]["render_cache_size"]
+            if config["message"]["reuse_rendered"]
+            else 0
+        ),
+    )
+
+    bounds = list(range(0, len(pairs), SHARD_SIZE)) + [len(pairs)]
+    shard_count = len(bounds) - 1
+
+    obs_shm = shared_memory.SharedMemory(create=True, size=max(1, observations.nbytes))
+    pairs_shm = shared_memory.SharedMemory(create=True, size=pair_table.nbytes)
+    try:
+        np.ndarray(observations.shape, SHARED_DTYPE, buffer=obs_shm.buf)[:] = (
+            observations
+        )
+        np.ndarray(pair_table.shape, PAIR_DTYPE, buffer=pairs_shm.buf)[:] = pair_table
+
+        logger.info(
+            f"Evaluating {len(pairs)} pairs in {shard_count} shards on {workers} workers"
+        )
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(
+                obs_shm.name,
+                len(observations),
+                pairs_shm.name,
+                len(pair_table),
+                (cities, descriptions),
+                settings,
+            ),
+        ) as executor:
+            outputs = list(
+                executor.map(
+                    evaluate_shard,
+                    range(shard_count),
+                    bounds[:-1],
+                    bounds[1:],
+                    [seed] * shard_count,
+                )
+            )
+    finally:
+        for shm in (obs_shm, pairs_shm):
+            shm.close()
+            shm.unlink()
+
+    codes = np.concatenate([shard_codes for shard_codes, _ in outputs])
+    results = [
+        {
+            "our_city": our,
+            "their_city": their,
+            "reason": REASONS[code],
+            "message": None,
+            "subject": None,
+        }
+        for (our, their), code in zip(pairs, codes)
+    ]
+    for _, rendered in outputs:
+        for position, message, subject in rendered:
+            results[position]["message"] = message
+            results[position]["subject"] = subject
+
+    return results
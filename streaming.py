@@ -0,0 +1,162 @@
+import logging
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from comparison import compare_weather
+from decoding import dumps
+from weather_api import get_temperature
+
+logger = logging.getLogger("weathermark.streaming")
+
+# Fields of an input line: "our city,their city" (or tab separated), or
+# just "their city" to compare against our city
+FIELD_SEPARATOR = re.compile(r"\s*[,\t]\s*")
+
+
+def read_pairs(lines, our_city):
+    """
+    Parse city pairs from lines of text, lazily
+
+    Blank lines and lines starting with # are skipped.
+
+    Args:
+        lines: Iterable of lines (a file or sys.stdin)
+        our_city: City to pair single-city lines with
+
+    Yields:
+        tuple: (line number, our_city, their_city)
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = FIELD_SEPARATOR.split(line)
+        if len(fields) == 1:
+            yield number, our_city, fields[0]
+        else:
+            yield number, fields[0], fields[1]
+
+
+def observation_summary(weather_data):
+    """Return the fields of an observation that go into a result"""
+    condition = (weather_data.get("weather") or [{}])[0]
+    return {
+        "temp": get_temperature(weather_data),
+        "description": condition.get("description"),
+        "dt": weather_data.get("dt"),
+    }
+
+
+def evaluate_pair(number, our_city, their_city, fetch, min_temp, max_temp, comfort):
+    """
+    Fetch and compare one pair
+
+    Returns:
+        dict: The NDJSON result of the pair
+    """
+    result = {"line": number, "our_city": our_city, "their_city": their_city}
+    weather = {}
+    for city in (our_city, their_city):
+        try:
+            weather[city] = fetch(city)
+        except Exception as e:
+            logger.error(f"Failed to fetch weather for {city}: {e}")
+            weather[city] = None
+        if not weather[city]:
+            result["error"] = f"No weather data for {city}"
+            return result
+
+    result.update(
+        compare_weather(
+            weather[our_city],
+            weather[their_city],
+            min_temp,
+            max_temp,
+            comfort,
+            our_city,
+            their_city,
+        )
+    )
+    result["our"] = observation_summary(weather[our_city])
+    result["their"] = observation_summary(weather[their_city])
+    return result
+
+
+def stream_pairs(
+    pairs, fetch, out, concurrency=16, min_temp=18, max_temp=26, comfort=None
+):
+    """
+    Compare pairs and write one NDJSON result per pair as soon as it's ready
+
+    At most concurrency pairs are fetched at once and no more than twice
+    that are read ahead, so memory use doesn't grow with the input. Results
+    are written in completion order; their "line" field gives the input
+    line they belong to. A pair whose evaluation raises gets an "error"
+    result instead of ending the stream.
+
+    Args:
+        pairs: Iterable of (line number, our_city, their_city)
+        fetch: Function returning the weather data of a city (or None)
+        out: Binary file to write results to
+        concurrency: Maximum pairs being fetched at once
+        min_temp: Minimum comfortable temperature
+        max_temp: Maximum comfortable temperature
+        comfort: comfort.ComfortTable to check comfort with (optional)
+
+    Returns:
+        dict: Number of pairs written, with an advantage and with an error
+    """
+    counts = {"pairs": 0, "advantages": 0, "errors": 0}
+    submitted = {}  # future -> (line number, our_city, their_city)
+
+    def write(futures):
+        for future in futures:
+            number, our_city, their_city = submitted.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Failed to evaluate {our_city} vs {their_city}: {e}")
+                result = {
+                    "line": number,
+                    "our_city": our_city,
+                    "their_city": their_city,
+                    "error": f"Evaluation failed: {e}",
+                }
+            out.write(dumps(result) + b"\n")
+            counts["pairs"] += 1
+            if "error" in result:
+                counts["errors"] += 1
+            elif result["reason"]:
+                counts["advantages"] += 1
+        out.flush()
+
+    pool = ThreadPoolExecutor(concurrency)
+    try:
+        pending = set()
+        for number, our_city, their_city in pairs:
+            future = pool.submit(
+                evaluate_pair,
+                number,
+                our_city,
+                their_city,
+                fetch,
+                min_temp,
+                max_temp,
+                comfort,
+            )
+            submitted[future] = (number, our_city, their_city)
+            pending.add(future)
+            if len(pending) >= 2 * concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            write(done)
+    except BaseException:
+        # The reader went away (BrokenPipeError) or we were interrupted:
+        # don't start the pairs that are still queued
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+
+    return counts
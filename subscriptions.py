@@ -0,0 +1,428 @@
+import csv
+import itertools
+import logging
+import sqlite3
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from digest import construct_digest
+
+logger = logging.getLogger("weathermark.subscriptions")
+
+# Channel preference bits
+CHANNEL_EMAIL = 1
+CHANNEL_SMS = 2
+CHANNELS = {"email": CHANNEL_EMAIL, "sms": CHANNEL_SMS}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recipients (
+    id INTEGER PRIMARY KEY,
+    email TEXT,
+    phone TEXT,
+    channels INTEGER NOT NULL DEFAULT 3,
+    quiet_start INTEGER,
+    quiet_end INTEGER,
+    timezone TEXT NOT NULL DEFAULT 'UTC'
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    topic TEXT NOT NULL,
+    recipient_id INTEGER NOT NULL REFERENCES recipients(id) ON DELETE CASCADE,
+    PRIMARY KEY (topic, recipient_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS subscriptions_by_recipient
+    ON subscriptions (recipient_id);
+CREATE TABLE IF NOT EXISTS held (
+    recipient_id INTEGER NOT NULL REFERENCES recipients(id) ON DELETE CASCADE,
+    topic TEXT NOT NULL,
+    message TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    PRIMARY KEY (recipient_id, topic)
+) WITHOUT ROWID;
+"""
+
+
+def pair_topic(our_city, their_city):
+    """Return the subscription topic of a city pair"""
+    return f"pair:{our_city.lower()}|{their_city.lower()}"
+
+
+def region_topic(city):
+    """Return the subscription topic of a city's regional advantage"""
+    return f"region:{city.lower()}"
+
+
+def parse_minutes(value):
+    """Convert "HH:MM" to minutes after midnight (None stays None)"""
+    if value in (None, ""):
+        return None
+    hours, minutes = str(value).split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+@lru_cache(maxsize=None)
+def _zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning(f"Unknown timezone {name}, using UTC")
+        return timezone.utc
+
+
+def in_quiet_hours(quiet_start, quiet_end, zone, now):
+    """
+    Check whether a time falls in a recipient's quiet hours
+
+    Args:
+        quiet_start: Start in minutes after local midnight (None: no quiet hours)
+        quiet_end: End in minutes after local midnight; may be before the
+                   start for quiet hours spanning midnight
+        zone: Recipient's timezone name
+        now: Seconds since the epoch
+
+    Returns:
+        bool: True if the recipient shouldn't be notified now
+    """
+    if quiet_start is None or quiet_end is None or quiet_start == quiet_end:
+        return False
+    local = datetime.fromtimestamp(now, _zone(zone))
+    minute = local.hour * 60 + local.minute
+    if quiet_start < quiet_end:
+        return quiet_start <= minute < quiet_end
+    return minute >= quiet_start or minute < quiet_end
+
+
+class SubscriptionStore:
+    """
+    Recipients and the pairs and regions they subscribe to, in SQLite
+
+    Subscriptions are indexed by topic, so finding the audience of a batch
+    of advantages is one indexed join, and results are streamed in chunks
+    so memory doesn't grow with the number of subscribers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        if path != ":memory:":
+            self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add_recipient(
+        self,
+        email=None,
+        phone=None,
+        channels=("email", "sms"),
+        quiet_hours=None,
+        zone="UTC",
+        topics=(),
+    ):
+        """
+        Add a recipient and its subscriptions
+
+        Args:
+            email: Email address (optional)
+            phone: Phone number for SMS (optional)
+            channels: Channels the recipient wants ("email", "sms")
+            quiet_hours: ("HH:MM", "HH:MM") local time without notifications
+            zone: Timezone name for the quiet hours
+            topics: Topics to subscribe to (see pair_topic, region_topic)
+
+        Returns:
+            int: Recipient id
+        """
+        quiet_start, quiet_end = quiet_hours or (None, None)
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO recipients"
+                " (email, phone, channels, quiet_start, quiet_end, timezone)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    email,
+                    phone,
+                    sum(CHANNELS[channel] for channel in set(channels)),
+                    parse_minutes(quiet_start),
+                    parse_minutes(quiet_end),
+                    zone,
+                ),
+            )
+            recipient_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT OR IGNORE INTO subscriptions (topic, recipient_id)"
+                " VALUES (?, ?)",
+                ((topic, recipient_id) for topic in topics),
+            )
+        return recipient_id
+
+    def subscribe(self, recipient_id, topic):
+        with self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO subscriptions (topic, recipient_id)"
+                " VALUES (?, ?)",
+                (topic, recipient_id),
+            )
+
+    def unsubscribe(self, recipient_id, topic):
+        with self.db:
+            self.db.execute(
+                "DELETE FROM subscriptions WHERE topic = ? AND recipient_id = ?",
+                (topic, recipient_id),
+            )
+
+    def import_csv(self, path):
+        """
+        Add recipients from a CSV file
+
+        Columns: email, phone, channels (e.g. "email sms"), quiet_start,
+        quiet_end ("HH:MM"), timezone and topics (space separated).
+
+        Returns:
+            int: Number of recipients added
+        """
+        count = 0
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                self.add_recipient(
+                    row.get("email") or None,
+                    row.get("phone") or None,
+                    (row.get("channels") or "email sms").split(),
+                    (row.get("quiet_start"), row.get("quiet_end")),
+                    row.get("timezone") or "UTC",
+                    (row.get("topics") or "").split(),
+                )
+                count += 1
+        return count
+
+    def recipients_for(self, topics, chunk_size=1000):
+        """
+        Stream the recipients subscribed to any of the topics
+
+        Args:
+            topics: Topics with an advantage to announce
+            chunk_size: Recipients fetched per chunk
+
+        Yields:
+            list: Up to chunk_size rows of (id, email, phone, channels,
+                  quiet_start, quiet_end, timezone, matched topics)
+        """
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS batch_topics (topic TEXT)")
+        self.db.execute("DELETE FROM batch_topics")
+        self.db.executemany(
+            "INSERT INTO batch_topics (topic) VALUES (?)",
+            ((topic,) for topic in topics),
+        )
+
+        cursor = self.db.execute(
+            "SELECT r.id, r.email, r.phone, r.channels, r.quiet_start,"
+            " r.quiet_end, r.timezone, group_concat(s.topic, char(10))"
+            " FROM batch_topics b"
+            " JOIN subscriptions s ON s.topic = b.topic"
+            " JOIN recipients r ON r.id = s.recipient_id"
+            " GROUP BY r.id ORDER BY r.id"
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [row[:7] + (sorted(row[7].split("\n")),) for row in rows]
+
+    def hold(self, rows):
+        """
+        Keep advantages for recipients in their quiet hours
+
+        A newer advantage of the same topic replaces the held one.
+
+        Args:
+            rows: (recipient id, topic, message, subject) tuples
+        """
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO held"
+                " (recipient_id, topic, message, subject) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def held_count(self):
+        return self.db.execute("SELECT count(*) FROM held").fetchone()[0]
+
+    def held_for(self, chunk_size=1000):
+        """
+        Stream the recipients with held advantages
+
+        Yields:
+            list: Up to chunk_size rows of (id, email, phone, channels,
+                  quiet_start, quiet_end, timezone, [(topic, message,
+                  subject), ...])
+        """
+        cursor = self.db.execute(
+            "SELECT r.id, r.email, r.phone, r.channels, r.quiet_start,"
+            " r.quiet_end, r.timezone, h.topic, h.message, h.subject"
+            " FROM held h JOIN recipients r ON r.id = h.recipient_id"
+            " ORDER BY r.id, h.topic"
+        )
+        rows = iter(lambda: cursor.fetchmany(chunk_size), [])
+        recipients = (
+            recipient + ([row[7:] for row in group],)
+            for recipient, group in itertools.groupby(
+                itertools.chain.from_iterable(rows), key=lambda row: row[:7]
+            )
+        )
+        while True:
+            chunk = list(itertools.islice(recipients, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+    def release(self, keys):
+        """
+        Forget held advantages
+
+        Args:
+            keys: (recipient id, topic) pairs
+        """
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM held WHERE recipient_id = ? AND topic = ?", keys
+            )
+
+
+class FanOut:
+    """
+    Advantages of a run waiting to be sent to their subscribers
+
+    Recipients in a chunk with the same matched topics and channels get
+    the same message, so they are grouped into one send (one SMTP session
+    for all of their addresses). Advantages for recipients in their quiet
+    hours are held in the store and sent by the first run after the quiet
+    hours end, unless a newer advantage of the same topic replaces them.
+    """
+
+    def __init__(self, store, chunk_size=1000):
+        self.store = store
+        self.chunk_size = chunk_size
+        self.pending = {}  # topic -> (message, subject)
+
+    def __len__(self):
+        """Number of advantages waiting, including held ones"""
+        return len(self.pending) + self.store.held_count()
+
+    def add(self, topic, message, subject):
+        self.pending[topic] = (message, subject)
+
+    def deliveries(self, now, digest=False, signature=None):
+        """
+        Take the pending advantages and plan their sends
+
+        Args:
+            now: Seconds since the epoch, for quiet hours
+            digest: Combine a recipient's advantages into one message
+            signature: Message signature (moved to the end of digests)
+
+        Yields:
+            tuple: (emails, phones, message, subject)
+        """
+        pending, self.pending = self.pending, {}
+        yield from self.release_held(now, pending, digest, signature)
+        if not pending:
+            return
+
+        quiet = 0
+        for chunk in self.store.recipients_for(pending, self.chunk_size):
+            groups = {}
+            held = []
+            for recipient_id, email, phone, channels, start, end, zone, topics in chunk:
+                if in_quiet_hours(start, end, zone, now):
+                    quiet += 1
+                    held.extend(
+                        (recipient_id, topic) + pending[topic] for topic in topics
+                    )
+                    continue
+                emails, phones = groups.setdefault(tuple(topics), ([], []))
+                if email and channels & CHANNEL_EMAIL:
+                    emails.append(email)
+                if phone and channels & CHANNEL_SMS:
+                    phones.append(phone)
+            self.store.hold(held)
+
+            for topics, (emails, phones) in groups.items():
+                yield from self.sends(
+                    emails,
+                    phones,
+                    [pending[topic] for topic in topics],
+                    digest,
+                    signature,
+                )
+
+        if quiet:
+            logger.info(
+                f"Holding notifications of {quiet} recipients until their quiet"
+                " hours end"
+            )
+
+    def release_held(self, now, pending, digest, signature):
+        """
+        Plan the sends of held advantages whose recipients are out of quiet hours
+
+        Held advantages of a topic in pending are dropped instead, the
+        fresh advantage being sent in their place.
+
+        Yields:
+            tuple: (emails, phones, message, subject)
+        """
+        released = []
+        for chunk in self.store.held_for(self.chunk_size):
+            groups = {}
+            for recipient_id, email, phone, channels, start, end, zone, held in chunk:
+                if in_quiet_hours(start, end, zone, now):
+                    continue
+                released.extend((recipient_id, topic) for topic, _, _ in held)
+                sections = tuple(
+                    (message, subject)
+                    for topic, message, subject in held
+                    if topic not in pending
+                )
+                if not sections:
+                    continue
+                emails, phones = groups.setdefault(sections, ([], []))
+                if email and channels & CHANNEL_EMAIL:
+                    emails.append(email)
+                if phone and channels & CHANNEL_SMS:
+                    phones.append(phone)
+
+            for sections, (emails, phones) in groups.items():
+                yield from self.sends(emails, phones, list(sections), digest, signature)
+
+        if released:
+            self.store.release(released)
+            logger.info(f"Released {len(released)} held notifications")
+
+    def sends(self, emails, phones, sections, digest, signature):
+        """Yield the sends of sections to a group of recipients"""
+        if not emails and not phones:
+            return
+        if digest:
+            sections = [construct_digest(sections, signature)]
+        for message, subject in sections:
+            yield emails, phones, message, subject
+
+
+def subscription_fanout(config):
+    """
+    Return the subscriber fan-out of a configuration
+
+    Returns:
+        FanOut: The fan-out, or None when [subscriptions] is disabled
+    """
+    settings = config["subscriptions"]
+    if not settings.get("enabled"):
+        return None
+    fanout = config.get("subscription_fanout")
+    if fanout is None:
+        fanout = config["subscription_fanout"] = FanOut(
+            SubscriptionStore(settings["path"]), settings.get("chunk_size", 1000)
+        )
+    return fanout
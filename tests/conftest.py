@@ -2,15 +2,133 @@ import pytest
 import sys
 import os
 import logging
+import tempfile
 
 # Add parent directory to path to import modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import delivery
+from tests import perf
 
-@pytest.fixture(autouse=True)
+
+class FakeClock:
+    """Manually advanced clock, with a sleep that advances it"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+# Observations shared by the history and calendar tests
+def make_weather(main, description, temp, condition_id=800):
+    """Build a minimal API-shaped observation"""
+    return {
+        "weather": [{"id": condition_id, "main": main, "description": description}],
+        "main": {"temp": temp, "feels_like": temp, "humidity": 50},
+        "wind": {"speed": 3.0},
+        "dt": 1622181341,
+    }
+
+
+SUNNY = make_weather("Clear", "clear sky", 23.5)
+RAINY_COLD = make_weather("Rain", "moderate rain", 12.0, 501)
+RAINY_MILD = make_weather("Rain", "light rain", 22.0, 500)
+CLOUDY_HOT = make_weather("Clouds", "overcast clouds", 31.0, 804)
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("perf", "performance budgets")
+    group.addoption(
+        "--perf",
+        action="store_true",
+        help="Run the benchmarks (marked perf) and check their budgets",
+    )
+    group.addoption(
+        "--perf-update-baseline",
+        action="store_true",
+        help="Store the benchmark results as the new baseline",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "perf: benchmark checked against tests/perf_budgets.toml"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip the benchmarks unless --perf is given"""
+    if config.getoption("--perf") or config.getoption("--perf-update-baseline"):
+        return
+    skip = pytest.mark.skip(reason="benchmark (run with --perf)")
+    for item in items:
+        if "perf" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session", autouse=True)
 def disable_logging():
-    """Disable logging during tests"""
+    """
+    Disable logging during tests
+
+    Once per session (per worker with pytest -n), so threads a test leaves
+    behind never see logging switched back on halfway through.
+    """
     logging.disable(logging.CRITICAL)
     yield
     logging.disable(logging.NOTSET)
 
+
+@pytest.fixture(autouse=True)
+def reset_delivery():
+    """Give every test fresh circuit breakers and no outbox"""
+    delivery.configure({})
+    yield
+    delivery.configure({})
+
+
+@pytest.fixture
+def history_dir():
+    """Temporary history directory"""
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+@pytest.fixture(scope="session")
+def perf_budgets():
+    return perf.load_budgets()
+
+
+@pytest.fixture
+def benchmark(request, perf_budgets):
+    """
+    Time a function and check it against its budget and baseline
+
+    Usage: benchmark(name, func) where name is a table of perf_budgets.toml.
+
+    Returns:
+        dict: The result of perf.measure()
+    """
+    update = request.config.getoption("--perf-update-baseline")
+
+    scale = perf.contention()
+    if update and scale > 1:
+        pytest.skip("baselines are only stored from serial runs")
+
+    def run(name, func):
+        budget = perf_budgets[name]
+        result = perf.measure(func, budget.get("rounds", 5))
+        if update:
+            perf.save_baseline(name, result)
+            return result
+        failures = perf.check(name, result, budget, perf.load_baseline(name), scale)
+        if failures:
+            pytest.fail("\n".join(failures))
+        return result
+
+    return run
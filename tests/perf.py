@@ -0,0 +1,160 @@
+import gc
+import json
+import os
+import platform
+import time
+
+import tomli
+
+PERF_DIR = os.path.dirname(os.path.abspath(__file__))
+BUDGETS_FILE = os.path.join(PERF_DIR, "perf_budgets.toml")
+BASELINE_DIR = os.path.join(PERF_DIR, "perf_baseline")
+
+# Time one round of calls should take at least, so timer resolution and
+# scheduling noise don't dominate (seconds)
+MIN_ROUND_TIME = 0.02
+
+
+def contention():
+    """
+    How many test processes share each CPU
+
+    pytest -n runs benchmarks next to other tests, so their times are
+    scaled by this before being compared (1.0 in a serial run).
+    """
+    workers = int(os.environ.get("PYTEST_XDIST_WORKER_COUNT", 1))
+    return max(1.0, workers / (os.cpu_count() or 1))
+
+
+def load_budgets(path=BUDGETS_FILE):
+    """
+    Load the performance budgets
+
+    Returns:
+        dict: Benchmark name -> budget, with the [default] settings applied
+    """
+    with open(path, "rb") as f:
+        budgets = tomli.load(f)
+    defaults = budgets.pop("default", {})
+    return {name: {**defaults, **budget} for name, budget in budgets.items()}
+
+
+def measure(func, rounds=5):
+    """
+    Time repeated calls of func
+
+    Like timeit, the number of calls per round is calibrated first and the
+    garbage collector is off while timing.
+
+    Returns:
+        dict: best_us and mean_us per call (best and mean round),
+              calls_per_second over all rounds, calls per round
+    """
+    number = 1
+    while True:
+        elapsed = _time_round(func, number)
+        if elapsed >= MIN_ROUND_TIME or number >= 1 << 20:
+            break
+        number *= 2
+
+    times = [_time_round(func, number) for _ in range(rounds)]
+    return {
+        "best_us": min(times) / number * 1e6,
+        "mean_us": sum(times) / len(times) / number * 1e6,
+        "calls_per_second": number * len(times) / sum(times),
+        "number": number,
+    }
+
+
+def _time_round(func, number):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def baseline_path(name, directory=BASELINE_DIR):
+    return os.path.join(directory, f"{name}.json")
+
+
+def load_baseline(name, directory=BASELINE_DIR):
+    """Return the stored result of a benchmark, or None"""
+    try:
+        with open(baseline_path(name, directory)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(name, result, directory=BASELINE_DIR):
+    """
+    Store a benchmark result as its new baseline
+
+    Every benchmark has its own file, written atomically, so parallel
+    workers (pytest -n) never write the same file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = baseline_path(name, directory)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(
+            {
+                "best_us": round(result["best_us"], 3),
+                "mean_us": round(result["mean_us"], 3),
+                "calls_per_second": round(result["calls_per_second"], 1),
+                "machine": platform.machine(),
+                "python": platform.python_version(),
+            },
+            f,
+            indent=2,
+        )
+        f.write("\n")
+    os.replace(temp_path, path)
+
+
+def check(name, result, budget, baseline=None, scale=1.0):
+    """
+    Compare a benchmark result with its budget and baseline
+
+    Args:
+        name: Benchmark name
+        result: Result of measure()
+        budget: Budget of the benchmark:
+            - max_mean_us: Slowest acceptable mean time per call
+            - min_calls_per_second: Lowest acceptable throughput
+            - regression: Slowdown allowed against the baseline (1.0: 100%)
+        baseline: Stored result to compare with (optional)
+        scale: Factor the thresholds are relaxed by (see contention())
+
+    Returns:
+        list: Descriptions of the thresholds that were missed
+    """
+    failures = []
+    if "max_mean_us" in budget:
+        limit = budget["max_mean_us"] * scale
+        if result["mean_us"] > limit:
+            failures.append(
+                f"{name}: mean {result['mean_us']:.2f}us over budget of {limit:g}us"
+            )
+    if "min_calls_per_second" in budget:
+        limit = budget["min_calls_per_second"] / scale
+        if result["calls_per_second"] < limit:
+            failures.append(
+                f"{name}: {result['calls_per_second']:.0f} calls/s"
+                f" under budget of {limit:g}"
+            )
+    if baseline is not None and "regression" in budget:
+        limit = baseline["best_us"] * (1 + budget["regression"]) * scale
+        if result["best_us"] > limit:
+            failures.append(
+                f"{name}: best {result['best_us']:.2f}us regressed from"
+                f" baseline {baseline['best_us']:.2f}us"
+                f" (allowed up to {limit:.2f}us)"
+            )
+    return failures
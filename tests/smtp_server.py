@@ -0,0 +1,142 @@
+import base64
+import os
+import shutil
+import socket
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+
+
+def self_signed_context(directory):
+    """
+    Build a server TLS context with a throwaway self-signed certificate
+
+    Returns:
+        ssl.SSLContext: The context, or None if openssl isn't available
+    """
+    if shutil.which("openssl") is None:
+        return None
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-keyout",
+            key,
+            "-out",
+            cert,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks enough SMTP (EHLO, STARTTLS, AUTH PLAIN, MAIL, RCPT, DATA)"""
+
+    def setup(self):
+        # Replies are small: don't let Nagle hold them back for an ACK
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+
+    def reply(self, *lines):
+        """Send a (multiline) reply in one write"""
+        self.wfile.write(b"".join(line.encode() + b"\r\n" for line in lines))
+        self.wfile.flush()
+
+    def handle(self):
+        self.reply("220 localhost ESMTP stub")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(" ", 1)[0].upper()
+
+            if verb in ("EHLO", "HELO"):
+                if isinstance(self.connection, ssl.SSLSocket):
+                    self.reply("250-localhost", "250 AUTH PLAIN")
+                else:
+                    self.reply("250-localhost", "250-STARTTLS", "250 AUTH PLAIN")
+            elif verb == "STARTTLS":
+                self.reply("220 Ready to start TLS")
+                self.connection = self.server.tls.wrap_socket(
+                    self.connection, server_side=True
+                )
+                self.rfile = self.connection.makefile("rb")
+                self.wfile = self.connection.makefile("wb")
+            elif verb == "AUTH":
+                # AUTH PLAIN <base64 of \0user\0password>
+                base64.b64decode(command.split()[-1])
+                self.reply("235 Authentication successful")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with self.server.lock:
+                    self.server.messages += 1
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class LoopbackSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    SMTP server on a loopback port that accepts every message
+
+    Usage:
+        with LoopbackSMTPServer(tls_context) as server:
+            send_email(..., {"smtp_server": "127.0.0.1", "smtp_port": server.port})
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, tls):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.tls = tls
+        self.port = self.server_address[1]
+        self.messages = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def loopback_smtp_server():
+    """
+    Start a LoopbackSMTPServer with a fresh self-signed certificate
+
+    Returns:
+        LoopbackSMTPServer: The server (use as a context manager), or None
+                            if no certificate could be made
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        tls = self_signed_context(directory)
+    if tls is None:
+        return None
+    return LoopbackSMTPServer(tls)
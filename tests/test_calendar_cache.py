@@ -0,0 +1,143 @@
+import pytest
+import sys
+import os
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calendar_cache import (
+    calendar_streaks,
+    calendar_win_rate,
+    day_advantage,
+    load_calendar,
+    range_mask,
+    rebuild_calendar,
+    record_run,
+)
+from history import record_observation
+from tests.conftest import CLOUDY_HOT, RAINY_COLD, RAINY_MILD, SUNNY
+
+PAIR = ("Brisbane", "Melbourne")
+
+
+def ts(year, month, day, hour=12):
+    """Run timestamp of a UTC date and hour"""
+    return int(datetime(year, month, day, hour, tzinfo=timezone.utc).timestamp())
+
+
+def record_days(directory, days):
+    """Record one run per (date, their weather) with Brisbane sunny"""
+    for day, theirs in days:
+        record_run(
+            [PAIR],
+            {"Brisbane": SUNNY, "Melbourne": theirs},
+            directory,
+            ts(day.year, day.month, day.day),
+            18,
+            26,
+        )
+
+
+class TestCalendarCache:
+    """Tests for the calendar_cache module"""
+
+    def test_record_and_look_up(self, history_dir):
+        """Test runs set the bits of their day"""
+        record_days(
+            history_dir,
+            [(date(2024, 3, 1), RAINY_COLD), (date(2024, 3, 2), RAINY_MILD)],
+        )
+        record_run(
+            [PAIR],
+            {"Brisbane": SUNNY, "Melbourne": SUNNY},
+            history_dir,
+            ts(2024, 3, 2, 18),
+            18,
+            26,
+        )
+
+        assert day_advantage(*PAIR, history_dir, date(2024, 3, 1)) == {
+            "observed": True,
+            "weather": False,
+            "temperature": False,
+            "both": True,
+            "won": True,
+        }
+        march_2 = day_advantage(*PAIR, history_dir, date(2024, 3, 2))
+        assert march_2["observed"] and march_2["weather"] and march_2["won"]
+        assert not day_advantage(*PAIR, history_dir, date(2024, 3, 3))["observed"]
+
+    def test_skips_missing_observations(self, history_dir):
+        """Test pairs without both observations are left alone"""
+        assert record_run([PAIR], {"Brisbane": SUNNY}, history_dir, 0, 18, 26) == 0
+        assert load_calendar(*PAIR, history_dir) == {}
+
+    def test_win_rate_and_streaks(self, history_dir):
+        """Test popcount and run-length queries across a year boundary"""
+        record_days(
+            history_dir,
+            [
+                (date(2023, 12, 30), RAINY_COLD),
+                (date(2023, 12, 31), CLOUDY_HOT),
+                (date(2024, 1, 1), RAINY_MILD),
+                (date(2024, 1, 2), SUNNY),
+                (date(2024, 1, 3), RAINY_COLD),
+            ],
+        )
+
+        result = calendar_win_rate(*PAIR, history_dir)
+        assert result == {
+            "days": 5,
+            "wins": 4,
+            "weather": 1,
+            "temperature": 1,
+            "both": 2,
+            "win_rate": 0.8,
+        }
+        assert (
+            calendar_win_rate(*PAIR, history_dir, start=date(2024, 1, 1))["wins"] == 2
+        )
+        assert calendar_streaks(*PAIR, history_dir) == {
+            "longest": 3,
+            "current": 1,
+            "count": 2,
+        }
+        assert calendar_streaks(*PAIR, history_dir, end=date(2024, 1, 2)) == {
+            "longest": 3,
+            "current": 3,
+            "count": 1,
+        }
+
+    def test_rebuild_matches_incremental(self, history_dir):
+        """Test a calendar rebuilt from history equals the incremental one"""
+        rng = np.random.default_rng(0)
+        choices = [SUNNY, RAINY_COLD, RAINY_MILD, CLOUDY_HOT]
+        for day in range(0, 400, 3):
+            run_ts = ts(2023, 1, 1) + day * 86400
+            weather = {city: choices[rng.integers(4)] for city in PAIR}
+            for city in PAIR:
+                record_observation(city, weather[city], history_dir, run_ts)
+            record_run([PAIR], weather, history_dir, run_ts, 18, 26)
+
+        incremental = load_calendar(*PAIR, history_dir)
+        assert rebuild_calendar(*PAIR, history_dir, 18, 26) == 134
+        rebuilt = load_calendar(*PAIR, history_dir)
+        assert sorted(rebuilt) == [2023, 2024]
+        for year in rebuilt:
+            assert np.array_equal(rebuilt[year], incremental[year])
+
+    def test_range_mask(self):
+        """Test range masks select [start, end) within the year"""
+        days = np.unpackbits(
+            range_mask(2023, date(2022, 6, 1), date(2023, 1, 3)), bitorder="little"
+        )
+        assert list(np.flatnonzero(days)) == [0, 1]
+        assert np.unpackbits(range_mask(2024), bitorder="little").sum() == 366
+        assert np.unpackbits(range_mask(2023), bitorder="little").sum() == 365
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,152 @@
+import pytest
+import sys
+import os
+import tempfile
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from change_detection import (
+    inputs_changed,
+    load_state,
+    observation_signature,
+    record_evaluation,
+    save_state,
+    should_notify,
+    update_entry,
+)
+
+SAMPLE_WEATHER = {
+    "weather": [{"id": 800, "main": "Clear", "description": "clear sky"}],
+    "main": {"temp": 23.4},
+    "dt": 1622181341,
+}
+
+OUR_SIGNATURE = [1622181341, 800, 23]
+THEIR_SIGNATURE = [1622181341, 501, 12]
+COMFORT = (18, 26)
+HOUR = 3600
+
+
+class TestChangeDetection:
+    """Tests for the change_detection module"""
+
+    def test_observation_signature(self):
+        """Test the signature uses dt, condition ID and rounded temperature"""
+        assert observation_signature(SAMPLE_WEATHER) == OUR_SIGNATURE
+        assert observation_signature(None) is None
+        assert observation_signature({"dt": 1}) == [1, None, None]
+
+    def test_inputs_changed(self):
+        """Test change detection against the last evaluated state"""
+        entry = update_entry(None, OUR_SIGNATURE, THEIR_SIGNATURE, COMFORT, None, False)
+
+        assert inputs_changed(None, OUR_SIGNATURE, THEIR_SIGNATURE, COMFORT)
+        assert not inputs_changed(entry, OUR_SIGNATURE, THEIR_SIGNATURE, COMFORT)
+        assert inputs_changed(entry, [1622181342, 800, 23], THEIR_SIGNATURE, COMFORT)
+        assert inputs_changed(entry, OUR_SIGNATURE, [1622181341, 501, 13], COMFORT)
+        assert inputs_changed(entry, OUR_SIGNATURE, THEIR_SIGNATURE, (20, 26))
+
+    def test_should_notify_on_flip(self):
+        """Test notifications are only sent when the advantage flips"""
+        assert should_notify(None, "weather", 0, HOUR, 6 * HOUR)
+        assert not should_notify(None, None, 0, HOUR, 6 * HOUR)
+
+        entry = update_entry(
+            None, OUR_SIGNATURE, THEIR_SIGNATURE, COMFORT, "weather", True, now=0
+        )
+        # Same advantage as last time - identical boast is not resent
+        assert not should_notify(entry, "weather", 10 * HOUR, HOUR, 6 * HOUR)
+        # Flipped to a different advantage after the cooldown
+        assert should_notify(entry, "both", 2 * HOUR, HOUR, 6 * HOUR)
+
+    def test_should_notify_cooldown_and_dedup(self):
+        """Test cooldown and dedup windows hold back notifications"""
+        entry = update_entry(
+            None, OUR_SIGNATURE, THEIR_SIGNATURE, COMFORT, "weather", True, now=0
+        )
+        entry = update_entry(
+            entry, OUR_SIGNATURE, THEIR_SIGNATURE, COMFORT, None, False, now=HOUR
+        )
+
+        # Within the cooldown nothing is sent
+        assert not should_notify(entry, "both", HOUR / 2, HOUR, 6 * HOUR)
+        # The same reason flipping back is deduplicated within the window
+        assert not should_notify(entry, "weather", 2 * HOUR, HOUR, 6 * HOUR)
+        assert should_notify(entry, "weather", 7 * HOUR, HOUR, 6 * HOUR)
+        # A different reason is fine once the cooldown has passed
+        assert should_notify(entry, "temperature", 2 * HOUR, HOUR, 6 * HOUR)
+
+    def test_cooldown_delays_flip(self):
+        """Test an advantage held back by the cooldown is sent once it's over"""
+        state = {}
+        settings = {"cooldown_minutes": 60, "dedup_window_minutes": 360}
+
+        def evaluate(reason, now):
+            return record_evaluation(
+                state,
+                "Brisbane",
+                "Melbourne",
+                SAMPLE_WEATHER,
+                SAMPLE_WEATHER,
+                COMFORT,
+                reason,
+                settings,
+                now=now,
+            )
+
+        assert evaluate("weather", 0)
+        assert not evaluate(None, 600)
+        assert not evaluate("both", 1200)
+        # Same inputs, but the held back advantage is still due
+        assert inputs_changed(
+            state["Brisbane|Melbourne"], OUR_SIGNATURE, OUR_SIGNATURE, COMFORT
+        )
+        assert not evaluate("both", 1800)
+        assert evaluate("both", 7200)
+        assert not evaluate("both", 7800)
+        assert "pending" not in state["Brisbane|Melbourne"]
+
+    def test_pending_cleared_when_advantage_lost(self):
+        """Test a held back advantage is dropped if it's gone by the next run"""
+        state = {}
+        settings = {"cooldown_minutes": 60, "dedup_window_minutes": 360}
+        for reason, now, sent in [
+            ("weather", 0, True),
+            ("both", 600, False),
+            (None, 1200, False),
+            (None, 7200, False),
+        ]:
+            assert (
+                record_evaluation(
+                    state,
+                    "Brisbane",
+                    "Melbourne",
+                    SAMPLE_WEATHER,
+                    SAMPLE_WEATHER,
+                    COMFORT,
+                    reason,
+                    settings,
+                    now=now,
+                )
+                == sent
+            )
+        assert "pending" not in state["Brisbane|Melbourne"]
+
+    def test_state_roundtrip(self):
+        """Test state is saved and loaded"""
+        with tempfile.TemporaryDirectory() as directory:
+            state_file = os.path.join(directory, "state.json")
+            assert load_state(state_file) == {}
+
+            state = {
+                "Brisbane|Melbourne": update_entry(
+                    None, OUR_SIGNATURE, THEIR_SIGNATURE, COMFORT, "both", True, now=5
+                )
+            }
+            assert save_state(state_file, state)
+            assert load_state(state_file) == state
+
+            with open(state_file, "w") as f:
+                f.write("not json")
+            assert load_state(state_file) == {}
@@ -0,0 +1,161 @@
+import pytest
+import sys
+import os
+import calendar
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from comfort import ComfortTable, comfort_signature, get_comfort_table, season_months
+from comparison import compare_weather
+from config import DEFAULT_CONFIG
+from history import encode_observation
+
+
+def make_config(**comfort):
+    """Build a configuration with the given [comfort] settings"""
+    config = {key: dict(value) for key, value in DEFAULT_CONFIG.items()}
+    config["comfort"].update(comfort)
+    return config
+
+
+def make_weather(temp, month=1, feels_like=None, humidity=50, wind_speed=3.0):
+    """Build weather data observed mid-month in 2024"""
+    return {
+        "dt": calendar.timegm((2024, month, 15, 12, 0, 0)),
+        "weather": [{"id": 800, "main": "Clear", "description": "clear sky"}],
+        "main": {
+            "temp": temp,
+            "feels_like": temp if feels_like is None else feels_like,
+            "humidity": humidity,
+        },
+        "wind": {"speed": wind_speed},
+    }
+
+
+class TestComfort:
+    """Tests for the comfort module"""
+
+    def test_defaults_match_temperature_range(self):
+        """Test that the default profile is the [temperature] range"""
+        table = ComfortTable.from_config(make_config())
+
+        assert table.is_comfortable(make_weather(18))
+        assert table.is_comfortable(make_weather(26))
+        assert not table.is_comfortable(make_weather(17.9))
+        assert not table.is_comfortable(make_weather(26.1))
+        assert not table.is_comfortable(None)
+        assert not table.is_comfortable({"main": {}})
+
+    def test_feels_like_and_limits(self):
+        """Test the feels_like measure and humidity/wind limits"""
+        table = ComfortTable.from_config(
+            make_config(measure="feels_like", max_humidity=80, max_wind_speed=10)
+        )
+
+        assert table.is_comfortable(make_weather(30, feels_like=24))
+        assert not table.is_comfortable(make_weather(22, feels_like=28))
+        assert not table.is_comfortable(make_weather(22, humidity=90))
+        assert not table.is_comfortable(make_weather(22, wind_speed=12))
+
+    def test_season_and_city_precedence(self):
+        """Test that city and city-season profiles override seasons"""
+        config = make_config(
+            seasons={"winter": {"min": 15}},
+            cities={"Darwin": {"max": 32, "winter": {"min": 20}}},
+        )
+        table = ComfortTable.from_config(config)
+
+        # July is winter in the southern hemisphere
+        assert table.is_comfortable(make_weather(16, month=7))
+        assert not table.is_comfortable(make_weather(16, month=1))
+        assert table.is_comfortable(make_weather(30, month=1), "darwin")
+        assert not table.is_comfortable(make_weather(30, month=1), "Sydney")
+        assert not table.is_comfortable(make_weather(18, month=7), "Darwin")
+        assert table.is_comfortable(make_weather(18, month=1), "Darwin")
+
+    def test_northern_seasons(self):
+        """Test that seasons flip in the northern hemisphere"""
+        assert season_months("winter", "north") == (12, 1, 2)
+        assert season_months("summer", "north") == (6, 7, 8)
+
+    def test_vectorized_matches_scalar(self):
+        """Test that record checks agree with the scalar check"""
+        table = ComfortTable.from_config(
+            make_config(
+                max_humidity=85,
+                seasons={"winter": {"min": 14}},
+                cities={"Darwin": {"max": 33}},
+            )
+        )
+        cases = [
+            (city, make_weather(temp, month, humidity=humidity))
+            for city in ("Sydney", "Darwin")
+            for temp in (12, 15, 20, 27, 32, 35)
+            for month in (1, 7)
+            for humidity in (40, 90)
+        ]
+        records = np.concatenate(
+            [encode_observation(weather_data) for _, weather_data in cases]
+        )
+        rows = table.rows([city for city, _ in cases])
+
+        vectorized = table.comfortable_records(records, rows)
+        expected = [
+            table.is_comfortable(weather_data, city) for city, weather_data in cases
+        ]
+        assert list(vectorized) == expected
+
+    def test_months_in_local_time(self):
+        """Test the city's UTC offset picks the month near a month boundary"""
+        table = ComfortTable.from_config(make_config(seasons={"summer": {"max": 32}}))
+        # 20:00 UTC on 30 November is already 1 December (summer) in Brisbane
+        weather_data = dict(
+            make_weather(30), dt=calendar.timegm((2024, 11, 30, 20, 0, 0))
+        )
+
+        local = dict(weather_data, timezone=36000)
+        assert not table.is_comfortable(weather_data)
+        assert table.is_comfortable(local)
+        assert table.comfort_limits(None, local) == (18, 32)
+
+        records = encode_observation(weather_data)
+        assert not table.comfortable_records(records, 0)[0]
+        assert table.comfortable_records(records, 0, [36000])[0]
+
+    def test_compare_weather_uses_profiles(self):
+        """Test that compare_weather picks up per-city profiles"""
+        config = make_config(cities={"Darwin": {"max": 32}})
+        comfort = get_comfort_table(config)
+        assert "comfort_table" not in config
+
+        result = compare_weather(
+            make_weather(30), make_weather(30), 18, 26, comfort, "Darwin", "Sydney"
+        )
+        assert result["our_temp_comfortable"]
+        assert not result["their_temp_comfortable"]
+        assert result["reason"] == "temperature"
+
+    def test_comfort_signature(self):
+        """Test every comfort setting that can change a comparison is signed"""
+        base = comfort_signature(make_config())
+        assert base[:2] == (18, 26)
+        assert comfort_signature(make_config()) == base
+
+        for settings in [
+            {"measure": "feels_like"},
+            {"max_humidity": 80},
+            {"max_wind_speed": 10},
+            {"seasons": {"winter": {"min": 14}}},
+            {"cities": {"Darwin": {"max": 32}}},
+            {"cities": {"Darwin": {"winter": {"min": 20}}}},
+        ]:
+            signature = comfort_signature(make_config(**settings))
+            assert signature[:2] == base[:2]
+            assert signature != base, settings
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
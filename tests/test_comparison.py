@@ -0,0 +1,64 @@
+import pytest
+import sys
+import os
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from comparison import compare_weather
+
+# Sample weather data for testing
+SUNNY_COMFORTABLE = {
+    "weather": [{"main": "Clear", "description": "clear sky"}],
+    "main": {"temp": 23.5},
+}
+
+RAINY_COLD = {
+    "weather": [{"main": "Rain", "description": "moderate rain"}],
+    "main": {"temp": 12.5},
+}
+
+RAINY_COMFORTABLE = {
+    "weather": [{"main": "Rain", "description": "light rain"}],
+    "main": {"temp": 22.0},
+}
+
+CLOUDY_HOT = {
+    "weather": [{"main": "Clouds", "description": "overcast clouds"}],
+    "main": {"temp": 31.0},
+}
+
+
+class TestComparison:
+    """Tests for the comparison module"""
+
+    def test_reasons(self):
+        """Test each advantage reason"""
+        assert (
+            compare_weather(SUNNY_COMFORTABLE, RAINY_COLD, 18, 26)["reason"] == "both"
+        )
+        assert (
+            compare_weather(SUNNY_COMFORTABLE, RAINY_COMFORTABLE, 18, 26)["reason"]
+            == "weather"
+        )
+        assert (
+            compare_weather(SUNNY_COMFORTABLE, CLOUDY_HOT, 18, 26)["reason"]
+            == "temperature"
+        )
+        assert compare_weather(CLOUDY_HOT, RAINY_COLD, 18, 26)["reason"] is None
+
+    def test_condition_flags(self):
+        """Test the individual checks are reported"""
+        result = compare_weather(SUNNY_COMFORTABLE, CLOUDY_HOT, 18, 26)
+        assert result["our_city_sunny"]
+        assert not result["their_city_rainy"]
+        assert result["our_temp_comfortable"]
+        assert not result["their_temp_comfortable"]
+
+    def test_missing_data(self):
+        """Test comparisons with missing weather data"""
+        result = compare_weather(None, None, 18, 26)
+        assert result["reason"] is None
+        assert compare_weather(SUNNY_COMFORTABLE, None, 18, 26)["reason"] == (
+            "temperature"
+        )
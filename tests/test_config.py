@@ -7,7 +7,7 @@ from unittest.mock import patch, MagicMock
 # Add parent directory to path to import modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import load_config, get_credential
+from config import load_config, get_credential, get_city_pairs
 
 
 class TestConfig:
@@ -117,3 +117,19 @@ class TestConfig:
         mock_env_get.assert_called_once_with("TEST_ENV_VAR")
         mock_run.assert_called_once()
 
+
+    def test_get_city_pairs(self):
+        """Test city pairs default to the single configured pair"""
+        config = {"cities": {"our_city": "Brisbane", "their_city": "Melbourne"}}
+        assert get_city_pairs(config) == [("Brisbane", "Melbourne")]
+
+        # Invalid pairs are skipped
+        config["cities"]["pairs"] = [
+            ["Brisbane", "Sydney"],
+            ["Perth"],
+            ["Darwin", "Hobart"],
+        ]
+        assert get_city_pairs(config) == [
+            ("Brisbane", "Sydney"),
+            ("Darwin", "Hobart"),
+        ]
@@ -0,0 +1,76 @@
+import pytest
+import sys
+import os
+import json
+from unittest.mock import MagicMock, patch
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import decoding
+from decoding import decode, loads, project_list, project_weather
+from providers import Observation
+from weather_api import MOCK_BAD_WEATHER, MOCK_GOOD_WEATHER, fetch_weather
+
+
+class TestDecoding:
+    """Tests for the decoding module"""
+
+    def test_project_weather(self):
+        """Test that only the fields WeatherMark reads are kept"""
+        projected = project_weather(MOCK_GOOD_WEATHER)
+
+        assert projected == {
+            "id": 2174003,
+            "name": "Brisbane",
+            "dt": 1622181341,
+            "timezone": 36000,
+            "coord": {"lon": 153.0281, "lat": -27.4679},
+            "cod": 200,
+            "weather": [{"id": 800, "main": "Clear", "description": "clear sky"}],
+            "main": {"temp": 23.5, "feels_like": 23.7, "humidity": 61},
+            "wind": {"speed": 3.6},
+            "sys": {"country": "AU"},
+        }
+        assert Observation.from_weather_data(
+            "Brisbane", projected
+        ) == Observation.from_weather_data("Brisbane", MOCK_GOOD_WEATHER)
+
+    def test_project_list(self):
+        """Test that every city of a multi-city response is projected"""
+        body = {"cnt": 2, "list": [MOCK_GOOD_WEATHER, MOCK_BAD_WEATHER]}
+        projected = project_list(body)
+
+        assert projected["cnt"] == 2
+        assert projected["list"] == [
+            project_weather(MOCK_GOOD_WEATHER),
+            project_weather(MOCK_BAD_WEATHER),
+        ]
+        assert project_list(None) is None
+
+    def test_stdlib_fallback(self):
+        """Test decoding works the same without orjson"""
+        body = json.dumps(MOCK_GOOD_WEATHER).encode()
+        with patch.object(decoding, "ORJSON_AVAILABLE", False):
+            assert loads(body) == MOCK_GOOD_WEATHER
+            with pytest.raises(ValueError):
+                loads(b"{not json")
+        assert decode(body, project_weather) == project_weather(MOCK_GOOD_WEATHER)
+
+    @patch("weather_api.requests.get")
+    def test_fetch_weather_projects_response(self, mock_get):
+        """Test fetches decode the body bytes and handle bad JSON"""
+        response = MagicMock(status_code=200)
+        response.content = json.dumps(MOCK_GOOD_WEATHER).encode()
+        mock_get.return_value = response
+
+        assert fetch_weather("Brisbane", "fake_api_key") == project_weather(
+            MOCK_GOOD_WEATHER
+        )
+
+        response.content = b"<html>Bad gateway</html>"
+        assert fetch_weather("Brisbane", "fake_api_key") is None
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,238 @@
+import pytest
+import asyncio
+import smtplib
+import socket
+import sys
+import os
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import delivery
+import message_sender
+from config import DEFAULT_CONFIG
+from delivery import AdaptiveLimit, CircuitBreaker, Outbox
+from metrics import metrics
+from tests.conftest import FakeClock
+
+
+EMAIL_CONFIG = {
+    "smtp_server": "smtp.example.com",
+    "smtp_port": 587,
+    "sender_email": "weather@example.com",
+    "receiver_email": ["a@example.com", "b@example.com"],
+    "password": "secret",
+    "timeout": 1,
+}
+
+SMS_CONFIG = {
+    "account_sid": "AC123",
+    "auth_token": "token",
+    "from_number": "+61400000000",
+    "to_numbers": [f"+6140000000{i}" for i in range(1, 7)],
+}
+
+
+@pytest.fixture
+def outbox():
+    """Reset every endpoint and keep deferred sends in memory"""
+    delivery.configure(dict(DEFAULT_CONFIG["delivery"], outbox=":memory:"))
+    yield delivery.open_outbox()
+    delivery.configure({})
+
+
+class TestCircuitBreaker:
+    """Tests for the circuit breaker"""
+
+    def test_opens_and_recovers(self):
+        """Test the breaker opens after repeated failures and probes later"""
+        clock = FakeClock()
+        breaker = CircuitBreaker("email.test", 2, reset_timeout=60, clock=clock)
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == delivery.OPEN
+        assert not breaker.allow()
+        assert metrics.snapshot()["gauges"]["sender.breaker.email.test.state"] == 2
+
+        clock.now = 60
+        assert breaker.state == delivery.HALF_OPEN
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == delivery.OPEN
+
+        clock.now = 120
+        breaker.record_success()
+        assert breaker.state == delivery.CLOSED
+        assert metrics.snapshot()["gauges"]["sender.breaker.email.test.state"] == 0
+
+    def test_half_open_lets_one_trial_through(self):
+        """Test callers wait for the half open trial call instead of joining it"""
+        clock = FakeClock()
+        breaker = CircuitBreaker("sms.test", 1, reset_timeout=60, clock=clock)
+
+        for outcome, allowed in (
+            (breaker.record_success, [True]),
+            (breaker.record_failure, [False]),
+        ):
+            breaker.record_failure()
+            clock.now += 60
+            assert breaker.allow()
+
+            results = []
+            waiter = threading.Thread(target=lambda: results.append(breaker.allow()))
+            waiter.start()
+            waiter.join(0.1)
+            assert waiter.is_alive()
+
+            outcome()
+            waiter.join(5)
+            assert results == allowed
+            breaker.record_success()
+
+
+class TestAdaptiveLimit:
+    """Tests for the AIMD concurrency limit"""
+
+    def test_additive_increase_multiplicative_decrease(self):
+        """Test fast sends grow the limit and slow or failed sends halve it"""
+        limit = AdaptiveLimit("sms.test", initial=4, maximum=8, latency_target=1.0)
+        for _ in range(5):
+            limit.record(0.1)
+        assert limit.size == 5
+
+        limit.record(2.0)
+        assert limit.size == 2
+        limit.record(0.1, ok=False)
+        limit.record(0.1, ok=False)
+        assert limit.size == 1
+
+        for _ in range(100):
+            limit.record(0.1)
+        assert limit.size == 8
+
+
+class TestOutbox:
+    """Tests for the durable retry outbox"""
+
+    def test_retry_backoff(self):
+        """Test entries come back with exponential backoff until settled"""
+        clock = FakeClock()
+        outbox = Outbox(":memory:", retry_seconds=60, max_attempts=3, clock=clock)
+        outbox.add("email", "Better here", "Brisbane vs Melbourne", ["a", "b"])
+        assert outbox.due() == []
+
+        clock.now = 60
+        (entry,) = outbox.due()
+        assert entry["recipients"] == ["a", "b"]
+        outbox.settle(entry, ["b"])
+        assert outbox.due(now=179) == []
+
+        (entry,) = outbox.due(now=180)
+        assert entry["recipients"] == ["b"] and entry["attempts"] == 1
+        outbox.settle(entry, [])
+        assert len(outbox) == 0
+
+    def test_gives_up(self):
+        """Test entries are dropped after max_attempts retries"""
+        outbox = Outbox(":memory:", retry_seconds=0, max_attempts=2)
+        outbox.add("sms", "Better here", "", ["+61400000001"])
+        for _ in range(2):
+            (entry,) = outbox.due()
+            outbox.settle(entry, entry["recipients"])
+        assert len(outbox) == 0
+
+
+class TestSenderBreakers:
+    """Tests for circuit breakers and the outbox in message_sender"""
+
+    @patch("message_sender.smtplib.SMTP")
+    def test_email_fails_fast(self, mock_smtp, outbox):
+        """Test a timing out SMTP server is skipped once its breaker opens"""
+        mock_smtp.side_effect = socket.timeout("timed out")
+        for _ in range(3):
+            assert not message_sender.send_email("Hi", "Subject", EMAIL_CONFIG)
+        assert mock_smtp.call_count == 3
+
+        assert not message_sender.send_email("Hi", "Subject", EMAIL_CONFIG)
+        assert mock_smtp.call_count == 3
+        assert len(outbox) == 4
+
+    @patch("message_sender.TwilioClient")
+    def test_sms_fails_fast(self, mock_client, outbox):
+        """Test the remaining recipients are deferred once the breaker opens"""
+        create = mock_client.return_value.messages.create
+        create.side_effect = Exception("timed out")
+
+        assert not message_sender.send_sms("Hi", SMS_CONFIG)
+
+        # Failures of the first round open the breaker before the second
+        assert create.call_count == 4
+        (entry,) = outbox.due(now=float("inf"))
+        assert entry["recipients"] == SMS_CONFIG["to_numbers"]
+        assert delivery.limit("sms", "twilio:+61400000000").size == 1
+
+    @patch("message_sender.TwilioClient")
+    def test_retry_deferred(self, mock_client, outbox):
+        """Test deferred sends are retried to the recipients that missed out"""
+        outbox.add("sms", "Better here", "", ["+61400000001"])
+        outbox.clock = lambda: 0.0
+        config = {key: dict(value) for key, value in DEFAULT_CONFIG.items()}
+        config["sms"].update(enabled=True, account_sid="AC123", auth_token="token")
+
+        assert message_sender.retry_deferred(config) == 0
+        outbox.db.execute("UPDATE outbox SET next_attempt = 0")
+        mock_client.return_value.messages.create.return_value = MagicMock(sid="SM1")
+        assert message_sender.retry_deferred(config) == 1
+
+        mock_client.return_value.messages.create.assert_called_once_with(
+            body="Better here", from_="+1234567890", to="+61400000001"
+        )
+        assert len(outbox) == 0
+
+    @patch("message_sender.smtplib.SMTP")
+    def test_email_bad_credentials_not_deferred(self, mock_smtp, outbox):
+        """Test rejected credentials count as a failure but aren't retried"""
+        server = mock_smtp.return_value
+        server.login.side_effect = smtplib.SMTPAuthenticationError(535, b"bad")
+        server.quit.side_effect = smtplib.SMTPServerDisconnected()
+
+        assert not message_sender.send_email("Hi", "Subject", EMAIL_CONFIG)
+        assert len(outbox) == 0
+        assert delivery.breaker("email", "smtp.example.com:587").failures == 1
+
+    @patch("message_sender.AsyncTwilioHttpClient")
+    @patch("message_sender.TwilioClient")
+    def test_sms_async_defers_only_failed(self, mock_client, mock_http, outbox):
+        """Test recipients already sent to aren't deferred with the failed ones"""
+        mock_http.return_value.close = AsyncMock()
+
+        async def create_async(body, from_, to):
+            if to == SMS_CONFIG["to_numbers"][1]:
+                raise Exception("invalid number")
+            return MagicMock(sid="SM1")
+
+        mock_client.return_value.messages.create_async = create_async
+
+        assert not asyncio.run(message_sender.send_sms_async("Hi", SMS_CONFIG))
+        (entry,) = outbox.due(now=float("inf"))
+        assert entry["recipients"] == [SMS_CONFIG["to_numbers"][1]]
+
+    def test_outbox_opened_lazily(self, tmp_path):
+        """Test runs that defer nothing don't create the outbox database"""
+        path = tmp_path / "outbox.db"
+        delivery.configure(dict(DEFAULT_CONFIG["delivery"], outbox=str(path)))
+        config = {key: dict(value) for key, value in DEFAULT_CONFIG.items()}
+
+        assert message_sender.retry_deferred(config) == 0
+        assert not path.exists()
+
+        delivery.defer("sms", "Better here", "", ["+61400000001"])
+        assert path.exists()
+        assert len(delivery.open_outbox(create=False)) == 1
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
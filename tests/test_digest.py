@@ -0,0 +1,93 @@
+import pytest
+import sys
+import os
+from unittest.mock import patch
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from config import DEFAULT_CONFIG
+from digest import ALL_RECIPIENTS, DigestQueue, construct_digest, digest_queue
+from message_constructor import construct_message
+from weather_api import MOCK_BAD_WEATHER, MOCK_GOOD_WEATHER
+from tests.conftest import FakeClock
+
+
+def make_config(**notifications):
+    """Build a configuration with the given [notifications] settings"""
+    config = {key: dict(value) for key, value in DEFAULT_CONFIG.items()}
+    config["notifications"].update(notifications)
+    return config
+
+
+class TestDigest:
+    """Tests for the digest module"""
+
+    def test_window(self):
+        """Test batches are released once their window has closed"""
+        clock = FakeClock()
+        queue = DigestQueue(window=600, clock=clock)
+        queue.add("a@example.com", "one", "One")
+        clock.now = 300
+        queue.add("a@example.com", "two", "Two")
+        queue.add("b@example.com", "three", "Three")
+
+        assert len(queue) == 3
+        clock.now = 600
+        assert queue.due() == [("a@example.com", [("one", "One"), ("two", "Two")])]
+        assert queue.due(force=True) == [("b@example.com", [("three", "Three")])]
+        assert len(queue) == 0
+
+    def test_construct_digest(self):
+        """Test sections are combined with one signature"""
+        sections = [
+            construct_message(
+                MOCK_GOOD_WEATHER,
+                MOCK_BAD_WEATHER,
+                "Brisbane",
+                their_city,
+                signature="WeatherMark",
+            )
+            for their_city in ("Melbourne", "Hobart")
+        ]
+        message, subject = construct_digest(sections, "WeatherMark")
+
+        assert subject == "Weather digest: 2 wins"
+        assert message.count("-- WeatherMark") == 1
+        assert message.endswith("-- WeatherMark")
+        assert "Melbourne" in message and "Hobart" in message
+        for _, section_subject in sections:
+            assert f"== {section_subject} ==" in message
+
+        assert construct_digest(sections[:1], "WeatherMark") == sections[0]
+
+    def test_digest_queue_policy(self):
+        """Test the queue only exists when digests are enabled"""
+        assert digest_queue(make_config()) is None
+
+        config = make_config(digest=True, digest_window_minutes=5)
+        queue = digest_queue(config)
+        assert queue.window == 300
+        assert digest_queue(config) is queue
+
+    @patch("main.deliver")
+    def test_notify_sends_one_digest(self, mock_deliver):
+        """Test notifications are delivered together as one message"""
+        config = make_config(digest=True)
+        main.notify("Better in Brisbane", "Brisbane vs Melbourne", config)
+        main.notify("Better in Brisbane again", "Brisbane vs Hobart", config)
+        mock_deliver.assert_not_called()
+
+        main.send_digests(config, force=True)
+
+        mock_deliver.assert_called_once()
+        message, subject, _ = mock_deliver.call_args[0]
+        assert subject == "Weather digest: 2 wins"
+        assert "Brisbane vs Hobart" in message
+        assert len(digest_queue(config)) == 0
+        assert ALL_RECIPIENTS not in digest_queue(config).batches
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,215 @@
+import pytest
+import sys
+import os
+import argparse
+import copy
+import time
+from unittest.mock import patch
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from config import DEFAULT_CONFIG
+from forecast import (
+    SLOT_SECONDS,
+    advantage_windows,
+    carried_over,
+    due_notifications,
+    get_forecast,
+    load_schedule,
+    next_send_at,
+    project_slot,
+    save_schedule,
+    schedule_notifications,
+)
+
+
+def make_slot(dt, main, temp, condition_id=800):
+    """Build a minimal forecast slot"""
+    return {
+        "dt": dt,
+        "weather": [{"id": condition_id, "main": main, "description": main.lower()}],
+        "main": {"temp": temp, "feels_like": temp, "humidity": 50},
+        "wind": {"speed": 3.0},
+    }
+
+
+def series(*slots, start=0):
+    """Build consecutive forecast slots from (main, temp) tuples"""
+    return [
+        make_slot(start + i * SLOT_SECONDS, main, temp)
+        for i, (main, temp) in enumerate(slots)
+    ]
+
+
+class TestForecast:
+    """Tests for the forecast module"""
+
+    def test_project_slot(self):
+        """Test that forecast slots keep only the fields we use"""
+        slot = make_slot(100, "Clear", 22.0)
+        slot["clouds"] = {"all": 0}
+        slot["sys"] = {"pod": "d"}
+        projected = project_slot(slot)
+        assert set(projected) == {"dt", "weather", "main", "wind"}
+        assert projected["main"]["temp"] == 22.0
+
+    def test_advantage_windows_merge_slots(self):
+        """Test that consecutive slots with the same reason form one window"""
+        ours = series(("Clear", 22), ("Clear", 22), ("Clear", 22), ("Clear", 22))
+        theirs = series(("Rain", 22), ("Rain", 22), ("Clear", 10), ("Rain", 10))
+        windows = advantage_windows(ours, theirs, 18, 26)
+        assert [(w["start"], w["end"], w["reason"]) for w in windows] == [
+            (0, 2 * SLOT_SECONDS, "weather"),
+            (2 * SLOT_SECONDS, 3 * SLOT_SECONDS, "temperature"),
+            (3 * SLOT_SECONDS, 4 * SLOT_SECONDS, "both"),
+        ]
+        assert windows[1]["our_slot"] == 2
+
+    def test_advantage_windows_align_slots(self):
+        """Test that only slots present in both forecasts are compared"""
+        ours = series(("Clear", 22), ("Clear", 22), ("Clear", 22))
+        theirs = series(("Rain", 22), ("Rain", 22), start=SLOT_SECONDS)
+        windows = advantage_windows(ours, theirs, 18, 26)
+        assert len(windows) == 1
+        assert windows[0]["start"] == SLOT_SECONDS
+        assert windows[0]["our_slot"] == 1
+        assert windows[0]["their_slot"] == 0
+
+        assert advantage_windows(ours, [], 18, 26) == []
+
+    def test_due_notifications(self):
+        """Test that notifications are due from send_at until the window ends"""
+        windows = [{"start": 1000, "end": 2000, "reason": "weather"}]
+        schedule = schedule_notifications(windows, lead_time=300)
+        assert schedule[0]["send_at"] == 700
+        assert due_notifications(schedule, 600) == []
+        assert due_notifications(schedule, 700) == schedule
+        assert due_notifications(schedule, 2000) == []
+
+    def test_schedule_persisted(self, tmp_path):
+        """Test the schedule is saved and gives the next time to wake up"""
+        windows = [
+            {"start": 1000, "end": 2000, "reason": "weather"},
+            {"start": 5000, "end": 6000, "reason": "both"},
+        ]
+        schedule = schedule_notifications(windows, lead_time=300)
+        assert next_send_at(schedule, 0) == 700
+        assert next_send_at(schedule, 700) == 4700
+        assert next_send_at(schedule, 4700) is None
+
+        assert load_schedule(str(tmp_path)) == []
+        save_schedule(str(tmp_path), schedule)
+        assert load_schedule(str(tmp_path)) == schedule
+
+    def test_get_forecast_cached(self, tmp_path):
+        """Test that a forecast is fetched at most once per max_age"""
+        data = {"list": series(("Clear", 22), ("Rain", 12))}
+        with patch("forecast.fetch_json", return_value=data) as mock_fetch:
+            slots = get_forecast("Brisbane", "key", str(tmp_path), 3600, now=0)
+            assert len(slots) == 2
+            assert get_forecast("Brisbane", "key", str(tmp_path), 3600, now=1800) == (
+                slots
+            )
+            assert mock_fetch.call_count == 1
+
+            get_forecast("Brisbane", "key", str(tmp_path), 3600, now=3600)
+            assert mock_fetch.call_count == 2
+
+    def test_get_forecast_outdated_cache_fallback(self, tmp_path):
+        """Test that an outdated forecast is used if refreshing fails"""
+        data = {"list": series(("Clear", 22))}
+        with patch("forecast.fetch_json", return_value=data):
+            slots = get_forecast("Brisbane", "key", str(tmp_path), 60, now=0)
+        with patch("forecast.fetch_json", return_value=None):
+            assert get_forecast("Brisbane", "key", str(tmp_path), 60, now=600) == slots
+            assert get_forecast("Sydney", "key", str(tmp_path), 60, now=600) is None
+
+    @patch("main.notify")
+    def test_run_forecast_saves_schedule(self, mock_notify, tmp_path):
+        """Test a forecast run persists the schedule of every pair"""
+        config = copy.deepcopy(DEFAULT_CONFIG)
+        config["forecast"]["cache_dir"] = str(tmp_path)
+        pairs = [("Brisbane", "Melbourne")]
+
+        schedule = main.run_forecast(
+            pairs, ["Brisbane", "Melbourne"], None, config, "both"
+        )
+
+        assert load_schedule(str(tmp_path)) == schedule
+        assert [(n["our_city"], n["their_city"]) for n in schedule] == pairs
+        mock_notify.assert_called_once()
+
+    def test_carried_over(self):
+        """Test saved windows missing from the new forecast are kept until they end"""
+        previous = [
+            {"start": 0, "end": 1000},
+            {"start": 500, "end": 2000},
+            {"start": 3000, "end": 4000},
+        ]
+        schedule = [{"start": 3000, "end": 4000}]
+        assert carried_over(previous, schedule, 1500) == [previous[1]]
+
+    @patch("main.notify")
+    def test_cron_run_sends_window_started_since_last_run(self, mock_notify, tmp_path):
+        """Test a window that began between two runs is sent once"""
+        config = copy.deepcopy(DEFAULT_CONFIG)
+        config["forecast"]["cache_dir"] = str(tmp_path)
+        config["notifications"]["state_file"] = str(tmp_path / "state.json")
+        pairs = [("Brisbane", "Melbourne")]
+        state = {}
+
+        def run_at(now, forecasts):
+            with patch("main.time.time", return_value=now), patch(
+                "main.get_forecast", side_effect=lambda city, *args: forecasts[city]
+            ):
+                return main.run_forecast(
+                    pairs, ["Brisbane", "Melbourne"], "key", config, None, state
+                )
+
+        # The window starts after the first run...
+        start = SLOT_SECONDS
+        run_at(
+            0,
+            {
+                "Brisbane": series(("Clear", 22), ("Clear", 22), start=start),
+                "Melbourne": series(("Rain", 22), ("Rain", 22), start=start),
+            },
+        )
+        mock_notify.assert_not_called()
+
+        # ...and the refreshed forecast of the next run starts after it began
+        later = {
+            "Brisbane": series(("Clear", 22), start=2 * start),
+            "Melbourne": series(("Rain", 22), start=2 * start),
+        }
+        run_at(start + 60, later)
+        mock_notify.assert_called_once()
+
+        run_at(start + 120, later)
+        mock_notify.assert_called_once()
+
+    def test_loop_wakes_for_scheduled_notification(self, tmp_path):
+        """Test --interval sleeps only until the next scheduled notification"""
+        config = copy.deepcopy(DEFAULT_CONFIG)
+        config["forecast"]["cache_dir"] = str(tmp_path)
+        args = argparse.Namespace(
+            adaptive=False, region=None, forecast=True, use_async=False, interval=3600
+        )
+        schedule = [{"send_at": time.time() + 100, "start": 0, "end": 0}]
+        delays = []
+
+        def sleep(delay):
+            delays.append(delay)
+            raise KeyboardInterrupt
+
+        with patch("main.run_forecast", return_value=schedule), patch(
+            "main.time.sleep", sleep
+        ), pytest.raises(KeyboardInterrupt):
+            main.run_loop(args, [], [], None, config, "both", None)
+        assert 90 < delays[0] <= 100
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
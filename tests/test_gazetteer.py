@@ -0,0 +1,94 @@
+import pytest
+import sys
+import os
+import random
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gazetteer import (
+    Gazetteer,
+    KDTree,
+    chord_to_km,
+    km_to_chord,
+    load_gazetteer,
+    to_xyz,
+)
+
+
+class TestGazetteer:
+    """Tests for the gazetteer module"""
+
+    def test_lookup(self):
+        """Test that cities are found by name regardless of case"""
+        gazetteer = load_gazetteer()
+        entry = gazetteer.lookup(" brisbane ")
+        assert entry["id"] == 2174003
+        assert entry["country"] == "AU"
+        assert gazetteer.lookup("Brisbane", "au") is entry
+        assert gazetteer.lookup("Brisbane", "NZ") is None
+        assert gazetteer.lookup("Atlantis") is None
+
+    def test_nearest(self):
+        """Test nearest city lookups by coordinate"""
+        gazetteer = load_gazetteer()
+        # Brisbane CBD to the airport
+        distance, entry = gazetteer.nearest(-27.38, 153.12)[0]
+        assert entry["name"] == "Brisbane"
+        assert 10 < distance < 15
+
+        names = [entry["name"] for _, entry in gazetteer.nearest(-27.47, 153.03, 3)]
+        assert names == ["Brisbane", "Ipswich", "Gold Coast"]
+
+    def test_cities_within(self):
+        """Test the cities within a radius of a city"""
+        gazetteer = load_gazetteer()
+        nearby = gazetteer.cities_within("Brisbane", 100)
+        assert nearby[0] == "Ipswich"
+        assert set(nearby) == {"Ipswich", "Gold Coast", "Sunshine Coast"}
+        assert gazetteer.cities_within("Atlantis", 100) == []
+
+    def test_distance_conversion(self):
+        """Test conversions between km and chord distance"""
+        assert chord_to_km(km_to_chord(1234.5)) == pytest.approx(1234.5)
+        # Sydney to Melbourne is about 714 km
+        chord = (
+            sum(
+                (a - b) ** 2
+                for a, b in zip(to_xyz(-33.8679, 151.2073), to_xyz(-37.8140, 144.9633))
+            )
+            ** 0.5
+        )
+        assert chord_to_km(chord) == pytest.approx(714, abs=5)
+
+    def test_kdtree_matches_brute_force(self):
+        """Test the tree against a linear scan over random points"""
+        rng = random.Random(7)
+        points = [
+            (to_xyz(rng.uniform(-90, 90), rng.uniform(-180, 180)), i)
+            for i in range(500)
+        ]
+        tree = KDTree(points)
+
+        for _ in range(20):
+            query = to_xyz(rng.uniform(-90, 90), rng.uniform(-180, 180))
+            by_distance = sorted(
+                (sum((a - b) ** 2 for a, b in zip(xyz, query)) ** 0.5, i)
+                for xyz, i in points
+            )
+            assert [i for _, i in tree.nearest(query, 5)] == [
+                i for _, i in by_distance[:5]
+            ]
+            assert [i for _, i in tree.within(query, 0.3)] == [
+                i for distance, i in by_distance if distance <= 0.3
+            ]
+
+    def test_empty(self):
+        """Test that an empty gazetteer finds nothing"""
+        gazetteer = Gazetteer([])
+        assert gazetteer.nearest(0, 0) == []
+        assert gazetteer.within(0, 0, 1000) == []
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
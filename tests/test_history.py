@@ -0,0 +1,127 @@
+import pytest
+import sys
+import os
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import (
+    REASON_BOTH,
+    REASON_NONE,
+    REASON_TEMPERATURE,
+    REASON_WEATHER,
+    advantage_codes,
+    load_history,
+    query,
+    record_observation,
+    run_lengths,
+    streaks,
+    temperature_percentiles,
+    time_window,
+    win_rate,
+)
+from weather_api import is_temperature_comfortable
+from tests.conftest import CLOUDY_HOT, RAINY_COLD, RAINY_MILD, SUNNY, make_weather
+
+
+class TestHistory:
+    """Tests for the history module"""
+
+    def test_record_and_load(self, history_dir):
+        """Test that recorded observations can be memory-mapped back"""
+        assert record_observation("Brisbane", SUNNY, history_dir, ts=100)
+        assert record_observation("Brisbane", CLOUDY_HOT, history_dir, ts=200)
+
+        records = load_history("Brisbane", history_dir)
+        assert isinstance(records, np.memmap)
+        assert list(records["ts"]) == [100, 200]
+        assert list(records["condition_id"]) == [800, 804]
+        assert records["temp"][0] == 23.5
+
+    def test_record_nothing(self, history_dir):
+        """Test that missing weather data is not recorded"""
+        assert not record_observation("Brisbane", None, history_dir)
+        assert len(load_history("Brisbane", history_dir)) == 0
+
+    def test_query_time_window(self, history_dir):
+        """Test range scans return views of the requested window"""
+        for ts in range(0, 100, 10):
+            record_observation("Sydney", SUNNY, history_dir, ts=ts)
+
+        window = query("Sydney", history_dir, start=20, end=50)
+        assert list(window["ts"]) == [20, 30, 40]
+
+        records = load_history("Sydney", history_dir)
+        assert np.shares_memory(time_window(records, 20, 50), records)
+
+    def test_advantage_codes_match_predicates(self, history_dir):
+        """Test vectorized reasons agree with the weather_api rules"""
+        observations = [
+            (SUNNY, RAINY_COLD, REASON_BOTH),
+            (SUNNY, RAINY_MILD, REASON_WEATHER),
+            (SUNNY, CLOUDY_HOT, REASON_TEMPERATURE),
+            (CLOUDY_HOT, RAINY_COLD, REASON_NONE),
+        ]
+        for ts, (ours, theirs, _) in enumerate(observations):
+            record_observation("Brisbane", ours, history_dir, ts=ts)
+            record_observation("Melbourne", theirs, history_dir, ts=ts)
+
+        codes = advantage_codes(
+            load_history("Brisbane", history_dir),
+            load_history("Melbourne", history_dir),
+            18,
+            26,
+        )
+        assert list(codes) == [expected for _, _, expected in observations]
+
+        # Comfort uses the same inclusive range as is_temperature_comfortable
+        assert is_temperature_comfortable(SUNNY, 18, 26)
+        assert not is_temperature_comfortable(CLOUDY_HOT, 18, 26)
+
+    def test_win_rate_aligns_runs(self, history_dir):
+        """Test win rate only counts runs where both cities were recorded"""
+        record_observation("Brisbane", SUNNY, history_dir, ts=1)
+        record_observation("Brisbane", SUNNY, history_dir, ts=2)
+        record_observation("Brisbane", SUNNY, history_dir, ts=3)
+        record_observation("Melbourne", RAINY_COLD, history_dir, ts=1)
+        record_observation("Melbourne", SUNNY, history_dir, ts=3)
+
+        result = win_rate("Brisbane", "Melbourne", history_dir, 18, 26)
+        assert result["samples"] == 2
+        assert result["wins"] == 1
+        assert result["both"] == 1
+        assert result["win_rate"] == 0.5
+
+    def test_win_rate_no_history(self, history_dir):
+        """Test win rate with no stored observations"""
+        result = win_rate("Brisbane", "Melbourne", history_dir, 18, 26)
+        assert result["samples"] == 0
+        assert result["win_rate"] == 0.0
+
+    def test_streaks(self, history_dir):
+        """Test longest and current winning streaks"""
+        theirs = [RAINY_COLD, RAINY_COLD, SUNNY, RAINY_COLD, RAINY_COLD, RAINY_COLD]
+        for ts, weather in enumerate(theirs):
+            record_observation("Brisbane", SUNNY, history_dir, ts=ts)
+            record_observation("Melbourne", weather, history_dir, ts=ts)
+
+        result = streaks("Brisbane", "Melbourne", history_dir, 18, 26)
+        assert result == {"longest": 3, "current": 3, "count": 2}
+        assert list(run_lengths([True, False, True, True])) == [1, 2]
+
+    def test_temperature_percentiles(self, history_dir):
+        """Test temperature percentiles over a window"""
+        for ts, temp in enumerate([10.0, 20.0, 30.0]):
+            record_observation(
+                "Perth", make_weather("Clear", "clear sky", temp), history_dir, ts=ts
+            )
+
+        result = temperature_percentiles("Perth", history_dir, (0, 50, 100))
+        assert result == {0: 10.0, 50: 20.0, 100: 30.0}
+        assert temperature_percentiles("Darwin", history_dir) == {
+            10: None,
+            50: None,
+            90: None,
+        }
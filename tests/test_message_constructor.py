@@ -2,12 +2,15 @@ import pytest
 import sys
 import os
 import re
+import random
 
 # Add parent directory to path to import modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from message_constructor import (
+    MessageCache,
     construct_message,
+    message_cache,
     get_temperature_condition,
     GREETINGS,
     WEATHER_STATEMENTS,
@@ -120,6 +123,26 @@ class TestMessageConstructor:
             formatted = statement.format(our_city="Brisbane", their_city="Melbourne")
             assert formatted not in message
 
+    def test_construct_message_their_limits(self):
+        """Test their temperature is described with their own comfort profile"""
+        for seed in range(20):
+            message, _ = construct_message(
+                SAMPLE_OUR_CITY_DATA,
+                SAMPLE_THEIR_CITY_DATA,
+                "Brisbane",
+                "Melbourne",
+                18,
+                26,
+                "temperature",
+                "Test Signature",
+                rng=random.Random(seed),
+                their_limits=(10, 16),
+            )
+            # 12.5°C is comfortable in Melbourne's profile, so never "cold"
+            for statement in TEMPERATURE_STATEMENTS[:12]:
+                assert statement.format(their_city="Melbourne") not in message
+            assert "13°C ❄️" not in message
+
     def test_construct_message_both_reasons(self):
         """Test message construction with both reasons"""
         message, subject = construct_message(
@@ -191,3 +214,69 @@ class TestMessageConstructor:
             subj.format(our_city="Brisbane", their_city="Melbourne") == subject
             for subj in SUBJECT_LINES
         )
+
+    def test_construct_message_seeded_rng(self):
+        """Test a seeded RNG makes message selection reproducible"""
+        args = (
+            SAMPLE_OUR_CITY_DATA,
+            SAMPLE_THEIR_CITY_DATA,
+            "Brisbane",
+            "Melbourne",
+            18,
+            26,
+            "both",
+            "Test Signature",
+        )
+        first = construct_message(*args, rng=random.Random(7))
+        second = construct_message(*args, rng=random.Random(7))
+
+        assert first == second
+
+    def test_render_cache_reuses_identical_comparisons(self):
+        """Test identical comparisons render once and reuse the result"""
+        cache = MessageCache()
+        rng = random.Random(3)
+        args = (
+            SAMPLE_OUR_CITY_DATA,
+            SAMPLE_THEIR_CITY_DATA,
+            "Brisbane",
+            "Melbourne",
+            18,
+            26,
+            "both",
+            "Test Signature",
+        )
+        first = construct_message(*args, rng=rng, cache=cache)
+        state = rng.getstate()
+
+        # Temperatures that round the same give the same key
+        warmer = {"weather": SAMPLE_OUR_CITY_DATA["weather"], "main": {"temp": 23.6}}
+        second = construct_message(warmer, *args[1:], rng=rng, cache=cache)
+
+        assert second == first
+        assert rng.getstate() == state
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        construct_message(*args[:2], "Sydney", *args[3:], rng=rng, cache=cache)
+        assert cache.misses == 2
+
+    def test_render_cache_evicts_least_recently_used(self):
+        """Test the cache keeps only maxsize entries"""
+        cache = MessageCache(maxsize=2)
+        cache.put("a", ("a", "A"))
+        cache.put("b", ("b", "B"))
+        assert cache.get("a") == ("a", "A")
+        cache.put("c", ("c", "C"))
+
+        assert len(cache) == 2
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+
+    def test_message_cache_policy(self):
+        """Test the render cache is only used when reuse is configured"""
+        assert message_cache({"message": {"signature": "x"}}) is None
+
+        config = {"message": {"reuse_rendered": True, "render_cache_size": 8}}
+        cache = message_cache(config)
+        assert cache.maxsize == 8
+        assert message_cache(config) is cache
@@ -0,0 +1,84 @@
+import pytest
+import itertools
+import random
+import sys
+import os
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_constructor import construct_message, get_weather_emoji
+from message_sender import send_email
+from tests.smtp_server import loopback_smtp_server
+from weather_api import MOCK_BAD_WEATHER, MOCK_GOOD_WEATHER, get_weather
+
+# Only run with --perf (see conftest.py and perf_budgets.toml)
+pytestmark = pytest.mark.perf
+
+
+# Descriptions cycled through by the emoji benchmark, one per branch
+DESCRIPTIONS = [
+    "clear sky",
+    "few clouds",
+    "scattered clouds",
+    "overcast clouds",
+    "light rain",
+    "heavy intensity rain",
+    "moderate rain",
+    "thunderstorm",
+    "light snow",
+    "mist",
+    "squalls",
+]
+
+
+class TestPerf:
+    """Benchmarks of the hot paths"""
+
+    def test_get_weather_mock(self, benchmark):
+        """Benchmark the mock path of get_weather"""
+        benchmark("get_weather_mock", lambda: get_weather("Melbourne", None, "both"))
+
+    def test_construct_message(self, benchmark):
+        """Benchmark rendering a message"""
+        rng = random.Random(0)
+        benchmark(
+            "construct_message",
+            lambda: construct_message(
+                MOCK_GOOD_WEATHER,
+                MOCK_BAD_WEATHER,
+                "Brisbane",
+                "Melbourne",
+                reason="both",
+                rng=rng,
+            ),
+        )
+
+    def test_get_weather_emoji(self, benchmark):
+        """Benchmark picking the emoji of a description (without the cache)"""
+        descriptions = itertools.cycle(DESCRIPTIONS)
+        lookup = get_weather_emoji.__wrapped__
+        benchmark("get_weather_emoji", lambda: lookup(next(descriptions)))
+
+    def test_send_email_stub(self, benchmark):
+        """Benchmark send_email against an SMTP server on a loopback port"""
+        server = loopback_smtp_server()
+        if server is None:
+            pytest.skip("openssl is needed for the SMTP server's certificate")
+        with server:
+            config = {
+                "smtp_server": "127.0.0.1",
+                "smtp_port": server.port,
+                "sender_email": "weather@example.com",
+                "receiver_email": ["a@example.com", "b@example.com"],
+                "password": "secret",
+            }
+            result = benchmark(
+                "send_email_stub",
+                lambda: send_email("Better in Brisbane", "Brisbane wins", config),
+            )
+        assert server.messages >= 2 * result["number"]
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__, "--perf"])
@@ -0,0 +1,148 @@
+import pytest
+import sys
+import os
+import asyncio
+import copy
+from unittest.mock import patch, AsyncMock
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calendar_cache import calendar_win_rate
+from config import DEFAULT_CONFIG
+from history import load_history
+from message_sender import send_message_async
+from pipeline import main_async
+from weather_api import MOCK_BAD_WEATHER, MOCK_GOOD_WEATHER, WeatherCache
+
+
+@pytest.fixture
+def config():
+    """Default configuration with email enabled"""
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["email"].update({"enabled": True, "password": "secret"})
+    return config
+
+
+class TestPipeline:
+    """Tests for the asyncio pipeline"""
+
+    @patch("pipeline.send_message_async", new_callable=AsyncMock)
+    def test_pipeline_mock_data(self, mock_send, config):
+        """Test every pair flows through compare, render and send"""
+        mock_send.return_value = {"email": True}
+        pairs = [("Brisbane", "Melbourne"), ("Brisbane", "Sydney")]
+        cities = ["Brisbane", "Melbourne", "Sydney"]
+
+        results = asyncio.run(main_async(pairs, cities, None, config, "weather"))
+
+        assert results == {
+            ("Brisbane", "Melbourne"): "weather",
+            ("Brisbane", "Sydney"): "weather",
+        }
+        assert mock_send.await_count == 2
+        message, sender_config = mock_send.await_args[0]
+        assert "Brisbane" in message
+        assert sender_config["send_email"]
+        assert sender_config["email_config"]["receiver_email"] == [
+            "recipient@example.com"
+        ]
+
+    @patch("pipeline.send_message_async", new_callable=AsyncMock)
+    def test_pipeline_backpressure(self, mock_send, config):
+        """Test the pipeline completes with single-slot queues"""
+        mock_send.return_value = {"email": True}
+        config["pipeline"].update({"queue_size": 1, "send_workers": 1})
+        pairs = [
+            ("Brisbane", city) for city in ["Melbourne", "Sydney", "Perth", "Hobart"]
+        ]
+        cities = ["Brisbane", "Melbourne", "Sydney", "Perth", "Hobart"]
+
+        results = asyncio.run(main_async(pairs, cities, None, config, "both"))
+
+        assert len(results) == 4
+        assert mock_send.await_count == 4
+
+    @patch("pipeline.send_message_async", new_callable=AsyncMock)
+    def test_pipeline_skips_unchanged(self, mock_send, config, tmp_path):
+        """Test change detection state is honoured by the pipeline"""
+        mock_send.return_value = {"email": True}
+        config["notifications"]["state_file"] = str(tmp_path / "state.json")
+        state = {}
+        pairs = [("Brisbane", "Melbourne")]
+        cities = ["Brisbane", "Melbourne"]
+
+        asyncio.run(main_async(pairs, cities, None, config, "weather", state))
+        results = asyncio.run(main_async(pairs, cities, None, config, "weather", state))
+
+        assert results == {}
+        assert mock_send.await_count == 1
+
+    @patch("pipeline.send_message_async", new_callable=AsyncMock)
+    @patch("weather_api.fetch_weather_async", new_callable=AsyncMock)
+    def test_pipeline_uses_cache_and_records_history(
+        self, mock_fetch, mock_send, config, tmp_path
+    ):
+        """Test cached cities aren't refetched and history is recorded"""
+        mock_fetch.return_value = MOCK_BAD_WEATHER
+        mock_send.return_value = {"email": True}
+        config["history"].update(enabled=True, directory=str(tmp_path))
+        cache = WeatherCache(max_age=600)
+        cache.put("Brisbane", MOCK_GOOD_WEATHER)
+        pairs = [("Brisbane", "Melbourne")]
+
+        with patch("weather_api.weather_cache", cache):
+            results = asyncio.run(
+                main_async(pairs, ["Brisbane", "Melbourne"], "key", config)
+            )
+            assert [call.args[1] for call in mock_fetch.await_args_list] == [
+                "Melbourne"
+            ]
+            assert cache.peek("Melbourne") == MOCK_BAD_WEATHER
+
+            asyncio.run(main_async(pairs, ["Brisbane", "Melbourne"], "key", config))
+            assert mock_fetch.await_count == 1
+
+        assert results == {("Brisbane", "Melbourne"): "both"}
+        assert len(load_history("Brisbane", str(tmp_path))) == 2
+        assert len(load_history("Melbourne", str(tmp_path))) == 2
+        # The async runs fill the advantage calendar like the sync ones
+        assert calendar_win_rate("Brisbane", "Melbourne", str(tmp_path))["both"] == 1
+
+    @patch("pipeline.send_message_async", new_callable=AsyncMock)
+    @patch("weather_api.fetch_weather")
+    @patch("weather_api.fetch_weather_async", new_callable=AsyncMock)
+    def test_failed_fetch_not_repeated(
+        self, mock_fetch, mock_sync_fetch, mock_send, config
+    ):
+        """Test a city the async fetch failed for isn't requested again"""
+        mock_fetch.return_value = None
+        pairs = [("Brisbane", "Melbourne")]
+
+        with patch("weather_api.weather_cache", WeatherCache(max_age=600)):
+            results = asyncio.run(
+                main_async(pairs, ["Brisbane", "Melbourne"], "key", config)
+            )
+
+        assert mock_fetch.await_count == 2
+        mock_sync_fetch.assert_not_called()
+        assert results == {("Brisbane", "Melbourne"): None}
+
+    @patch("message_sender.send_email")
+    def test_send_message_async(self, mock_send_email):
+        """Test async sending runs the email sender in an executor"""
+        mock_send_email.return_value = True
+        results = asyncio.run(
+            send_message_async(
+                "Hello",
+                {"send_email": True, "email_config": {}, "subject": "Hi"},
+            )
+        )
+
+        assert results == {"email": True}
+        mock_send_email.assert_called_once_with("Hello", "Hi", {})
+
+    def test_send_message_async_missing_config(self):
+        """Test channels without config are reported as failed"""
+        results = asyncio.run(send_message_async("Hello", {"send_sms": True}))
+        assert results == {"sms": False}
@@ -0,0 +1,119 @@
+import pytest
+import sys
+import os
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from polling import PollScheduler, cache_limits
+from weather_api import WeatherCache
+
+
+def make_weather(dt, temp, condition_id=800):
+    """Build minimal weather data reported at dt"""
+    return {
+        "dt": dt,
+        "weather": [{"id": condition_id, "main": "Clear", "description": "clear"}],
+        "main": {"temp": temp},
+    }
+
+
+def settle(scheduler, city, temps, start=0, cadence=600, condition_id=800):
+    """Feed a city a series of reports cadence seconds apart"""
+    for i, temp in enumerate(temps):
+        scheduler.observe(city, make_weather(start + i * cadence, temp, condition_id))
+    return start + (len(temps) - 1) * cadence
+
+
+class TestPollScheduler:
+    """Tests for the polling module"""
+
+    def test_learns_cadence(self):
+        """Test the reporting cadence is learned from dt"""
+        scheduler = PollScheduler(default_cadence=600)
+        settle(scheduler, "Brisbane", [22] * 10, cadence=1200)
+
+        assert scheduler.state("Brisbane")["cadence"] == pytest.approx(1200, rel=0.05)
+
+    def test_volatility_tracks_changes(self):
+        """Test condition changes raise volatility and calm reports lower it"""
+        scheduler = PollScheduler()
+        settle(scheduler, "Calm", [22] * 10)
+        last = settle(scheduler, "Stormy", [22] * 5)
+        for i, condition_id in enumerate((500, 800, 500, 800)):
+            scheduler.observe(
+                "Stormy", make_weather(last + (i + 1) * 600, 22, condition_id)
+            )
+
+        assert scheduler.state("Calm")["volatility"] < 0.1
+        assert scheduler.state("Stormy")["volatility"] > 0.5
+
+    def test_polls_close_pairs_sooner(self):
+        """Test pairs near a comfort boundary are polled right after a report"""
+        scheduler = PollScheduler(min_interval=60, max_interval=7200, grace=30)
+        last = settle(scheduler, "Brisbane", [22] * 10)
+        settle(scheduler, "Melbourne", [10] * 10)
+        settle(scheduler, "Sydney", [22] * 10)
+        settle(scheduler, "Adelaide", [25.9] * 10)
+        pairs = [("Brisbane", "Melbourne"), ("Sydney", "Adelaide")]
+
+        polls = scheduler.schedule(pairs, ["Brisbane", "Melbourne", "Sydney"], last)
+
+        # Adelaide sits on the 26 degree boundary, so its pair is urgent
+        assert polls["Sydney"] == last + 600 + 30
+        assert polls["Brisbane"] > polls["Sydney"]
+
+    def test_backs_off_without_new_reports(self):
+        """Test polls back off while dt doesn't move on"""
+        scheduler = PollScheduler(min_interval=60, max_interval=600)
+        last = settle(scheduler, "Brisbane", [22, 22])
+        pairs = [("Brisbane", "Brisbane")]
+
+        gaps = []
+        now = last
+        for _ in range(6):
+            scheduler.observe("Brisbane", make_weather(last, 22))
+            next_poll = scheduler.schedule(pairs, ["Brisbane"], now)["Brisbane"]
+            gaps.append(next_poll - now)
+            now = next_poll
+
+        assert gaps == [60, 120, 240, 480, 600, 600]
+
+    def test_due_pairs(self):
+        """Test only pairs with a due city are run"""
+        scheduler = PollScheduler()
+        pairs = [("Brisbane", "Melbourne"), ("Sydney", "Perth")]
+        assert scheduler.due(pairs, now=0) == (pairs, [c for p in pairs for c in p])
+
+        for city in ("Brisbane", "Melbourne", "Sydney"):
+            scheduler.state(city)["next_poll"] = 100
+        scheduler.state("Perth")["next_poll"] = 50
+
+        assert scheduler.due(pairs, now=60) == ([("Sydney", "Perth")], ["Perth"])
+        assert scheduler.next_poll(pairs) == 50
+
+    def test_poll_after_expected_report_refetches(self):
+        """Test the capped cache doesn't serve a poll the report it already saw"""
+        clock = [0.0]
+        reports = iter(range(0, 10 * 600, 600))
+        fetched = []
+
+        def fetch(city, api_key):
+            fetched.append(city)
+            return make_weather(next(reports), 22)
+
+        max_age, max_stale = cache_limits(600, 3600, 60)
+        cache = WeatherCache(max_age, max_stale, fetch=fetch, clock=lambda: clock[0])
+        scheduler = PollScheduler(min_interval=60, clock=lambda: clock[0])
+        pairs = [("Brisbane", "Brisbane")]
+
+        for _ in range(3):
+            assert scheduler.observe("Brisbane", cache.get("Brisbane", "key"))
+            clock[0] = scheduler.schedule(pairs, ["Brisbane"])["Brisbane"]
+
+        assert fetched == ["Brisbane"] * 3
+        assert cache_limits(20, 40, 60) == (20, 30)
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,94 @@
+import pytest
+import sys
+import os
+import glob
+import pstats
+import signal
+import time
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiling import (
+    SamplingProfiler,
+    install_signal_toggle,
+    profiled,
+    stats_rollup,
+)
+from weather_api import MOCK_GOOD_WEATHER, is_sunny
+
+
+def busy(seconds):
+    """Spend some time in weather_api"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        is_sunny(MOCK_GOOD_WEATHER)
+
+
+class TestProfiling:
+    """Tests for the profiling module"""
+
+    def test_sampling_profiler(self):
+        """Test collapsed stacks and module rollup from samples"""
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        busy(0.2)
+        profiler.stop()
+
+        assert profiler.samples > 0
+        lines = profiler.collapsed()
+        assert any("test_profiling:busy;weather_api:is_sunny" in line for line in lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        assert int(count) > 0
+
+        rollup = profiler.rollup()
+        assert rollup["weather_api"]["total"] > 0
+        assert set(rollup) == {
+            "weather_api",
+            "message_constructor",
+            "message_sender",
+            "config",
+            "other",
+        }
+
+    def test_profiled_cprofile(self, tmp_path):
+        """Test that cProfile runs write pstats and a rollup"""
+        with profiled("cprofile", str(tmp_path)):
+            busy(0.05)
+
+        (pstats_path,) = glob.glob(str(tmp_path / "*.pstats"))
+        (rollup_path,) = glob.glob(str(tmp_path / "*.rollup.txt"))
+        with open(rollup_path) as f:
+            assert f.read().startswith("weather_api: self ")
+
+        rollup = stats_rollup(pstats.Stats(pstats_path))
+        assert rollup["weather_api"]["calls"] > 0
+
+    def test_profiled_sampling(self, tmp_path):
+        """Test that sampling runs write collapsed stacks"""
+        with profiled("sampling", str(tmp_path)):
+            busy(0.05)
+        assert glob.glob(str(tmp_path / "*.folded"))
+        assert glob.glob(str(tmp_path / "*.rollup.txt"))
+
+    @pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="needs SIGUSR1")
+    def test_signal_toggle(self, tmp_path):
+        """Test profiling a running process on a signal"""
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            assert install_signal_toggle(str(tmp_path), 60)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            busy(0.05)
+            # A second signal stops early and writes the profile
+            os.kill(os.getpid(), signal.SIGUSR1)
+            for _ in range(100):
+                if glob.glob(str(tmp_path / "*.folded")):
+                    break
+                time.sleep(0.01)
+            assert glob.glob(str(tmp_path / "*.folded"))
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,174 @@
+import pytest
+import sys
+import os
+import json
+from unittest.mock import patch
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import weather_api
+from config import DEFAULT_CONFIG
+from providers import (
+    FallbackProvider,
+    FileProvider,
+    MockProvider,
+    Observation,
+    OpenWeatherMapProvider,
+    WeatherProvider,
+    build_provider,
+    rank_providers,
+)
+from weather_api import MOCK_GOOD_WEATHER, is_sunny, is_temperature_comfortable
+
+
+class StaticProvider(WeatherProvider):
+    """Provider serving fixed observations and counting calls"""
+
+    def __init__(self, name, known, batch_size=1, cost_per_call=0.0, latency=0.5):
+        self.name = name
+        self.known = known
+        self.batch_size = batch_size
+        self.cost_per_call = cost_per_call
+        self.latency = latency
+        self.batches = []
+
+    def fetch(self, city):
+        return self.fetch_batch([city]).get(city)
+
+    def fetch_batch(self, cities):
+        self.batches.append(list(cities))
+        return {
+            city: Observation.from_weather_data(city, MOCK_GOOD_WEATHER)
+            for city in cities
+            if city in self.known
+        }
+
+
+class TestProviders:
+    """Tests for the providers module"""
+
+    def test_observation_round_trip(self):
+        """Test normalizing to an observation and back"""
+        observation = Observation.from_weather_data("Brisbane", MOCK_GOOD_WEATHER)
+        assert observation.condition == "Clear"
+        assert observation.temp == 23.5
+
+        weather_data = observation.to_weather_data()
+        assert is_sunny(weather_data)
+        assert is_temperature_comfortable(weather_data, 18, 26)
+        assert Observation.from_weather_data("Brisbane", weather_data) == observation
+
+        assert Observation.from_weather_data("Brisbane", None) is None
+        assert Observation.from_weather_data("Brisbane", {"weather": []}) is None
+
+    def test_fetch_many_batches(self):
+        """Test that fetch_many groups cities into batch_size calls"""
+        provider = StaticProvider("static", {"A", "B", "C"}, batch_size=2)
+        observations = provider.fetch_many(["A", "B", "C", "D"])
+        assert provider.batches == [["A", "B"], ["C", "D"]]
+        assert list(observations) == ["A", "B", "C", "D"]
+        assert observations["D"] is None
+
+    def test_fallback_chain(self):
+        """Test that later providers only get the missing cities"""
+        first = StaticProvider("first", {"A"})
+        second = StaticProvider("second", {"B"})
+        observations = FallbackProvider([first, second]).fetch_many(["A", "B", "C"])
+        assert second.batches == [["B"], ["C"]]
+        assert observations["A"].city == "A"
+        assert observations["B"].city == "B"
+        assert observations["C"] is None
+
+    def test_rank_providers(self):
+        """Test routing to the cheapest, then fastest, provider"""
+        paid = StaticProvider("paid", set(), batch_size=50, cost_per_call=0.01)
+        slow = StaticProvider("slow", set(), latency=1.0)
+        fast = StaticProvider("fast", set(), batch_size=10, latency=1.0)
+        assert rank_providers([paid, slow, fast], 30) == [fast, slow, paid]
+
+        chain = FallbackProvider([paid, slow, fast], route=True)
+        chain.fetch_many(["A"])
+        assert fast.batches == [["A"]]
+
+    def test_file_provider(self, tmp_path):
+        """Test observations served from a JSON file"""
+        path = tmp_path / "observations.json"
+        path.write_text(json.dumps({"Brisbane": MOCK_GOOD_WEATHER}))
+        provider = FileProvider(str(path))
+        observations = provider.fetch_many(["brisbane", "Sydney"])
+        assert observations["brisbane"].temp == 23.5
+        assert observations["Sydney"] is None
+
+        assert FileProvider(str(tmp_path / "missing.json")).fetch("Brisbane") is None
+
+    @patch("providers.get_weather")
+    @patch("providers.fetch_json")
+    def test_openweathermap_group(self, mock_fetch_json, mock_get_weather):
+        """Test that gazetteer cities are fetched with one /group call"""
+        sydney = dict(MOCK_GOOD_WEATHER, id=2147714, name="Sydney")
+        mock_fetch_json.return_value = {"cnt": 1, "list": [sydney]}
+        mock_get_weather.return_value = MOCK_GOOD_WEATHER
+
+        provider = OpenWeatherMapProvider("fake_api_key")
+        observations = provider.fetch_many(["Sydney", "Perth", "Nowhere"])
+
+        url = mock_fetch_json.call_args[0][0]
+        assert "/group?id=2147714,2063523&" in url
+        assert observations["Sydney"].city == "Sydney"
+        # Perth was missing from the response and Nowhere has no id
+        fetched = [call.args[0] for call in mock_get_weather.call_args_list]
+        assert fetched == ["Perth", "Nowhere"]
+
+    @patch("providers.get_weather")
+    @patch("providers.fetch_json")
+    def test_openweathermap_group_uses_cache(
+        self, mock_fetch_json, mock_get_weather, monkeypatch
+    ):
+        """Test that fresh cached cities are not fetched again"""
+        cache = weather_api.WeatherCache(max_age=600)
+        cache.put("Sydney", dict(MOCK_GOOD_WEATHER, name="Sydney"))
+        monkeypatch.setattr(weather_api, "weather_cache", cache)
+        melbourne = dict(MOCK_GOOD_WEATHER, id=2158177, name="Melbourne")
+        perth = dict(MOCK_GOOD_WEATHER, id=2063523, name="Perth")
+        mock_fetch_json.return_value = {"cnt": 2, "list": [melbourne, perth]}
+
+        provider = OpenWeatherMapProvider("fake_api_key")
+        observations = provider.fetch_many(["Sydney", "Melbourne", "Perth"])
+
+        url = mock_fetch_json.call_args[0][0]
+        assert "/group?id=2158177,2063523&" in url
+        assert all(observations[city] for city in ["Sydney", "Melbourne", "Perth"])
+        assert cache.peek("Perth") == perth
+        mock_get_weather.assert_not_called()
+
+        # Everything is cached now: no call at all
+        mock_fetch_json.reset_mock()
+        assert all(provider.fetch_many(["Sydney", "Melbourne", "Perth"]).values())
+        mock_fetch_json.assert_not_called()
+
+    def test_provider_requires_fetch(self):
+        """Test that providers must implement fetch"""
+
+        class Incomplete(WeatherProvider):
+            pass
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_build_provider(self):
+        """Test building providers from configuration"""
+        config = {key: dict(value) for key, value in DEFAULT_CONFIG.items()}
+        assert isinstance(build_provider(config, "key", "weather"), MockProvider)
+        assert isinstance(build_provider(config, "key"), OpenWeatherMapProvider)
+
+        config["providers"]["order"] = ["openweathermap", "file"]
+        chain = build_provider(config, "key")
+        assert [provider.name for provider in chain.providers] == [
+            "openweathermap",
+            "file",
+        ]
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,123 @@
+import pytest
+import sys
+import os
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from regional import compare_region, get_region, normalize_station
+from weather_api import is_rainy, is_sunny, is_temperature_comfortable
+
+
+def make_station(name, main, temp, condition_id=800):
+    """Build a /find result entry"""
+    return {
+        "id": abs(hash(name)) % 10**7,
+        "name": name,
+        "coord": {"lat": -27.5, "lon": 153.0},
+        "main": {"temp": temp, "feels_like": temp, "humidity": 60},
+        "dt": 1622181341,
+        "wind": {"speed": 2.1, "deg": 90},
+        "sys": {"country": "AU"},
+        "rain": None,
+        "snow": None,
+        "clouds": {"all": 0},
+        "weather": [{"id": condition_id, "main": main, "description": main.lower()}],
+    }
+
+
+STATIONS = [
+    make_station("Brisbane", "Clear", 23.0),
+    make_station("Ipswich", "Rain", 22.0, 501),
+    make_station("Gold Coast", "Clear", 31.0),
+    make_station("Sunshine Coast", "Rain", 12.0, 501),
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves /find like OpenWeatherMap and records the queries"""
+
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        StubHandler.requests.append((url.path, query))
+        if not url.path.endswith("/find"):
+            self.send_error(404)
+            return
+        count = int(query["cnt"][0])
+        body = json.dumps(
+            {"message": "accurate", "cod": "200", "list": STATIONS[:count]}
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    """Run a local OpenWeatherMap stub and point weather_api at it"""
+    StubHandler.requests = []
+    server = HTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_port}/data/2.5"
+    with patch("weather_api.base_url", base_url):
+        yield StubHandler.requests
+    server.shutdown()
+    server.server_close()
+
+
+class TestRegional:
+    """Tests for the regional module"""
+
+    def test_get_region_single_request(self, stub_server):
+        """Test that a whole region is fetched with one request"""
+        region = get_region(-27.47, 153.03, 4, "fake_api_key")
+        assert list(region) == ["Brisbane", "Ipswich", "Gold Coast", "Sunshine Coast"]
+        assert len(stub_server) == 1
+
+        path, query = stub_server[0]
+        assert path == "/data/2.5/find"
+        assert query["lat"] == ["-27.47"]
+        assert query["cnt"] == ["4"]
+        assert query["appid"] == ["fake_api_key"]
+
+    def test_get_region_error(self):
+        """Test that a failed request gives an empty region"""
+        with patch("regional.find_url", return_value="http://127.0.0.1:1/find"):
+            assert get_region(-27.47, 153.03, 4, "fake_api_key") == {}
+
+    def test_normalize_station(self):
+        """Test that /find results work with the weather checks"""
+        weather_data = normalize_station(STATIONS[1])
+        assert "rain" not in weather_data
+        assert is_rainy(weather_data)
+        assert not is_sunny(weather_data)
+        assert is_temperature_comfortable(weather_data, 18, 26)
+
+    def test_compare_region(self):
+        """Test one-vs-many comparison"""
+        region = {station["name"]: normalize_station(station) for station in STATIONS}
+        our_weather = region.pop("Brisbane")
+        assert compare_region(our_weather, region, 18, 26) == {
+            "Ipswich": "weather",
+            "Gold Coast": "temperature",
+            "Sunshine Coast": "both",
+        }
+        assert compare_region(None, region, 18, 26) == dict.fromkeys(region)
+        assert compare_region(our_weather, {}, 18, 26) == {}
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
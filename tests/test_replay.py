@@ -0,0 +1,107 @@
+import json
+import pytest
+import sys
+import os
+from unittest.mock import MagicMock, patch
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import weather_api
+from replay import Recorder, Replayer, read_records, request_key
+from weather_api import MOCK_BAD_WEATHER, MOCK_GOOD_WEATHER, fetch_json
+from tests.conftest import FakeClock
+
+URL = "https://api.example/data/2.5/weather?id=1&appid=secret&units=metric"
+
+
+class TestReplay:
+    """Tests for the replay module"""
+
+    def test_request_key_drops_api_key(self):
+        """Test that recordings don't depend on (or store) the API key"""
+        assert "secret" not in request_key(URL)
+        assert request_key(URL) == request_key(URL.replace("secret", "other"))
+
+    def test_round_trip(self, tmp_path):
+        """Test that records are read back in order"""
+        path = str(tmp_path / "capture.log")
+        recorder = Recorder(path, clock=FakeClock(100.0))
+        recorder.record(URL, MOCK_GOOD_WEATHER)
+        recorder.record(URL, None)
+        recorder.close()
+
+        # Appending to an existing log keeps one header
+        recorder = Recorder(path, clock=FakeClock(101.0))
+        recorder.record(URL, MOCK_BAD_WEATHER)
+        recorder.close()
+
+        records = read_records(path)
+        assert [record["body"] for record in records] == [
+            MOCK_GOOD_WEATHER,
+            None,
+            MOCK_BAD_WEATHER,
+        ]
+        assert records[2]["t"] == 101.0
+
+    def test_truncated_log(self, tmp_path):
+        """Test that a partially written record ends the log"""
+        path = str(tmp_path / "capture.log")
+        recorder = Recorder(path)
+        recorder.record(URL, MOCK_GOOD_WEATHER)
+        recorder.record(URL, MOCK_BAD_WEATHER)
+        recorder.close()
+        with open(path, "rb+") as f:
+            f.truncate(os.path.getsize(path) - 5)
+
+        assert len(read_records(path)) == 1
+
+    def test_not_a_replay_log(self, tmp_path):
+        """Test that other files are rejected"""
+        path = tmp_path / "other.log"
+        path.write_bytes(b"hello")
+        with pytest.raises(ValueError):
+            read_records(str(path))
+
+    def test_replay_order_and_timing(self, tmp_path):
+        """Test responses are served in order at the requested speed"""
+        path = str(tmp_path / "capture.log")
+        clock = FakeClock(1000.0)
+        recorder = Recorder(path, clock=clock)
+        recorder.record(URL, MOCK_GOOD_WEATHER)
+        clock.now += 10
+        recorder.record(URL, MOCK_BAD_WEATHER)
+        recorder.close()
+
+        replay_clock = FakeClock(50.0)
+        replayer = Replayer(path, speed=2.0, clock=replay_clock)
+        assert replayer.take(URL) == (0.0, MOCK_GOOD_WEATHER)
+        replay_clock.now += 1
+        assert replayer.take(URL) == (4.0, MOCK_BAD_WEATHER)
+        # The last response is repeated once they run out
+        assert replayer.take(URL)[1] == MOCK_BAD_WEATHER
+        assert replayer.take(URL.replace("id=1", "id=2")) == (0.0, None)
+
+        assert Replayer(path, speed=0).take(URL) == (0.0, MOCK_GOOD_WEATHER)
+
+    @patch("weather_api.requests.get")
+    def test_fetch_json_record_and_replay(self, mock_get, tmp_path):
+        """Test that fetch_json captures responses and serves them back"""
+        path = str(tmp_path / "capture.log")
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.content = json.dumps(MOCK_GOOD_WEATHER).encode()
+        mock_get.return_value = mock_response
+
+        with patch("weather_api.recorder", Recorder(path)):
+            assert fetch_json(URL, "weather") == MOCK_GOOD_WEATHER
+            weather_api.recorder.close()
+
+        mock_get.reset_mock()
+        with patch("weather_api.replayer", Replayer(path, speed=0)):
+            assert fetch_json(URL, "weather") == MOCK_GOOD_WEATHER
+        mock_get.assert_not_called()
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,119 @@
+import pytest
+import asyncio
+import sys
+import os
+from unittest.mock import patch
+
+from aiohttp.test_utils import TestClient, TestServer
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DEFAULT_CONFIG
+from metrics import metrics
+from server import ResponseCache, WeatherServer
+from weather_api import MOCK_GOOD_WEATHER, WeatherCache
+from tests.conftest import FakeClock
+
+
+def make_config():
+    """Build a configuration with its own message cache"""
+    return {key: dict(value) for key, value in DEFAULT_CONFIG.items()}
+
+
+async def request_all(app, paths):
+    """Start the app, GET every path concurrently and return (status, json)"""
+    async with TestClient(TestServer(app)) as client:
+
+        async def get(path):
+            response = await client.get(path)
+            return response.status, await response.json()
+
+        return await asyncio.gather(*(get(path) for path in paths))
+
+
+class TestServerApi:
+    """Tests for the server module"""
+
+    def test_compare(self):
+        """Test a comparison is answered with its rendered message"""
+        app = WeatherServer(make_config(), None, "both").build_app()
+        ((status, result),) = asyncio.run(
+            request_all(app, ["/compare?our=Brisbane&their=Melbourne"])
+        )
+
+        assert status == 200
+        assert result["reason"] == "both"
+        assert "Melbourne" in result["message"]
+        assert result["their"]["description"] == "moderate rain"
+
+    def test_errors(self):
+        """Test missing parameters and missing weather are reported"""
+        app = WeatherServer(make_config(), None, None).build_app()
+        missing, no_weather = asyncio.run(
+            request_all(app, ["/compare", "/observation/Brisbane"])
+        )
+
+        assert missing[0] == 400
+        assert no_weather == (502, {"error": "No weather data for Brisbane"})
+
+    def test_coalesces_and_caches(self):
+        """Test concurrent identical requests share one fetch"""
+        fetches = []
+
+        async def fake_fetch(session, city, api_key=None, mock_type=None):
+            fetches.append(city)
+            await asyncio.sleep(0.01)
+            return MOCK_GOOD_WEATHER
+
+        app = WeatherServer(make_config(), "key").build_app()
+        metrics.reset()
+        with patch("server.get_weather_async", fake_fetch):
+            results = asyncio.run(
+                request_all(app, ["/observation/Brisbane"] * 5 + ["/metrics"])
+            )
+
+        assert fetches == ["Brisbane"]
+        assert all(result == results[0] for result in results[:5])
+        assert results[0][1]["temp"] == MOCK_GOOD_WEATHER["main"]["temp"]
+        counters = results[5][1]["counters"]
+        assert counters["server.observation.coalesced"] == 4
+
+    def test_uses_warm_weather_cache(self):
+        """Test fresh observations in the get_weather cache aren't refetched"""
+        cache = WeatherCache(max_age=600)
+        cache.put("Brisbane", MOCK_GOOD_WEATHER)
+
+        async def fail(*args):
+            raise AssertionError("fetched a cached city")
+
+        app = WeatherServer(make_config(), "key").build_app()
+        with patch("weather_api.weather_cache", cache), patch(
+            "server.get_weather_async", fail
+        ):
+            ((status, _),) = asyncio.run(request_all(app, ["/observation/Brisbane"]))
+        assert status == 200
+
+    def test_response_cache_expiry(self):
+        """Test responses are reused for their ttl only"""
+        clock = FakeClock()
+        cache = ResponseCache("test", ttl=60, clock=clock)
+        calls = []
+
+        async def produce():
+            calls.append(clock.now)
+            return 200, b"{}"
+
+        async def run():
+            await cache.get("key", produce)
+            clock.now = 59
+            await cache.get("key", produce)
+            clock.now = 60
+            await cache.get("key", produce)
+
+        asyncio.run(run())
+        assert calls == [0.0, 60]
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
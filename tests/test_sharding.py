@@ -0,0 +1,75 @@
+import pytest
+import sys
+import os
+import copy
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sharding
+from comparison import compare_weather
+from config import DEFAULT_CONFIG
+from sharding import evaluate_pairs_sharded, pack_observations
+from weather_api import MOCK_BAD_WEATHER, MOCK_GOOD_WEATHER
+
+
+def make_weather(base, temp):
+    """Copy mock weather data with a different temperature"""
+    weather_data = copy.deepcopy(base)
+    weather_data["main"]["temp"] = temp
+    return weather_data
+
+
+WEATHER = {
+    "Brisbane": make_weather(MOCK_GOOD_WEATHER, 23.5),
+    "Cairns": make_weather(MOCK_GOOD_WEATHER, 31.0),
+    "Melbourne": make_weather(MOCK_BAD_WEATHER, 12.0),
+    "Hobart": make_weather(MOCK_BAD_WEATHER, 21.0),
+    "Darwin": None,
+}
+CITIES = list(WEATHER)
+PAIRS = [(our, their) for our in CITIES for their in CITIES if our != their]
+
+
+class TestSharding:
+    """Tests for the sharding module"""
+
+    def test_reasons_match_comparison(self):
+        """Test sharded reasons agree with compare_weather"""
+        results = evaluate_pairs_sharded(WEATHER, PAIRS, DEFAULT_CONFIG, 2, seed=1)
+
+        assert [(r["our_city"], r["their_city"]) for r in results] == PAIRS
+        for result in results:
+            our, their = result["our_city"], result["their_city"]
+            if WEATHER[our] and WEATHER[their]:
+                expected = compare_weather(WEATHER[our], WEATHER[their], 18, 26)
+                assert result["reason"] == expected["reason"]
+            else:
+                assert result["reason"] is None
+
+            if result["reason"]:
+                assert our in result["message"] and their in result["message"]
+                assert result["subject"]
+            else:
+                assert result["message"] is None
+
+    def test_deterministic_across_workers(self, monkeypatch):
+        """Test the same seed renders the same messages on any worker count"""
+        monkeypatch.setattr(sharding, "SHARD_SIZE", 3)
+
+        first = evaluate_pairs_sharded(WEATHER, PAIRS, DEFAULT_CONFIG, 1, seed=42)
+        second = evaluate_pairs_sharded(WEATHER, PAIRS, DEFAULT_CONFIG, 3, seed=42)
+        assert first == second
+
+    def test_no_pairs(self):
+        """Test evaluating no pairs doesn't start a pool"""
+        assert evaluate_pairs_sharded(WEATHER, [], DEFAULT_CONFIG, 2) == []
+
+    def test_pack_observations(self):
+        """Test observations are packed with a shared description table"""
+        observations, descriptions = pack_observations(WEATHER, CITIES)
+
+        assert list(observations["valid"]) == [1, 1, 1, 1, 0]
+        assert descriptions == ["clear sky", "moderate rain"]
+        assert list(observations["description"][:4]) == [0, 0, 1, 1]
+        assert observations["temp"][1] == 31.0
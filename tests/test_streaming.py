@@ -0,0 +1,126 @@
+import pytest
+import io
+import json
+import sys
+import os
+from unittest.mock import patch
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from config import DEFAULT_CONFIG
+from streaming import read_pairs, stream_pairs
+from weather_api import MOCK_BAD_WEATHER, MOCK_GOOD_WEATHER
+
+
+def fetch(city):
+    """Good weather in Brisbane, bad weather elsewhere, none in Atlantis"""
+    if city == "Atlantis":
+        return None
+    return MOCK_GOOD_WEATHER if city == "Brisbane" else MOCK_BAD_WEATHER
+
+
+class TestStreaming:
+    """Tests for the streaming module"""
+
+    def test_read_pairs(self):
+        """Test pairs, single cities, comments and blank lines are parsed"""
+        lines = io.StringIO(
+            "Melbourne\n# comment\n\nSydney, Perth\nGold Coast\tHobart\n"
+        )
+        assert list(read_pairs(lines, "Brisbane")) == [
+            (1, "Brisbane", "Melbourne"),
+            (4, "Sydney", "Perth"),
+            (5, "Gold Coast", "Hobart"),
+        ]
+
+    def test_stream_pairs(self):
+        """Test one JSON result is written per pair"""
+        out = io.BytesIO()
+        pairs = read_pairs(["Melbourne", "Atlantis", "Sydney,Brisbane"], "Brisbane")
+        counts = stream_pairs(pairs, fetch, out, concurrency=2)
+
+        results = sorted(
+            (json.loads(line) for line in out.getvalue().splitlines()),
+            key=lambda result: result["line"],
+        )
+        assert counts == {"pairs": 3, "advantages": 1, "errors": 1}
+        assert results[0]["reason"] == "both"
+        assert results[0]["their"]["description"] == "moderate rain"
+        assert results[1]["error"] == "No weather data for Atlantis"
+        assert results[2]["reason"] is None
+
+    def test_bounded_read_ahead(self):
+        """Test input is only read a bounded distance ahead of the output"""
+        read = []
+
+        def lines():
+            for i in range(200):
+                read.append(i)
+                yield "Melbourne"
+
+        class Out(io.BytesIO):
+            lag = 0
+
+            def write(self, data):
+                written = self.getvalue().count(b"\n") + 1
+                Out.lag = max(Out.lag, len(read) - written)
+                return super().write(data)
+
+        out = Out()
+        counts = stream_pairs(read_pairs(lines(), "Brisbane"), fetch, out, 4)
+
+        assert counts["pairs"] == 200
+        assert Out.lag <= 8
+
+    def test_evaluation_error_is_a_result(self):
+        """Test a pair whose evaluation raises gets an error line"""
+        out = io.BytesIO()
+        pairs = read_pairs(["Melbourne", "Sydney"], "Brisbane")
+        with patch(
+            "streaming.compare_weather",
+            side_effect=[ValueError("bad"), {"reason": None}],
+        ):
+            counts = stream_pairs(pairs, fetch, out, concurrency=1)
+
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert counts["pairs"] == 2 and counts["errors"] == 1
+        assert results[0] == {
+            "line": 1,
+            "our_city": "Brisbane",
+            "their_city": "Melbourne",
+            "error": "Evaluation failed: bad",
+        }
+
+    def test_broken_pipe_stops_stream(self):
+        """Test a closed output stops reading and evaluating pairs"""
+        read = []
+
+        def lines():
+            for i in range(1000):
+                read.append(i)
+                yield "Melbourne"
+
+        class ClosedOut(io.BytesIO):
+            def write(self, data):
+                raise BrokenPipeError
+
+        with pytest.raises(BrokenPipeError):
+            stream_pairs(read_pairs(lines(), "Brisbane"), fetch, ClosedOut(), 4)
+        assert len(read) <= 8
+
+    def test_run_stream_exits_quietly_on_broken_pipe(self, tmp_path):
+        """Test --stream | head ends without a traceback"""
+        path = tmp_path / "pairs.txt"
+        path.write_text("Melbourne\n" * 100)
+        config = {key: dict(value) for key, value in DEFAULT_CONFIG.items()}
+        with patch("main.stream_pairs", side_effect=BrokenPipeError), patch(
+            "main.os.dup2"
+        ) as mock_dup2:
+            main.run_stream(str(path), config, None, "both")
+        assert mock_dup2.call_args.args[1] == sys.stdout.fileno()
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,194 @@
+import pytest
+import sys
+import os
+import calendar
+from unittest.mock import patch
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from config import DEFAULT_CONFIG
+from subscriptions import (
+    FanOut,
+    SubscriptionStore,
+    in_quiet_hours,
+    pair_topic,
+    region_topic,
+)
+
+BRISBANE_MELBOURNE = pair_topic("Brisbane", "Melbourne")
+BRISBANE_SYDNEY = pair_topic("Brisbane", "Sydney")
+
+# 2024-01-15 12:00 UTC
+NOON_UTC = calendar.timegm((2024, 1, 15, 12, 0, 0))
+
+
+@pytest.fixture
+def store():
+    store = SubscriptionStore(":memory:")
+    yield store
+    store.close()
+
+
+class TestSubscriptions:
+    """Tests for the subscriptions module"""
+
+    def test_topics(self):
+        """Test topics ignore the case of city names"""
+        assert pair_topic("Brisbane", "MELBOURNE") == "pair:brisbane|melbourne"
+        assert region_topic("Brisbane") == "region:brisbane"
+
+    def test_recipients_for_topics(self, store):
+        """Test only subscribers of the batch's topics are returned"""
+        both = store.add_recipient(
+            "both@example.com", topics=[BRISBANE_MELBOURNE, BRISBANE_SYDNEY]
+        )
+        store.add_recipient("other@example.com", topics=[region_topic("Perth")])
+        one = store.add_recipient(phone="+61400000000", topics=[BRISBANE_SYDNEY])
+
+        rows = [
+            row
+            for chunk in store.recipients_for([BRISBANE_MELBOURNE, BRISBANE_SYDNEY])
+            for row in chunk
+        ]
+
+        assert [(row[0], row[7]) for row in rows] == [
+            (both, [BRISBANE_MELBOURNE, BRISBANE_SYDNEY]),
+            (one, [BRISBANE_SYDNEY]),
+        ]
+
+        store.unsubscribe(both, BRISBANE_SYDNEY)
+        chunks = list(store.recipients_for([BRISBANE_SYDNEY]))
+        assert [row[0] for row in chunks[0]] == [one]
+
+    def test_streams_in_chunks(self, store):
+        """Test large audiences are streamed chunk by chunk"""
+        with store.db:
+            store.db.executemany(
+                "INSERT INTO recipients (id, email) VALUES (?, ?)",
+                ((i, f"user{i}@example.com") for i in range(1, 5001)),
+            )
+            store.db.executemany(
+                "INSERT INTO subscriptions (topic, recipient_id) VALUES (?, ?)",
+                ((BRISBANE_MELBOURNE, i) for i in range(1, 5001)),
+            )
+
+        sizes = [
+            len(chunk) for chunk in store.recipients_for([BRISBANE_MELBOURNE], 1000)
+        ]
+        assert sizes == [1000] * 5
+
+    def test_quiet_hours(self):
+        """Test quiet hours in the recipient's timezone, across midnight"""
+        # Noon UTC is 22:00 in Brisbane
+        assert in_quiet_hours(21 * 60, 7 * 60, "Australia/Brisbane", NOON_UTC)
+        assert not in_quiet_hours(21 * 60, 7 * 60, "UTC", NOON_UTC)
+        assert in_quiet_hours(11 * 60, 13 * 60, "UTC", NOON_UTC)
+        assert not in_quiet_hours(None, None, "UTC", NOON_UTC)
+
+    def test_fanout_groups_recipients(self, store):
+        """Test recipients are grouped by topics, channels and quiet hours"""
+        store.add_recipient("a@example.com", "+611", topics=[BRISBANE_MELBOURNE])
+        store.add_recipient(
+            "b@example.com", "+612", channels=["email"], topics=[BRISBANE_MELBOURNE]
+        )
+        store.add_recipient(
+            "c@example.com",
+            quiet_hours=("11:00", "13:00"),
+            topics=[BRISBANE_MELBOURNE],
+        )
+        store.add_recipient(
+            "d@example.com", topics=[BRISBANE_MELBOURNE, BRISBANE_SYDNEY]
+        )
+
+        fanout = FanOut(store)
+        fanout.add(BRISBANE_MELBOURNE, "Melbourne message", "Melbourne")
+        fanout.add(BRISBANE_SYDNEY, "Sydney message", "Sydney")
+        deliveries = list(fanout.deliveries(NOON_UTC, digest=True))
+
+        assert (
+            ["a@example.com", "b@example.com"],
+            ["+611"],
+            "Melbourne message",
+            "Melbourne",
+        ) in deliveries
+        digests = [d for d in deliveries if d[0] == ["d@example.com"]]
+        assert len(digests) == 1
+        assert digests[0][3] == "Weather digest: 2 wins"
+        assert not any("c@example.com" in d[0] for d in deliveries)
+        # Only c's advantage is left, held until its quiet hours end
+        assert len(fanout) == 1
+
+    def test_quiet_hours_hold_advantages(self, store):
+        """Test advantages held in quiet hours are sent once they end"""
+        store.add_recipient(
+            "c@example.com",
+            quiet_hours=("11:00", "13:00"),
+            topics=[BRISBANE_MELBOURNE, BRISBANE_SYDNEY],
+        )
+        store.add_recipient("d@example.com", topics=[BRISBANE_MELBOURNE])
+
+        fanout = FanOut(store)
+        fanout.add(BRISBANE_MELBOURNE, "Old Melbourne message", "Melbourne")
+        assert list(fanout.deliveries(NOON_UTC)) == [
+            (["d@example.com"], [], "Old Melbourne message", "Melbourne")
+        ]
+        assert len(fanout) == 1
+
+        # Still quiet: a newer advantage of the topic replaces the held one
+        fanout.add(BRISBANE_MELBOURNE, "Melbourne message", "Melbourne")
+        fanout.add(BRISBANE_SYDNEY, "Sydney message", "Sydney")
+        assert all(
+            d[0] == ["d@example.com"] for d in fanout.deliveries(NOON_UTC + 1800)
+        )
+        assert len(fanout) == 2
+
+        # Quiet hours are over: everything held goes out once
+        after_quiet = NOON_UTC + 2 * 3600
+        assert list(fanout.deliveries(after_quiet)) == [
+            (["c@example.com"], [], "Melbourne message", "Melbourne"),
+            (["c@example.com"], [], "Sydney message", "Sydney"),
+        ]
+        assert len(fanout) == 0
+        assert list(fanout.deliveries(after_quiet)) == []
+
+    def test_fresh_advantage_supersedes_held(self, store):
+        """Test a held advantage isn't sent next to a fresh one of its topic"""
+        store.add_recipient(
+            "c@example.com",
+            quiet_hours=("11:00", "13:00"),
+            topics=[BRISBANE_MELBOURNE],
+        )
+        fanout = FanOut(store)
+        fanout.add(BRISBANE_MELBOURNE, "Old Melbourne message", "Melbourne")
+        assert list(fanout.deliveries(NOON_UTC)) == []
+
+        fanout.add(BRISBANE_MELBOURNE, "Melbourne message", "Melbourne")
+        assert list(fanout.deliveries(NOON_UTC + 2 * 3600)) == [
+            (["c@example.com"], [], "Melbourne message", "Melbourne")
+        ]
+        assert len(fanout) == 0
+
+    @patch("main.send_message")
+    def test_send_subscriptions(self, mock_send_message, tmp_path):
+        """Test queued advantages are delivered to their subscribers"""
+        config = {key: dict(value) for key, value in DEFAULT_CONFIG.items()}
+        config["subscriptions"].update(enabled=True, path=str(tmp_path / "subs.db"))
+        config["email"].update(enabled=True, password="secret")
+        mock_send_message.return_value = {"email": True}
+
+        fanout = main.subscription_fanout(config)
+        fanout.store.add_recipient("a@example.com", topics=[BRISBANE_MELBOURNE])
+        main.notify("Better in Brisbane", "Subject", config, BRISBANE_MELBOURNE)
+        main.notify("Better in Brisbane", "Subject", config, BRISBANE_SYDNEY)
+        main.send_subscriptions(config)
+
+        mock_send_message.assert_called_once()
+        sender_config = mock_send_message.call_args[0][1]
+        assert sender_config["email_config"]["receiver_email"] == ["a@example.com"]
+        fanout.store.close()
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
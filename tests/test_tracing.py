@@ -0,0 +1,119 @@
+import pytest
+import sys
+import os
+import asyncio
+import json
+from unittest.mock import MagicMock, patch
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tracing
+from message_sender import send_email
+from tracing import (
+    NOOP_SPAN,
+    STATUS_CODE_ERROR,
+    configure_tracing,
+    flush_traces,
+    span,
+    traced,
+)
+
+EMAIL_CONFIG = {
+    "smtp_server": "smtp.example.com",
+    "smtp_port": 587,
+    "sender_email": "from@example.com",
+    "receiver_email": ["a@example.com", "b@example.com"],
+    "password": "secret",
+}
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    """Trace to a temporary file for the duration of a test"""
+    path = str(tmp_path / "traces.jsonl")
+    configure_tracing(path)
+    yield path
+    configure_tracing(None)
+
+
+def read_spans(path):
+    """Read every exported span from an OTLP/JSON lines file"""
+    spans = []
+    with open(path) as f:
+        for line in f:
+            for resource_spans in json.loads(line)["resourceSpans"]:
+                for scope_spans in resource_spans["scopeSpans"]:
+                    spans.extend(scope_spans["spans"])
+    return spans
+
+
+class TestTracing:
+    """Tests for the tracing module"""
+
+    def test_disabled_by_default(self):
+        """Test that no spans are created while tracing is off"""
+        assert not tracing.tracer.enabled
+        assert span("anything") is NOOP_SPAN
+        assert flush_traces() == {}
+
+    def test_spans_exported(self, trace_file):
+        """Test parent/child spans and error status in the exported file"""
+        with span("run"):
+            with span("compare", our_city="Brisbane", count=2):
+                pass
+            with pytest.raises(ValueError):
+                with span("render"):
+                    raise ValueError("bad template")
+        breakdown = flush_traces()
+        assert set(breakdown) == {"run", "compare", "render"}
+        assert breakdown["compare"]["count"] == 1
+
+        spans = {s["name"]: s for s in read_spans(trace_file)}
+        run = spans["run"]
+        assert run["parentSpanId"] == ""
+        assert spans["compare"]["parentSpanId"] == run["spanId"]
+        assert spans["compare"]["traceId"] == run["traceId"]
+        assert {"key": "count", "value": {"intValue": "2"}} in spans["compare"][
+            "attributes"
+        ]
+        assert spans["render"]["status"]["code"] == STATUS_CODE_ERROR
+        assert int(run["endTimeUnixNano"]) >= int(run["startTimeUnixNano"])
+
+    def test_traced_decorator(self, trace_file):
+        """Test that decorated sync and async functions record arguments"""
+
+        @traced("fetch", "city")
+        def fetch(city, api_key=None):
+            return city
+
+        @traced("fetch_async", "city")
+        async def fetch_async(session, city):
+            return city
+
+        assert fetch("Brisbane", api_key="secret") == "Brisbane"
+        assert asyncio.run(fetch_async(None, city="Sydney")) == "Sydney"
+        flush_traces()
+
+        spans = read_spans(trace_file)
+        assert [s["name"] for s in spans] == ["fetch", "fetch_async"]
+        assert spans[0]["attributes"] == [
+            {"key": "city", "value": {"stringValue": "Brisbane"}}
+        ]
+
+    @patch("message_sender.smtplib.SMTP")
+    def test_smtp_phases(self, mock_smtp, trace_file):
+        """Test that each SMTP phase gets its own span"""
+        mock_smtp.return_value = MagicMock()
+        assert send_email("Hello", "Subject", EMAIL_CONFIG)
+        breakdown = flush_traces()
+
+        assert breakdown["send_email"]["count"] == 1
+        assert breakdown["smtp.connect"]["count"] == 1
+        assert breakdown["smtp.starttls"]["count"] == 1
+        assert breakdown["smtp.login"]["count"] == 1
+        assert breakdown["smtp.send"]["count"] == 2
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -1,20 +1,30 @@
 import pytest
+import asyncio
 from unittest.mock import patch, MagicMock
 import json
 import sys
 import os
 import requests
+import threading
 
 # Add parent directory to path to import modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import weather_api
+from metrics import metrics
 from weather_api import (
+    ConditionalCache,
+    RateLimiter,
+    WeatherCache,
     get_weather,
+    parse_retry_after,
+    prioritize_cities,
     is_sunny,
     is_rainy,
     is_temperature_comfortable,
     get_temperature,
 )
+from tests.conftest import FakeClock
 
 # Sample weather data for testing
 SAMPLE_SUNNY_DATA = {
@@ -42,7 +52,7 @@ class TestWeatherAPI:
         # Setup mock
         mock_response = MagicMock()
         mock_response.raise_for_status.return_value = None
-        mock_response.json.return_value = SAMPLE_SUNNY_DATA
+        mock_response.content = json.dumps(SAMPLE_SUNNY_DATA).encode()
         mock_get.return_value = mock_response
 
         # Call function
@@ -51,9 +61,19 @@ class TestWeatherAPI:
         # Assertions
         assert result == SAMPLE_SUNNY_DATA
         mock_get.assert_called_once()
-        assert "Brisbane" in mock_get.call_args[0][0]
+        # Brisbane is in the gazetteer, so it is requested by id
+        assert "id=2174003" in mock_get.call_args[0][0]
         assert "fake_api_key" in mock_get.call_args[0][0]
 
+    def test_location_query(self):
+        """Test that cities are requested by id, coordinates or name"""
+        assert weather_api.location_query("Brisbane") == "id=2174003"
+        assert weather_api.location_query("gold coast").startswith("lat=-28.0167&")
+        assert weather_api.location_query("Nowhere") == "q=Nowhere,au"
+
+        with patch("weather_api.country_code", "nz"):
+            assert weather_api.location_query("Brisbane") == "q=Brisbane,nz"
+
     @patch("weather_api.requests.get")
     def test_get_weather_api_error(self, mock_get):
         """Test API error handling"""
@@ -142,3 +162,232 @@ class TestWeatherAPI:
         assert get_temperature({}) is None
         assert get_temperature({"main": {}}) is None
 
+
+class TestRateLimiter:
+    """Tests for the OpenWeatherMap rate limiter"""
+
+    def test_calls_are_spaced_under_quota(self):
+        """Test calls are spread evenly and never exceed the quota per minute"""
+        clock = FakeClock()
+        limiter = RateLimiter(60, clock=clock, sleep=clock.sleep)
+
+        call_times = []
+        for _ in range(120):
+            limiter.acquire()
+            call_times.append(clock.now)
+
+        assert call_times[:3] == [0.0, 1.0, 2.0]
+        for start in call_times:
+            in_window = [t for t in call_times if start <= t < start + 60]
+            assert len(in_window) <= 60
+
+    def test_throttled_honours_retry_after(self):
+        """Test a 429 pauses until Retry-After and halves the rate"""
+        clock = FakeClock()
+        limiter = RateLimiter(60, clock=clock, sleep=clock.sleep)
+        limiter.acquire()
+
+        limiter.throttled(retry_after=30)
+        assert limiter.rate == 0.5
+        limiter.acquire()
+        assert clock.now == 30.0
+
+        # Successful calls recover the rate, but never above the quota
+        for _ in range(100):
+            limiter.succeeded()
+        assert limiter.rate == 1.0
+
+    def test_parse_retry_after(self):
+        """Test Retry-After parsing"""
+        assert parse_retry_after("12") == 12.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("soon") is None
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+    def test_prioritize_cities(self):
+        """Test cities in the most pairs are fetched first"""
+        pairs = [("Brisbane", "Melbourne"), ("Sydney", "Perth"), ("Brisbane", "Perth")]
+        assert prioritize_cities(pairs) == ["Brisbane", "Perth", "Melbourne", "Sydney"]
+
+    @patch("weather_api.requests.get")
+    def test_get_weather_retries_after_429(self, mock_get):
+        """Test a rate limited fetch is retried through the limiter"""
+        limited = MagicMock(status_code=429, headers={"Retry-After": "0"})
+        ok = MagicMock(status_code=200)
+        ok.content = json.dumps(SAMPLE_SUNNY_DATA).encode()
+        mock_get.side_effect = [limited, ok]
+
+        clock = FakeClock()
+        with patch.object(
+            weather_api,
+            "rate_limiter",
+            RateLimiter(60, clock=clock, sleep=clock.sleep),
+        ):
+            result = get_weather("Brisbane", "fake_api_key")
+
+        assert result == SAMPLE_SUNNY_DATA
+        assert mock_get.call_count == 2
+
+
+class TestWeatherCache:
+    """Tests for single-flight fetching and stale-while-revalidate"""
+
+    def test_fresh_entries_are_reused(self):
+        """Test a fresh observation is served without fetching again"""
+        clock = FakeClock()
+        fetch = MagicMock(return_value=SAMPLE_SUNNY_DATA)
+        cache = WeatherCache(max_age=600, max_stale=3600, fetch=fetch, clock=clock)
+
+        assert cache.get("Brisbane", "key") == SAMPLE_SUNNY_DATA
+        clock.now = 599
+        assert cache.get("Brisbane", "key") == SAMPLE_SUNNY_DATA
+        fetch.assert_called_once_with("Brisbane", "key")
+
+    def test_concurrent_callers_share_one_fetch(self):
+        """Test concurrent callers for a city are coalesced into one request"""
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_fetch(city, api_key):
+            calls.append(city)
+            started.set()
+            release.wait(5)
+            return SAMPLE_SUNNY_DATA
+
+        cache = WeatherCache(fetch=slow_fetch)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get("Perth", "key")))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert calls == ["Perth"]
+        assert results == [SAMPLE_SUNNY_DATA] * 5
+
+    def test_stale_served_while_revalidating(self):
+        """Test stale data is returned immediately while a refresh runs"""
+        clock = FakeClock()
+        fetch = MagicMock(side_effect=[SAMPLE_SUNNY_DATA, SAMPLE_RAINY_DATA])
+        cache = WeatherCache(max_age=600, max_stale=3600, fetch=fetch, clock=clock)
+        cache.get("Brisbane", "key")
+
+        clock.now = 1000
+        assert cache.get("Brisbane", "key") == SAMPLE_SUNNY_DATA
+
+        # Wait for the background refresh to publish the new observation
+        for thread in threading.enumerate():
+            if thread.name.startswith("weather-refresh-"):
+                thread.join(5)
+        assert cache.get("Brisbane", "key") == SAMPLE_RAINY_DATA
+        assert fetch.call_count == 2
+
+    def test_failure_keeps_stale_within_bound(self):
+        """Test failed refreshes keep serving stale data until max_stale"""
+        clock = FakeClock()
+        fetch = MagicMock(side_effect=[SAMPLE_SUNNY_DATA, None, None])
+        cache = WeatherCache(max_age=600, max_stale=3600, fetch=fetch, clock=clock)
+        cache.get("Brisbane", "key")
+
+        clock.now = 1000
+        assert cache.get("Brisbane", "key") == SAMPLE_SUNNY_DATA
+        for thread in threading.enumerate():
+            if thread.name.startswith("weather-refresh-"):
+                thread.join(5)
+
+        # Past max_stale the fetch is awaited and its failure is reported
+        clock.now = 4000
+        assert cache.get("Brisbane", "key") is None
+
+    def test_async_callers_share_the_inflight_fetch(self):
+        """Test async callers wait for the same fetch as the sync callers"""
+        calls = []
+
+        async def fetch(city):
+            calls.append(city)
+            await asyncio.sleep(0.01)
+            return SAMPLE_SUNNY_DATA
+
+        async def get_all():
+            return await asyncio.gather(
+                *(cache.get_async("Perth", fetch) for _ in range(5))
+            )
+
+        cache = WeatherCache()
+        assert asyncio.run(get_all()) == [SAMPLE_SUNNY_DATA] * 5
+        assert calls == ["Perth"]
+
+    def test_async_failure_falls_back_to_stale(self):
+        """Test a failed async refetch serves the last observation until max_stale"""
+        clock = FakeClock()
+        cache = WeatherCache(max_age=600, max_stale=3600, clock=clock)
+        cache.put("Brisbane", SAMPLE_SUNNY_DATA)
+
+        async def fail(city):
+            return None
+
+        clock.now = 1000
+        assert asyncio.run(cache.get_async("Brisbane", fail)) == SAMPLE_SUNNY_DATA
+        clock.now = 4000
+        assert asyncio.run(cache.get_async("Brisbane", fail)) is None
+
+
+class TestConditionalRequests:
+    """Tests for conditional requests and skipping unchanged bodies"""
+
+    def make_response(self, status_code, body=b"", headers=None):
+        response = MagicMock(status_code=status_code, content=body)
+        response.headers = headers or {}
+        return response
+
+    @patch("weather_api.requests.get")
+    def test_not_modified_reuses_stored_body(self, mock_get):
+        """Test validators are sent back and a 304 isn't parsed"""
+        body = json.dumps(SAMPLE_SUNNY_DATA).encode()
+        mock_get.side_effect = [
+            self.make_response(200, body, {"ETag": '"v1"', "Content-Length": "40"}),
+            self.make_response(304),
+        ]
+        metrics.reset()
+
+        with patch.object(weather_api, "conditional_cache", ConditionalCache()):
+            first = get_weather("Brisbane", "fake_api_key")
+            with patch("weather_api.decode") as mock_decode:
+                second = get_weather("Brisbane", "fake_api_key")
+
+        assert first == second == SAMPLE_SUNNY_DATA
+        mock_decode.assert_not_called()
+        headers = mock_get.call_args_list[1].kwargs["headers"]
+        assert headers["If-None-Match"] == '"v1"'
+        assert "gzip" in headers["Accept-Encoding"]
+        # Brotli is in requirements.txt, so urllib3 advertises it
+        assert "br" in headers["Accept-Encoding"].split(",")
+        counters = metrics.snapshot()["counters"]
+        assert counters["http.requests"] == 2
+        assert counters["http.not_modified"] == 1
+        assert counters["http.bytes_received"] == 40
+
+    @patch("weather_api.requests.get")
+    def test_unchanged_body_is_not_parsed_again(self, mock_get):
+        """Test a repeated body without validators skips decoding"""
+        body = json.dumps(SAMPLE_SUNNY_DATA).encode()
+        changed = json.dumps(SAMPLE_RAINY_DATA).encode()
+        mock_get.side_effect = [
+            self.make_response(200, body),
+            self.make_response(200, body),
+            self.make_response(200, changed),
+        ]
+
+        with patch.object(weather_api, "conditional_cache", ConditionalCache()):
+            with patch("weather_api.decode", wraps=weather_api.decode) as mock_decode:
+                results = [get_weather("Brisbane", "fake_api_key") for _ in range(3)]
+
+        assert results == [SAMPLE_SUNNY_DATA, SAMPLE_SUNNY_DATA, SAMPLE_RAINY_DATA]
+        assert mock_decode.call_count == 2
+        assert "If-None-Match" not in mock_get.call_args_list[1].kwargs["headers"]
@@ -0,0 +1,304 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("weathermark.tracing")
+
+# OTLP enum values
+SPAN_KIND_INTERNAL = 1
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+# Span that new spans in this context are children of
+_current_span = contextvars.ContextVar("weathermark_span", default=None)
+
+
+def _attribute_value(value):
+    """Encode an attribute value as an OTLP AnyValue"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes):
+    return [
+        {"key": key, "value": _attribute_value(value)}
+        for key, value in attributes.items()
+    ]
+
+
+class Span:
+    """A timed operation, started and ended as a context manager"""
+
+    __slots__ = (
+        "tracer",
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "attributes",
+        "start_ns",
+        "end_ns",
+        "error",
+        "token",
+    )
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else ""
+        self.attributes = attributes
+        self.start_ns = None
+        self.end_ns = None
+        self.error = None
+        self.token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self.token)
+        self.tracer.finish(self)
+        return False
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_otlp(self):
+        """Encode the span in the OTLP/JSON format"""
+        status = {"code": STATUS_CODE_OK}
+        if self.error:
+            status = {"code": STATUS_CODE_ERROR, "message": self.error}
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _attributes(self.attributes),
+            "status": status,
+        }
+
+
+class NoopSpan:
+    """Stands in for a span while tracing is off"""
+
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class NoopExporter:
+    """Drops every span; spans aren't even created while this is in use"""
+
+    def export(self, spans):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class JsonFileExporter:
+    """
+    Append spans to a file in the OTLP/JSON encoding
+
+    Each export is written as one line holding a complete
+    ExportTraceServiceRequest, the layout the OpenTelemetry collector's
+    file exporter and receiver use.
+    """
+
+    def __init__(self, path, service_name="weathermark"):
+        self.path = path
+        self.resource = {
+            "attributes": _attributes({"service.name": service_name}),
+        }
+
+    def export(self, spans):
+        if not spans:
+            return
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": self.resource,
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "weathermark"},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        try:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(request, separators=(",", ":")) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write traces to {self.path}: {e}")
+
+    def shutdown(self):
+        pass
+
+
+class Tracer:
+    """Creates spans and hands finished ones to an exporter"""
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter or NoopExporter()
+        self.enabled = not isinstance(self.exporter, NoopExporter)
+        self.finished = []
+        self.lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        """Start a span as a child of the current one"""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, _current_span.get(), attributes)
+
+    def finish(self, span):
+        with self.lock:
+            self.finished.append(span)
+
+    def flush(self):
+        """
+        Export every span finished since the last flush
+
+        Returns:
+            dict: Per span name breakdown (see phase_breakdown)
+        """
+        with self.lock:
+            spans, self.finished = self.finished, []
+        self.exporter.export(spans)
+        return phase_breakdown(spans)
+
+    def shutdown(self):
+        self.flush()
+        self.exporter.shutdown()
+
+
+def phase_breakdown(spans):
+    """
+    Summarize span latencies by name
+
+    Returns:
+        dict: Span name -> {"count", "total_ms", "max_ms"}, slowest total first
+    """
+    breakdown = {}
+    for span in spans:
+        phase = breakdown.setdefault(
+            span.name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+        )
+        phase["count"] += 1
+        phase["total_ms"] += span.duration_ms
+        phase["max_ms"] = max(phase["max_ms"], span.duration_ms)
+    return dict(
+        sorted(breakdown.items(), key=lambda item: item[1]["total_ms"], reverse=True)
+    )
+
+
+# Tracer used by span() and traced() (a no-op until configure_tracing)
+tracer = Tracer()
+
+
+def configure_tracing(path=None):
+    """
+    Export spans to an OTLP/JSON file, or turn tracing off
+
+    Args:
+        path: File to append traces to (None disables tracing)
+    """
+    global tracer
+    tracer.shutdown()
+    tracer = Tracer(JsonFileExporter(path) if path else None)
+
+
+def span(name, **attributes):
+    """Start a span with the current tracer"""
+    return tracer.span(name, **attributes)
+
+
+def traced(name, *arguments):
+    """
+    Decorator running each call of a function in a span
+
+    Args:
+        name: Span name
+        arguments: Names of function arguments to record as span attributes
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def start(args, kwargs):
+            if not arguments:
+                return tracer.span(name)
+            bound = signature.bind_partial(*args, **kwargs).arguments
+            return tracer.span(
+                name, **{key: bound[key] for key in arguments if key in bound}
+            )
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return await func(*args, **kwargs)
+                with start(args, kwargs):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with start(args, kwargs):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def flush_traces():
+    """Export the finished spans and log the per-phase latency breakdown"""
+    if not tracer.enabled:
+        return {}
+    breakdown = tracer.flush()
+    for name, phase in breakdown.items():
+        logger.info(
+            f"{name}: {phase['count']} x, {phase['total_ms']:.1f} ms total, "
+            f"{phase['max_ms']:.1f} ms max"
+        )
+    return breakdown
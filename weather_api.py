@@ -1,9 +1,25 @@
 import requests
+import asyncio
+import hashlib
 import json
 import logging
 import os
 import copy
+import functools
 import random
+import threading
+import time
+import aiohttp
+from collections import Counter
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+from urllib3.util.request import ACCEPT_ENCODING
+
+from decoding import decode, project_weather
+from gazetteer import load_gazetteer
+from metrics import increment, observe
+from replay import Recorder, Replayer, request_key
+from tracing import traced
 
 logger = logging.getLogger("weathermark.api")
 
@@ -104,6 +120,572 @@ MOCK_TEMP_BAD = {
 }
 
 
+# OpenWeatherMap API root
+API_BASE_URL = "https://api.openweathermap.org/data/2.5"
+
+# API root in use (see set_base_url)
+base_url = API_BASE_URL
+
+# Country used to resolve city names (see set_country)
+country_code = "au"
+
+# Capture of every API response (see start_recording)
+recorder = None
+
+# Captured responses served instead of the API (see start_replay)
+replayer = None
+
+# Validators and decoded bodies of earlier responses (see
+# enable_conditional_requests)
+conditional_cache = None
+
+# Number of times a fetch is retried after a 429 (Too Many Requests)
+RATE_LIMIT_RETRIES = 2
+
+
+class RateLimiter:
+    """
+    Leaky-bucket scheduler for OpenWeatherMap calls
+
+    Each call reserves the next free slot, so calls are spread evenly across
+    the minute and never exceed the quota in any 60 second window. The rate
+    is halved when the API answers 429 (honouring Retry-After) and recovers
+    additively on success.
+    """
+
+    def __init__(self, calls_per_minute=60, clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = calls_per_minute / 60.0
+        self.min_rate = self.max_rate / 16
+        self.rate = self.max_rate
+        self.next_slot = 0.0
+        self.blocked_until = 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Reserve the next free slot
+
+        Returns:
+            float: Seconds the caller must wait before making its call
+        """
+        with self.lock:
+            now = self.clock()
+            slot = max(now, self.next_slot, self.blocked_until)
+            self.next_slot = slot + 1.0 / self.rate
+        return slot - now
+
+    def acquire(self):
+        """
+        Block until this caller's slot comes up
+
+        Returns:
+            float: Seconds waited
+        """
+        wait = self.reserve()
+        if wait > 0:
+            logger.debug(f"Rate limiter waiting {wait:.2f}s")
+            self.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        """Wait for this caller's slot without blocking the event loop"""
+        wait = self.reserve()
+        if wait > 0:
+            logger.debug(f"Rate limiter waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+        return wait
+
+    def throttled(self, retry_after=None):
+        """Back off after a 429 response"""
+        with self.lock:
+            now = self.clock()
+            self.rate = max(self.min_rate, self.rate / 2)
+            delay = retry_after if retry_after is not None else 1.0 / self.rate
+            self.blocked_until = max(self.blocked_until, now + delay)
+            self.next_slot = max(self.next_slot, self.blocked_until)
+        logger.warning(
+            f"Rate limited by OpenWeatherMap - pausing {delay:.0f}s, "
+            f"reducing to {self.rate * 60:.1f} calls/min"
+        )
+
+    def succeeded(self):
+        """Recover towards the quota after a successful call"""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+# Scheduler shared by every fetch (None means unlimited)
+rate_limiter = None
+
+
+def set_rate_limit(calls_per_minute):
+    """
+    Route every OpenWeatherMap call through a shared rate limiter
+
+    Args:
+        calls_per_minute: API quota (0 or None disables rate limiting)
+    """
+    global rate_limiter
+    rate_limiter = RateLimiter(calls_per_minute) if calls_per_minute else None
+
+
+def prioritize_cities(pairs):
+    """
+    Order cities so those referenced by the most pairs are fetched first
+
+    Args:
+        pairs: List of (our_city, their_city) tuples
+
+    Returns:
+        list: Unique city names, most referenced first (ties keep pair order)
+    """
+    counts = Counter(city for pair in pairs for city in pair)
+    cities = list(dict.fromkeys(city for pair in pairs for city in pair))
+    return sorted(cities, key=lambda city: -counts[city])
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def start_recording(path):
+    """Capture every API response to a replay log"""
+    global recorder
+    recorder = Recorder(path)
+
+
+def stop_recording():
+    """Close the replay log, if recording"""
+    global recorder
+    if recorder:
+        recorder.close()
+        recorder = None
+
+
+def start_replay(path, speed=1.0):
+    """
+    Serve API responses from a replay log instead of the network
+
+    Args:
+        path: Replay log written with start_recording
+        speed: Playback speed (1 = recorded timing, 0 = no delays)
+    """
+    global replayer
+    replayer = Replayer(path, speed)
+
+
+class ConditionalCache:
+    """
+    Validators and decoded bodies of earlier responses, per request
+
+    Requests carry If-None-Match / If-Modified-Since when the last response
+    had an ETag / Last-Modified, and a 304 serves the stored body without
+    downloading or parsing anything. For servers without validators, a body
+    identical to the last one (by hash) is not parsed again.
+    """
+
+    def __init__(self):
+        self.entries = {}  # request key -> entry dict
+        self.lock = threading.Lock()
+
+    def request_headers(self, url):
+        """
+        Return the headers for a (possibly conditional) request
+
+        Accept-Encoding is urllib3's, which includes br when brotli is
+        installed (it's in requirements.txt).
+        """
+        headers = {"Accept-Encoding": ACCEPT_ENCODING}
+        with self.lock:
+            entry = self.entries.get(request_key(url))
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def not_modified(self, url):
+        """
+        Return the stored body for a 304 response
+
+        Returns:
+            dict: Decoded body, or None if nothing was stored
+        """
+        with self.lock:
+            entry = self.entries.get(request_key(url))
+        if entry is None:
+            logger.warning(f"Got 304 without a stored response for {url}")
+            return None
+        increment("http.not_modified")
+        return entry["data"]
+
+    def decode(self, url, headers, body, project=None):
+        """
+        Decode a response body unless it matches the stored one
+
+        Args:
+            url: Requested URL
+            headers: Response headers
+            body: Raw (already decompressed) response body
+            project: Projection passed on to decoding.decode
+
+        Returns:
+            Decoded (and projected) body
+        """
+        key = request_key(url)
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry["digest"] == digest and entry["project"] is project:
+            increment("http.unchanged_bodies")
+            data = entry["data"]
+        else:
+            data = timed_decode(body, project)
+
+        with self.lock:
+            self.entries[key] = {
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "digest": digest,
+                "project": project,
+                "data": data,
+            }
+        return data
+
+
+def enable_conditional_requests():
+    """Send conditional, compressed requests and skip parsing unchanged bodies"""
+    global conditional_cache
+    conditional_cache = ConditionalCache()
+
+
+def wire_bytes(headers, body):
+    """Bytes transferred for a body: Content-Length if sent (compressed size)"""
+    try:
+        return int(headers.get("Content-Length"))
+    except (TypeError, ValueError):
+        return len(body)
+
+
+def timed_decode(body, project=None):
+    """Decode a body, recording the CPU time spent parsing it"""
+    started = time.process_time()
+    data = decode(body, project)
+    observe("http.decode_cpu_seconds", time.process_time() - started)
+    return data
+
+
+def decode_response(url, status, headers, body, project=None):
+    """
+    Turn a successful response into data, recording transfer metrics
+
+    Args:
+        url: Requested URL
+        status: HTTP status code
+        headers: Response headers
+        body: Raw response body (empty for a 304)
+        project: Projection passed on to decoding.decode
+
+    Returns:
+        Decoded (and projected) body, or None for a 304 with nothing stored
+    """
+    increment("http.requests")
+    if status == 304 and conditional_cache:
+        return conditional_cache.not_modified(url)
+    increment("http.bytes_received", wire_bytes(headers, body))
+    if conditional_cache:
+        return conditional_cache.decode(url, headers, body, project)
+    return timed_decode(body, project)
+
+
+def api_url(endpoint, api_key, query):
+    """Build an OpenWeatherMap API URL with metric units"""
+    return f"{base_url}/{endpoint}?{query}&appid={api_key}&units=metric"
+
+
+def set_base_url(url):
+    """Send API requests to another server, such as a local stub"""
+    global base_url
+    base_url = (url or API_BASE_URL).rstrip("/")
+
+
+def set_country(country):
+    """Set the ISO country code used to resolve city names"""
+    global country_code
+    country_code = country.lower()
+
+
+def location_query(city):
+    """
+    Build the query selecting a city
+
+    Cities in the gazetteer are requested by OpenWeatherMap id, or by
+    coordinates when the id isn't known, so the API doesn't have to resolve
+    the name. Anything else falls back to a name query.
+
+    Returns:
+        str: Query string for the city
+    """
+    entry = load_gazetteer().lookup(city, country_code)
+    if entry is None:
+        return f"q={city},{country_code}"
+    if entry["id"] is not None:
+        return f"id={entry['id']}"
+    return f"lat={entry['lat']}&lon={entry['lon']}"
+
+
+def weather_url(city, api_key):
+    """Build the current weather URL for a city"""
+    return api_url("weather", api_key, location_query(city))
+
+
+@traced("http.get", "description")
+def fetch_json(url, description, project=None):
+    """
+    GET an OpenWeatherMap endpoint and decode the JSON response
+
+    Every call passes through the shared rate limiter, and 429 responses
+    are retried once the limiter allows it. Responses are captured when
+    recording and served from the log when replaying.
+
+    Args:
+        url: Full API URL
+        description: What is being fetched, for log messages
+        project: Function keeping only the needed fields of the decoded
+                 response, e.g. decoding.project_weather (optional)
+
+    Returns:
+        dict: Decoded response, or None on error
+    """
+    if replayer:
+        wait, data = replayer.take(url)
+        time.sleep(wait)
+        return data
+
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        if rate_limiter:
+            rate_limiter.acquire()
+
+        try:
+            headers = (
+                conditional_cache.request_headers(url) if conditional_cache else None
+            )
+            response = requests.get(url, headers=headers)
+            if response.status_code == 429 and rate_limiter:
+                rate_limiter.throttled(
+                    parse_retry_after(response.headers.get("Retry-After"))
+                )
+                if attempt < RATE_LIMIT_RETRIES:
+                    continue
+            response.raise_for_status()  # Raise exception for HTTP errors
+            data = decode_response(
+                url, response.status_code, response.headers, response.content, project
+            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"API response for {description}: {json.dumps(data, indent=2)}"
+                )
+            if rate_limiter:
+                rate_limiter.succeeded()
+            if recorder:
+                recorder.record(url, data)
+            return data
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Error fetching {description}: {e}")
+            if recorder:
+                recorder.record(url, None)
+            return None
+
+
+def fetch_weather(city, api_key):
+    """
+    Fetch current weather for a city from OpenWeatherMap
+
+    Returns:
+        dict: Weather data, or None on error
+    """
+    return fetch_json(
+        weather_url(city, api_key), f"weather data for {city}", project_weather
+    )
+
+
+class WeatherCache:
+    """
+    Shared observation cache with single-flight fetches
+
+    Only one fetch per city is ever in flight; concurrent callers wait for
+    its result instead of issuing their own request. Observations older
+    than max_age are served stale (up to max_stale) while a background
+    refresh runs, so an upstream failure doesn't lose the comparison.
+    """
+
+    def __init__(self, max_age=600, max_stale=3600, fetch=None, clock=time.time):
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.fetch = fetch
+        self.clock = clock
+        self.entries = {}  # city -> (weather_data, fetched_at)
+        self.inflight = {}  # city -> Future for the running fetch
+        self.lock = threading.Lock()
+
+    def get(self, city, api_key):
+        """
+        Get weather data for a city, fetching it only when needed
+
+        Returns:
+            dict: Weather data, or None if nothing usable is available
+        """
+        with self.lock:
+            entry = self.entries.get(city)
+            age = self.clock() - entry[1] if entry else None
+            if entry and age < self.max_age:
+                return entry[0]
+
+            future = self.inflight.get(city)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[city] = future
+
+        # Serve the last good observation while a refresh runs
+        if entry and age < self.max_stale:
+            if leader:
+                threading.Thread(
+                    target=self.refresh,
+                    args=(city, api_key, future),
+                    name=f"weather-refresh-{city}",
+                    daemon=True,
+                ).start()
+            logger.info(f"Serving cached observation for {city} ({age:.0f}s old)")
+            return entry[0]
+
+        if leader:
+            self.refresh(city, api_key, future)
+        else:
+            logger.debug(f"Waiting for in-flight fetch of {city}")
+        return future.result()
+
+    async def get_async(self, city, fetch):
+        """
+        Async equivalent of get, sharing its in-flight fetches
+
+        Concurrent callers (sync or async) wait for the one fetch of a city
+        already running. There is no background refresh: an observation
+        older than max_age is fetched again, and only served stale if that
+        fetch fails.
+
+        Args:
+            city: The city to get weather for
+            fetch: Coroutine function fetching the weather data of a city
+
+        Returns:
+            dict: Weather data, or None if nothing usable is available
+        """
+        with self.lock:
+            entry = self.entries.get(city)
+            if entry and self.clock() - entry[1] < self.max_age:
+                return entry[0]
+
+            future = self.inflight.get(city)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[city] = future
+
+        if leader:
+            weather_data = None
+            try:
+                weather_data = await fetch(city)
+            finally:
+                self.publish(city, weather_data, future)
+        else:
+            logger.debug(f"Waiting for in-flight fetch of {city}")
+            weather_data = await asyncio.wrap_future(future)
+        return weather_data or self.stale(city)
+
+    def stale(self, city):
+        """
+        Return the last observation of a city while it is within max_stale
+
+        Returns:
+            dict: Weather data, or None
+        """
+        with self.lock:
+            entry = self.entries.get(city)
+        if entry and self.clock() - entry[1] < self.max_stale:
+            logger.info(f"Serving cached observation for {city} (refresh failed)")
+            return entry[0]
+        return None
+
+    def peek(self, city):
+        """
+        Return the cached observation of a city if it is fresh
+
+        Returns:
+            dict: Weather data younger than max_age, or None
+        """
+        with self.lock:
+            entry = self.entries.get(city)
+        if entry and self.clock() - entry[1] < self.max_age:
+            return entry[0]
+        return None
+
+    def put(self, city, weather_data):
+        """Store an observation fetched outside the cache"""
+        if weather_data:
+            with self.lock:
+                self.entries[city] = (weather_data, self.clock())
+
+    def refresh(self, city, api_key, future):
+        """Fetch a city and publish the result to everyone waiting on it"""
+        fetch = self.fetch or fetch_weather
+        try:
+            weather_data = fetch(city, api_key)
+        except Exception as e:
+            logger.error(f"Error refreshing weather data for {city}: {e}")
+            weather_data = None
+        self.publish(city, weather_data, future)
+
+    def publish(self, city, weather_data, future):
+        """Store a fetched observation and wake everyone waiting on it"""
+        with self.lock:
+            if weather_data:
+                self.entries[city] = (weather_data, self.clock())
+            self.inflight.pop(city, None)
+        future.set_result(weather_data)
+
+
+# Cache shared by every get_weather call (None means always fetch)
+weather_cache = None
+
+
+def enable_cache(max_age, max_stale):
+    """
+    Cache observations across get_weather calls
+
+    Args:
+        max_age: Seconds an observation is served without refreshing
+        max_stale: Seconds an observation may still be served while a
+                   refresh runs or after the refresh failed
+    """
+    global weather_cache
+    weather_cache = WeatherCache(max_age, max_stale)
+
+
+@traced("get_weather", "city")
 def get_weather(city, api_key=None, mock_type=None):
     """
     Fetch weather data for a given city using OpenWeatherMap API
@@ -122,19 +704,9 @@ def get_weather(city, api_key=None, mock_type=None):
             logger.error("No API key provided")
             return None
 
-        url = f"https://api.openweathermap.org/data/2.5/weather?q={city},au&appid={api_key}&units=metric"
-
-        try:
-            response = requests.get(url)
-            response.raise_for_status()  # Raise exception for HTTP errors
-            weather_data = response.json()
-            logger.debug(
-                f"API response for {city}: {json.dumps(weather_data, indent=2)}"
-            )
-            return weather_data
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching weather data for {city}: {e}")
-            return None
+        if weather_cache:
+            return weather_cache.get(city, api_key)
+        return fetch_weather(city, api_key)
 
     # Create mock data based on city and mock type
     if city.lower() == "brisbane":
@@ -199,19 +771,95 @@ def get_weather(city, api_key=None, mock_type=None):
                 logger.error("No API key provided")
                 return None
 
-            url = f"https://api.openweathermap.org/data/2.5/weather?q={city},au&appid={api_key}&units=metric"
+            return fetch_weather(city, api_key)
 
-            try:
-                response = requests.get(url)
+
+async def fetch_weather_async(session, city, api_key):
+    """
+    Fetch current weather for a city without blocking the event loop
+
+    Uses the same rate limiter and 429 handling as fetch_weather.
+
+    Args:
+        session: aiohttp.ClientSession to make the request with
+        city: The city to get weather for
+        api_key: OpenWeatherMap API key
+
+    Returns:
+        dict: Weather data, or None on error
+    """
+    url = weather_url(city, api_key)
+
+    if replayer:
+        wait, weather_data = replayer.take(url)
+        await asyncio.sleep(wait)
+        return weather_data
+
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        if rate_limiter:
+            await rate_limiter.acquire_async()
+
+        try:
+            headers = (
+                conditional_cache.request_headers(url) if conditional_cache else None
+            )
+            async with session.get(url, headers=headers) as response:
+                if response.status == 429 and rate_limiter:
+                    rate_limiter.throttled(
+                        parse_retry_after(response.headers.get("Retry-After"))
+                    )
+                    if attempt < RATE_LIMIT_RETRIES:
+                        continue
                 response.raise_for_status()
-                weather_data = response.json()
+                weather_data = decode_response(
+                    url,
+                    response.status,
+                    response.headers,
+                    await response.read(),
+                    project_weather,
+                )
+            if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(
-                    f"API response for {city}: {json.dumps(weather_data, indent=2)}"
+                    f"API response for weather data for {city}: {json.dumps(weather_data)}"
                 )
-                return weather_data
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error fetching weather data for {city}: {e}")
-                return None
+            if rate_limiter:
+                rate_limiter.succeeded()
+            if recorder:
+                recorder.record(url, weather_data)
+            return weather_data
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"Error fetching weather data for {city}: {e}")
+            if recorder:
+                recorder.record(url, None)
+            return None
+
+
+@traced("get_weather", "city")
+async def get_weather_async(session, city, api_key=None, mock_type=None):
+    """
+    Async equivalent of get_weather
+
+    Mock data is generated exactly as in get_weather; real data goes
+    through the shared cache (see WeatherCache.get_async) and is fetched
+    with the given aiohttp session.
+
+    Returns:
+        dict: Weather data
+    """
+    if mock_type in ("weather", "temperature", "both"):
+        return get_weather(city, api_key, mock_type)
+    if mock_type:
+        logger.warning(f"Invalid mock type: {mock_type}, using real API")
+
+    if not api_key:
+        logger.error("No API key provided")
+        return None
+
+    if weather_cache:
+        return await weather_cache.get_async(
+            city, functools.partial(fetch_weather_async, session, api_key=api_key)
+        )
+    return await fetch_weather_async(session, city, api_key)
 
 
 def is_sunny(weather_data):
@@ -294,4 +942,3 @@ def get_temperature(weather_data):
         return None
 
     return weather_data["main"]["temp"]
-